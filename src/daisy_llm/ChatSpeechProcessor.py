@@ -1,22 +1,27 @@
 import time
 import re
 import string
-import pyttsx3
 import requests
 import logging
-import yaml
-import nltk.data
 import queue
 import time
 import queue
 import requests
 import threading
+import json
 import speech_recognition as sr
-from concurrent.futures import ThreadPoolExecutor
 
 from .SoundManager import SoundManager
 from .text import print_text, delete_last_lines
 from .LoadTts import LoadTts
+from .config_service import get_config_service
+from .tts_pipeline import TtsPipeline
+from .tts_prefetch import PrefetchController
+from .tts_cache import TtsCache, default_cache_directory
+from .speech_chunker import SpeechChunker
+from .sentence_segmenter import create_segmenter, load_punkt
+from .pcm import decode_audio
+from .local_tts import LocalTts
 
 
 
@@ -29,212 +34,162 @@ class ChatSpeechProcessor:
 
 		# Define global variables
 		self.tts_speed = 1.0
+		self.tts_parallelism = 1
 		self.tts = None
+		# Speaks TTS error feedback when the TTS module is the one failing, created when first needed
+		self.error_tts = None
+		self.error_tts_loaded = False
+		# Synthesis rates are learned across responses, so the prefetch controller outlives the pipelines
+		self.tts_prefetch = PrefetchController()
 
 		self.ml = ml
 		self.result_str = ""
 		self.new_result_str = ""
 		self.result_received = False
 		self.sounds = SoundManager()
-		self.engine = pyttsx3.init()
-		self.tokenizer = nltk.data.load('tokenizers/punkt/english.pickle')
 		self.elapsed_time = 0
 		self.timeout_seconds = 0
 
-		self.tts_queue = queue.Queue()  # create a queue to hold the tts_sounds
-		self.tts_queue_complete = [False]	# use a list to make response_complete mutable
-
 		self.threads = []  # keep track of all threads created
 
+		# TTS speed is kept up to date by the config service, so playback never reads the file
+		self.config = get_config_service()
+		self.config.subscribe(self.on_config_change)
+
+		# Synthesized audio is cached by text, TTS module and voice settings, and speed. Files go to
+		# the user's cache directory (~/.cache/daisy_llm/tts) unless TTS: cache_dir is set.
+		self.tts_cache = None
+		if self.config.get_bool("TTS", "cache", default=True):
+			self.tts_cache = TtsCache(
+				self.config.get_str("TTS", "cache_dir") or default_cache_directory(),
+				max_memory_bytes=int(self.config.get_float("TTS", "cache_memory_mb", default=32) * 1024 * 1024),
+				max_disk_bytes=int(self.config.get_float("TTS", "cache_disk_mb", default=512) * 1024 * 1024),
+			)
+
 		self.initialize_tts(self.ml)
 
+	def on_config_change(self, configs):
+		self.tts_speed = self.config.get_float("TTS", "speed", default=1.0)
+		# Number of sentences synthesized at the same time. Playback order is kept either way.
+		self.tts_parallelism = self.config.get_int("TTS", "parallelism", default=2)
+		# Seconds of audio synthesized ahead of playback, adapted to how fast synthesis is, and a memory bound
+		self.tts_prefetch.min_seconds = self.config.get_float("TTS", "prefetch", "min_seconds", default=1.0)
+		self.tts_prefetch.max_seconds = self.config.get_float("TTS", "prefetch", "max_seconds", default=10.0)
+		self.tts_prefetch.max_bytes = int(self.config.get_float("TTS", "prefetch", "memory_mb", default=8) * 1024 * 1024)
+
 
 	def initialize_tts(self, ml):
 		t = LoadTts(self, ml)
 		t.start()
 		#t.join()
 
+	def create_local_tts(self):
+		# The built-in offline TTS, set up from the LocalTts section in configs.yaml. None when no local engine works.
+		try:
+			return LocalTts(
+				backend=self.config.get_str("LocalTts", "backend", default="auto"),
+				voice=self.config.get_str("LocalTts", "voice"),
+				rate=self.config.get_int("LocalTts", "rate") or None,
+			)
+		except Exception as e:
+			logging.warning(f"Local TTS is not available: {e}")
+			return None
+
+	def create_error_audio(self, message):
+		# Audio for spoken error feedback. From the TTS cache (list the messages under TTS: prewarm) or
+		# the TTS module if it still answers, and otherwise from the local TTS. None if nothing can say it.
+		try:
+			return self.create_tts_audio(message)
+		except Exception as e:
+			logging.debug(f"The TTS module cannot speak the error: {e}")
+		if isinstance(self.tts, LocalTts):
+			return None
+		if not self.error_tts_loaded:
+			self.error_tts_loaded = True
+			self.error_tts = self.create_local_tts()
+		if self.error_tts is None:
+			return None
+		return self.error_tts.create_tts_audio(message)
+
 	def speak_tts(self, arguments_dict):
 		text = arguments_dict.get('text')
 		stop_event = arguments_dict.get('stop_event', None)
 		sound_stop_event = arguments_dict.get('sound_stop_event', None)
 
-		with open("configs.yaml", "r") as f:
-			configs = yaml.safe_load(f)
-			self.tts_speed = configs["TTS"]["speed"]
-
 		audio = self.create_tts_audio(text)
-		self.sounds.play_sound(audio, 1.0, stop_event, sound_stop_event, self.tts_speed)
+		self.sounds.play_sound(audio, 1.0, stop_event, sound_stop_event)
 
 	def create_tts_audio(self, text):
-		audio = self.tts.create_tts_audio(text)
-		return audio
-
-	def queue_and_tts_sentences(
-			self, 
-			tts, 
-			sentences, 
-			sentence_queue_canceled, 
-			sentence_queue_complete, 
-			stop_event, 
-			sound_stop_event=None
-			):
-
-		with ThreadPoolExecutor(max_workers=2) as executor:
-			arguments = {
-				'tts':tts, 
-				'sentences':sentences, 
-				'sentence_queue_complete':sentence_queue_complete, 
-				'sentence_queue_canceled':sentence_queue_canceled, 
-				'tts_queue_complete':self.tts_queue_complete,
-				'tts_queue':self.tts_queue,
-				'stop_event':stop_event, 
-			}
-			executor.submit(self.queue_tts_from_sentences, arguments)
-
-			arguments = {
-				'play_tts_queue':self.play_tts_queue, 
-				'tts_queue':self.tts_queue, 
-				'sentence_queue_complete':sentence_queue_complete, 
-				'sentence_queue_canceled':sentence_queue_canceled, 
-				'tts_queue_complete':self.tts_queue_complete,
-				'stop_event':stop_event,
-				'sound_stop_event':sound_stop_event, 
-			}
-			executor.submit(self.play_tts_queue, arguments)
-		return
-		  
-	def queue_tts_from_sentences(self, arguments_dict):
-		tts = arguments_dict['tts']
-		sentences = arguments_dict['sentences']
-		sentence_queue_canceled = arguments_dict.get('sentence_queue_canceled', [False])
-		sentence_queue_complete = arguments_dict.get('sentence_queue_complete', [False])
-		tts_queue_complete = arguments_dict['tts_queue_complete']
-		tts_queue = arguments_dict['tts_queue']
-		stop_event = arguments_dict['stop_event']
-
-		tts_queue_complete[0] = False
-		sentences_length = 1
-
-		def queue_tts_items(index):
-			queued_sentence = temp_sentences[index]
-			logging.info("Queued sentence: " + queued_sentence)
-
-			try:
-				tts_queue.put(self.create_tts_audio(queued_sentence))
-			except requests.exceptions.HTTPError as e:
-				self.tts("HTTP Error. Error creating TTS audio. Please check your TTS account.")
-				logging.error(f"HTTP Error: {e}")
-			except requests.exceptions.ConnectionError as e:
-				self.tts("Connection Error. Error creating TTS audio. Please check your TTS account.")
-				logging.error(f"Connection Error: {e}")
-
-
-		while not stop_event.is_set():
-			temp_sentences = sentences[0]
-			index = 0
-
-			if not sentences[0]:
-				continue
-
-			if len(temp_sentences) > sentences_length:
-				logging.debug("Sentences: " + str(sentences))
-				sentence_length_difference = len(temp_sentences) - sentences_length
-
-				sentences_length = len(temp_sentences)
-				
-
-
-				for i in range(sentence_length_difference):
-					if not sentence_queue_canceled[0]:
-						index = (sentence_length_difference-i+1) * -1
-						queue_tts_items(index)
-
-			elif sentence_queue_complete[0]:
-
-				#Play a single sentence response
-				if len(sentences[0]) == 1:
-					logging.info("Single sentence response")
-					queued_sentence = sentences[0][0]
-					logging.info("Queued sentence: "+queued_sentence)
-
-					try:
-						if not sentence_queue_canceled[0]:
-							tts_queue.put(self.create_tts_audio(queued_sentence))
-					except requests.exceptions.HTTPError as e:
-						self.tts("HTTP Error. Error creating TTS audio. Please check your TTS account.")
-						logging.error(f"HTTP Error: {e}")
-
-					tts_queue_complete[0] = True
-					logging.info("TTS queue complete: single sentence response")
-					return
-
-				#Play the very last sentence
-				elif len(sentences[0]) == len(temp_sentences):
-					if len(sentences[0][-1]) == len(temp_sentences[-1]):
-							logging.debug("last sentence...")
-
-							queue_tts_items(-1)
-
-							tts_queue_complete[0] = True
-							logging.info("TTS queue complete")
-							return
-
-				#All tts items used
-				if tts_queue.empty():
-					tts_queue_complete[0] = True
-					logging.info("TTS queue complete")
-					return
-
-			if sentence_queue_canceled[0] or stop_event.is_set():
-				tts_queue_complete[0] = True
-				while not tts_queue.empty(): #Empty out the TTS queue so no sounds linger
-					tts_queue.get()
-				logging.info("TTS queue canceled")
-				return
-			time.sleep(0.5) #Wait juuuust a bit to prevent sentence overlap
-				
+		speed = self.tts_speed
+		if self.tts_cache is None:
+			return self.synthesize_tts_audio(text, speed)
+		key = self.tts_cache.key(text, self.get_tts_voice(), speed)
+		return self.tts_cache.get_or_create(key, lambda: self.synthesize_tts_audio(text, speed))
+
+	def synthesize_tts_audio(self, text, speed):
+		# TTS speed is applied here, on a synthesis worker, and cached with the clip.
+		# The result is 16-bit WAV, so playback starts without decoding or stretching anything.
+		tts = self.tts
+		try:
+			audio = tts.create_tts_audio(text)
+		except RuntimeError:
+			if self.tts is tts:
+				raise
+			# LoadTts swapped the TTS module and closed this one as the call started, say it with the new one
+			audio = self.tts.create_tts_audio(text)
+		if speed == 1.0 or not isinstance(audio, bytes) or not audio:
+			return audio
+		return self.sounds.process_clip(decode_audio(audio), speed).to_wav()
+
+	def get_tts_voice(self):
+		# The TTS module plus its settings section in configs.yaml (voice, project, ...)
+		module_name = type(self.tts).__name__
+		settings = self.config.get(module_name, default={})
+		return module_name + ":" + json.dumps(settings, sort_keys=True, default=str)
+
+	def prewarm_tts_cache(self, phrases=None):
+		# Synthesize common phrases ahead of time, by default the TTS: prewarm list in configs.yaml
+		if self.tts_cache is None or self.tts is None:
+			return 0
+		if phrases is None:
+			phrases = self.config.get("TTS", "prewarm", default=[])
+		speed = self.tts_speed
+		return self.tts_cache.prewarm(phrases, self.get_tts_voice(), speed, lambda phrase: self.synthesize_tts_audio(phrase, speed))
+
+	def get_tts_cache_stats(self):
+		return self.tts_cache.stats() if self.tts_cache else None
+
+	def create_tts_pipeline(self, stop_event=None, sound_stop_event=None):
+		return TtsPipeline(
+			self,
+			stop_event,
+			sound_stop_event,
+			parallelism=self.tts_parallelism,
+			chunker=self.create_speech_chunker(),
+			prefetch=self.tts_prefetch,
+		)
+
+	def create_speech_chunker(self):
+		# TTS: chunking in configs.yaml. "sentence" waits for whole sentences, "clause" and "words"
+		# flush the start of a long sentence early and grow later chunks.
+		# TTS: chunking: segmenter is "punkt" (the cached NLTK model, the default, with the rules when
+		# it is not downloaded) or "rules" (faster, incremental).
+		return SpeechChunker(
+			policy=self.config.get_str("TTS", "chunking", "policy", default="sentence"),
+			segmenter=create_segmenter(
+				self.config.get_str("TTS", "chunking", "segmenter", default="punkt"),
+				self.config.get_str("TTS", "chunking", "language", default="english"),
+			),
+			min_words=self.config.get_int("TTS", "chunking", "min_words", default=4),
+			growth=self.config.get_float("TTS", "chunking", "growth", default=2.0),
+			max_words=self.config.get_int("TTS", "chunking", "max_words", default=40),
+		)
+
+	def queue_and_tts_sentences(self, pipeline):
+		# Sentences put on the pipeline are synthesized as soon as they are complete and played in order.
+		# Blocks until everything has been played, or the pipeline is canceled or stopped.
+		pipeline.run()
 
-
-
-	def play_tts_queue(self, arguments_dict):
-		tts_queue = arguments_dict['tts_queue']
-		sentence_queue_canceled = arguments_dict.get('sentence_queue_canceled', [False])
-		tts_queue_complete = arguments_dict['tts_queue_complete']
-		stop_event = arguments_dict['stop_event']
-		sound_stop_event = arguments_dict['sound_stop_event']
-		
-		tts = []
-
-		# Wait for tts to be generated
-		while tts_queue.empty() and not sentence_queue_canceled[0]:
-			time.sleep(0.01)
-
-		# Play tts
-		while not stop_event.is_set():
-			tts = None
-
-
-			if tts_queue.qsize():
-				tts = tts_queue.get(block=True, timeout=0.01)  # get tts from the queue
-
-				#Stop voice assistant "waiting" sound
-				if sound_stop_event:
-					sound_stop_event.set()
-			
-				if tts:
-					
-					# Define global variables
-					with open("configs.yaml", "r") as f:
-						configs = yaml.safe_load(f)
-						if "TTS" in configs:
-							if "speed" in configs["TTS"]:
-								self.tts_speed = configs["TTS"]["speed"]
-					self.sounds.play_sound(tts, 1.0, stop_event, None, self.tts_speed)
-			elif tts_queue_complete[0]:
-				logging.info("TTS play queue complete")
-				return
-			
 	def stt(self, stop_event, timeout=30):
 		# Create a recognizer object
 		recognizer = sr.Recognizer()
@@ -315,8 +270,8 @@ class ChatSpeechProcessor:
 		# Log a debug message with the input string
 		logging.debug(f'Tokenizing string: {text}')
 
-		# Split the string into sentences
-		sentences = nltk.sent_tokenize(text, language)
+		# Split the string into sentences, with the punkt model loaded once per language
+		sentences = load_punkt(language).tokenize(text)
 
 		# Log a debug message with the modified string
 		logging.debug(f'Tokenized sentences: {sentences}')
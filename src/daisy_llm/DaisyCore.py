@@ -1,4 +1,3 @@
-import os
 import importlib.util
 import logging
 import time
@@ -13,17 +12,13 @@ import pubsub as pub
 # from scipy.spatial.distance import cosine
 # from scipy.spatial.distance import euclidean
 
-from ruamel.yaml import YAML
-
 from typing_extensions import Self
 
-yaml = YAML()
-yaml.allow_duplicate_keys = True
-
 import daisy_llm.input_manager as im
 import daisy_llm.CommandHandlers as commh
 from .text import print_text
 from .context_handlers import ContextHandlers
+from .config_service import get_config_service
 
 class ModuleLoader:
     initialized = False
@@ -52,8 +47,8 @@ class ModuleLoader:
             self.enabled_modules: List[str] = []
 
             # Load enabled modules from config file
-            with open(self.configs_yaml, "r") as f:
-                self.configs = yaml.load(f)
+            self.config = get_config_service(self.configs_yaml)
+            self.configs = self.config.get_data()
 
     def close(self)-> None:
         self.stop_event.set()
@@ -77,11 +72,7 @@ class ModuleLoader:
                 self.passed_modules
             )  # Create a copy so that it does not get updated when appended to.
 
-            try:
-                with open(self.configs_yaml, "r") as f:
-                    self.configs = yaml.load(f)
-            except Exception as e:
-                logging.warning(f"Failed to load configs.yaml: {str(e)}")
+            self.configs = self.config.get_data()
 
             if "enabled_modules" in self.configs:
                 if self.configs["enabled_modules"]:
@@ -89,7 +80,7 @@ class ModuleLoader:
                     for enabled_module in self.configs["enabled_modules"]:
                         if (
                             enabled_module not in self.enabled_modules
-                        )-> None:  # Eliminates duplicates
+                        ):  # Eliminates duplicates
                             self.enabled_modules.append(enabled_module)
 
             # Set all modules as disabled and enable them as they are found
@@ -117,10 +108,10 @@ class ModuleLoader:
                         continue  # Skip this module and proceed with the next one
 
                     # Find all classes in the module, and extract their methods and initialization parameters.
-                    for name in dir(module)-> None:
+                    for name in dir(module):
                         if name == module.__name__.split(".")[-1]:
                             obj = getattr(module, name)
-                            if isinstance(obj, type)-> None:
+                            if isinstance(obj, type):
                                 module_hook = getattr(obj, "module_hook", "")
 
                                 if module_hook and module_name:
@@ -200,7 +191,7 @@ class ModuleLoader:
                                 isinstance(obj, type)
                                 and instance.__class__.__name__
                                 == module_name.split(".")[-1]
-                            )-> None:
+                            ):
                                 existing_instance = instance
                                 break
 
@@ -208,15 +199,15 @@ class ModuleLoader:
                     if existing_instance:
                         instance = existing_instance
                     else:
-                        for name in dir(module_class)-> None:
+                        for name in dir(module_class):
                             if name == module_class.__name__.split(".")[-1]:
-                                if isinstance(obj, type)-> None:
+                                if isinstance(obj, type):
                                     instance = obj(self)
                                     instance.ch = self.ch  # Add self.ch to the instance
                                     instance.ml = self  # Add self to the instance
                                 if hasattr(instance, "start") and callable(
                                     getattr(instance, "start")
-                                )-> None:
+                                ):
                                     instance.start()
 
                     # Add the updated instance to the updated_hook_instances
@@ -230,26 +221,25 @@ class ModuleLoader:
                 if (
                     hook not in updated_hook_instances
                     or instance not in updated_hook_instances[hook]
-                )-> None:
+                ):
                     if hasattr(instance, "close") and callable(
                         getattr(instance, "close")
-                    )-> None:
+                    ):
                         instance.close()
 
         # Replace existing object with the new one
         self.hook_instances = updated_hook_instances
 
     def update_configs_loop(self)-> None:
-        last_modified_time = 0
-        while True:
-            current_modified_time = os.path.getmtime("configs.yaml")
-            if current_modified_time > last_modified_time:
-                self.loaded = False
-                self.get_available_modules()
-
-                last_modified_time = current_modified_time
+        # The config service watches configs.yaml and calls back when it changes
+        self.get_available_modules()
+        self.config.subscribe(self.on_config_change, call_now=False)
+        self.stop_event.wait()
+        self.config.unsubscribe(self.on_config_change)
 
-            time.sleep(1)
+    def on_config_change(self, configs)-> None:
+        self.loaded = False
+        self.get_available_modules()
 
     def start_update_configs_loop_thread(self)-> None:
         self.update_configs_loop_thread = threading.Thread(
@@ -262,34 +252,22 @@ class ModuleLoader:
 
     def enable_module(self, module_name)-> None:
         logging.info("Enabling module: " + module_name)
-        with open(self.configs_yaml, "r") as f:
-            config = yaml.load(f)
-
-        if module_name not in config["enabled_modules"]:
-            config["enabled_modules"].append(module_name)
-            with open(self.configs_yaml, "w") as f:
-                yaml.dump(config, f)
+        if module_name not in self.config.get("enabled_modules", default=[]):
+            self.config.edit(lambda config: config["enabled_modules"].append(module_name))
 
             self.loaded = False
         else:
             logging.warning(module_name + " is already enabled.")
-        time.sleep(0.5)
         return self.get_available_modules()
 
     def disable_module(self, module_name)-> None:
         logging.info("Disabling module: " + module_name)
-        with open(self.configs_yaml, "r") as f:
-            config = yaml.load(f)
-
-        if module_name in config["enabled_modules"]:
-            config["enabled_modules"].remove(module_name)
-            with open(self.configs_yaml, "w") as f:
-                yaml.dump(config, f)
+        if module_name in self.config.get("enabled_modules", default=[]):
+            self.config.edit(lambda config: config["enabled_modules"].remove(module_name))
 
             self.loaded = False
         else:
             logging.warning(module_name + " is already disabled.")
-        time.sleep(0.5)
         return self.get_available_modules()
 
     def process_main_start_instances(self)-> None:
@@ -312,13 +290,13 @@ class ModuleLoader:
             # Main loop that watches for changes to hook_instances["Main_start"]
             while True:
                 logging.debug("Main_start: Checking for changes...")
-                if list(running_threads.keys())-> None:
+                if list(running_threads.keys()):
                     future_object = list(running_threads.values())[
                         0
                     ]  # get the Future object from the dictionary
                     if (
                         future_object.exception() is not None
-                    )-> None:  # check if the Future object has a raised exception
+                    ):  # check if the Future object has a raised exception
                         runtime_error = (
                             future_object.exception()
                         )  # get the raised exception from the Future object
@@ -330,11 +308,11 @@ class ModuleLoader:
                 # Check if any new hook instances have been added or removed
                 if "Main_start" in hook_instances:
                     for instance in hook_instances["Main_start"]:
-                        for module in self.get_available_modules()-> None:
+                        for module in self.get_available_modules():
                             if (
                                 module["class_name"] == instance.__module__
                                 and instance not in running_threads
-                            )-> None:
+                            ):
                                 if module["enabled"]:
                                     future = executor.submit(start_instance, instance)
                                     running_threads[instance] = future
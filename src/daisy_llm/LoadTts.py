@@ -11,6 +11,17 @@ class LoadTts(threading.Thread):
 
 
     def run(self):
+        # TTS: backend in configs.yaml. "hook" waits for a Tts module, "local" uses the built-in
+        # offline TTS, and "auto" speaks with the offline TTS until a Tts module is loaded.
+        backend = self.ext_instance.config.get_str("TTS", "backend", default="auto")
+        if backend in ("local", "auto"):
+            local_tts = self.ext_instance.create_local_tts()
+            if local_tts is not None:
+                logging.info("Using the local TTS backend: " + local_tts.backend)
+                self.ext_instance.tts = local_tts
+                if backend == "local":
+                    self.prewarm()
+                    return
 
         while "Tts" not in self.hook_instances:
             logging.info("Waiting for TTS hook...")
@@ -27,4 +38,17 @@ class LoadTts(threading.Thread):
         if len(self.hook_instances["Tts"]) > 1:
             logging.warning("Multiple TTS modules found. Only the first one will be used.: "+type(self.hook_instances["Tts"][0]).__name__)
 
-        self.ext_instance.tts = self.hook_instances["Tts"][0]
\ No newline at end of file
+        previous = self.ext_instance.tts
+        self.ext_instance.tts = self.hook_instances["Tts"][0]
+        if hasattr(previous, "close"):
+            # The local TTS that spoke until now. Swapped out first, so nothing new starts on it,
+            # and it shuts down once the sentences it is rendering are done.
+            previous.close()
+        self.prewarm()
+
+    def prewarm(self):
+        if hasattr(self.ext_instance, "prewarm_tts_cache"):
+            try:
+                self.ext_instance.prewarm_tts_cache()
+            except Exception as e:
+                logging.warning("Failed to pre-warm TTS cache: " + str(e))
\ No newline at end of file
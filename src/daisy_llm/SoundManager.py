@@ -1,108 +1,137 @@
-import os
-from io import BytesIO
 import logging
-import threading
-import pydub
-from pydub import AudioSegment
-from pydub.effects import speedup
-import simpleaudio
-import numpy as np
-import pkg_resources
-import time
+
+from .audio_output import get_audio_output
+from .cancellation import CancellationToken, on_cancel
+from .config_service import get_config_service
+from .dsp_worker import close_dsp_worker, get_dsp_worker, process_clip
+from .pcm import PcmClip, decode_audio
+from .sound_assets import get_sound_assets
+
+# Mixer channel of the bundled sounds. Other named sounds are alerts, and audio given as bytes is speech.
+SOUND_CHANNELS = {"alert": "alert", "beep": "alert", "end": "alert", "waiting": "background"}
+
 
 class SoundManager:
     description = "A class for managing sound files in a directory, playing sounds, and stopping playback."
     
     def __init__(self, directory='sounds'):
-        self.directory = pkg_resources.resource_filename(__name__, directory)
-        self.sounds = {}
+        # Sounds are shared by every SoundManager and decoded on first use, so creating one is cheap
+        self.sounds = get_sound_assets(directory)
+        self.directory = self.sounds.directory
         self.current_sound = None
         self.playback = None
 
-        # Load all sound files in the directory
-        for filename in os.listdir(self.directory):
-            if filename.endswith('.wav') or filename.endswith('.mp3'):
-                # Extract filename without extension
-                name = os.path.splitext(filename)[0]
-
-                # Load sound file and store in dictionary
-                path = os.path.join(self.directory, filename)
-                try:
-                    sound = pydub.AudioSegment.from_file(path)
-                    self.sounds[name] = sound
-                except pydub.exceptions.CouldntDecodeError:
-                    logging.warning(f"Failed to load sound file '{filename}'")
-
-
-    def play_sound(self, name_or_bytes, volume=1.0, stop_event=None, sound_stop_event=None, speed=1.0):
-        logging.debug("play_sound")
+        # Audio processing moves to a worker process when audio: dsp_worker is set in configs.yaml
+        self.dsp = None
+        self.config = get_config_service()
+        self.config.subscribe(self.on_config_change)
+
+    def on_config_change(self, configs):
+        # The worker process starts with the first clip, and is stopped when the setting is turned off
+        if self.config.get_bool("audio", "dsp_worker", default=False):
+            self.dsp = get_dsp_worker()
+        elif self.dsp is not None:
+            self.dsp = None
+            close_dsp_worker()
+
+    def load_clip(self, name_or_bytes):
+        if isinstance(name_or_bytes, PcmClip):
+            return name_or_bytes
         if isinstance(name_or_bytes, bytes):
-            sound = AudioSegment.from_file(BytesIO(name_or_bytes))
-        elif isinstance(name_or_bytes, str):
+            # 16-bit WAV is used in place, other formats are decoded by pydub
+            return decode_audio(name_or_bytes)
+        if isinstance(name_or_bytes, str):
             sound = self.sounds.get(name_or_bytes)
             if sound is None:
                 raise ValueError(f"No sound named {name_or_bytes}")
-        else:
-            raise TypeError(f"Unsupported argument type {type(name_or_bytes)}")
+            return sound
+        raise TypeError(f"Unsupported argument type {type(name_or_bytes)}")
+
+    def get_channel(self, name_or_bytes, channel=None):
+        if channel:
+            return channel
+        if isinstance(name_or_bytes, str):
+            return SOUND_CHANNELS.get(name_or_bytes, "alert")
+        return "tts"
+
+    def play_sound(self, name_or_bytes, volume=1.0, stop_event=None, sound_stop_event=None, speed=1.0, channel=None):
+        logging.debug("play_sound")
+        channel = self.get_channel(name_or_bytes, channel)
+        sound = self.load_clip(name_or_bytes)
 
         self.current_sound = sound
 
         if stop_event is None:
-            stop_event = threading.Event()
-
-        # adjust the playback speed of the sound
-        if speed != 1.0:
-            sound = speedup(sound, speed)
+            stop_event = CancellationToken()
 
-        # create a new thread to play the sound
-        self._play_sound_method(sound, volume, stop_event, sound_stop_event)
+        # Play the sound on the mixer and wait for it. TTS audio arrives already stretched, see ChatSpeechProcessor.
+        self._play_sound_method(sound, volume, stop_event, sound_stop_event, channel, speed)
 
         self.current_sound = None
         return True
     
 
-    def _play_sound_method(self, sound, volume=1.0, stop_event=None, sound_stop_event=None):
+    def queue_sound(self, name_or_bytes, volume=1.0, speed=1.0, channel=None, stop_events=()):
+        # Queues the sound on its mixer channel (alert, tts or background) and returns at once.
+        # Queuing the next clip while the current one plays leaves no gap between them. The output
+        # stops the sound within one period of any of stop_events being set.
+        channel = self.get_channel(name_or_bytes, channel)
+        sound = self.load_clip(name_or_bytes)
+        output = get_audio_output()
+        sound = self.process_clip(sound, speed, volume, output.channels, output.sample_rate)
+        stop_events = [event for event in stop_events if event is not None]
+        self.playback = output.play(sound.samples, sound.sample_rate, sound.channels, channel, stop_events)
+        return self.playback
+
+    def process_clip(self, sound, speed=1.0, volume=1.0, channels=None, sample_rate=None):
+        # Time-stretch, volume and conversion to another format, in the DSP worker when it is enabled.
+        # A clip that needs none of them is returned as is, its own buffer is played.
+        channels = channels or sound.channels
+        sample_rate = sample_rate or sound.sample_rate
+        if speed == 1.0 and volume == 1.0 and channels == sound.channels and sample_rate == sound.sample_rate:
+            return sound
+        if self.dsp is not None:
+            return self.dsp.process(sound, speed, volume, channels, sample_rate)
+        return process_clip(sound, speed, volume, channels, sample_rate)
+
+    def wait_sound(self, playback, stop_event=None, sound_stop_event=None):
+        # Blocks until the queued sound has played. Returns False if stop_event stopped it.
+        # A CancellationToken stop_event stops the playback from its callback, the moment it is set.
+        # Other stop events, and sound_stop_event, are checked once per output period.
+        period = playback.output.period
+        remove_callback = on_cancel(stop_event, playback.stop)
+        try:
+            while True:
+                if stop_event:
+                    if stop_event.is_set():
+                        # Stop the playback if the stop_event is set
+                        playback.stop()
+                        return False
+                if sound_stop_event:
+                    if sound_stop_event.is_set():
+                        # Stop the playback if the sound_stop_event is set
+                        playback.stop()
+                        return True
+
+                # Check if the playback has finished
+                if playback.wait(period):
+                    return not (stop_event and stop_event.is_set())
+        finally:
+            remove_callback()
+
+    def _play_sound_method(self, sound, volume=1.0, stop_event=None, sound_stop_event=None, channel="tts", speed=1.0):
         logging.debug("_play_sound_method")
-        # Adjust volume
-        scaled_volume = volume * 32767
-        sound_array = sound.get_array_of_samples()
-        scaled_array = np.round(scaled_volume * np.array(sound_array) / 32767).astype(np.int16)
-        sound = sound._spawn(scaled_array)
-
-        # Convert audio segment to raw audio data
-        raw_data = sound.raw_data
-
-        # Set audio parameters
-        num_channels = sound.channels
-        bytes_per_sample = sound.sample_width
-        sample_rate = sound.frame_rate
-
-        # Play audio using simpleaudio
-        self.playback = simpleaudio.play_buffer(raw_data, num_channels=num_channels, bytes_per_sample=bytes_per_sample, sample_rate=sample_rate)
-
-        # Loop until either stop_event or sound_stop_event is set
-        while True:
-            if stop_event:
-                if stop_event.is_set():
-                    # Stop the playback if the stop_event is set
-                    self.playback.stop()
-                    return False
-            if sound_stop_event:
-                if sound_stop_event.is_set():
-                    # Stop the playback if the sound_stop_event is set
-                    self.playback.stop()
-                    return True
-
-            # Check if the playback has finished
-            if not self.playback.is_playing():
-                return True
-            time.sleep(0.1)
+        playback = self.queue_sound(sound, volume, speed, channel)
+        return self.wait_sound(playback, stop_event, sound_stop_event)
 
 
 
     def play_sound_with_thread(self, name_or_bytes, volume=1.0, awake_stop_event=None, sound_stop_event=None):
+        # Despite the name no thread is started anymore: the sound is queued on the mixer, which
+        # also watches the stop events
         logging.debug("play_sound_with_thread")
-        thread = threading.Thread(target=self.play_sound, args=(name_or_bytes, volume, awake_stop_event, sound_stop_event))
-        thread.start()
+        playback = self.queue_sound(name_or_bytes, volume, stop_events=(awake_stop_event, sound_stop_event))
+        on_cancel(awake_stop_event, playback.stop)
+        return playback
 
 
@@ -1,12 +1,19 @@
 # Import the necessary modules and classes that define the package
 from .SoundManager import SoundManager
+from .pcm import PcmClip
+from .cancellation import CancellationToken
 from .ChatSpeechProcessor import ChatSpeechProcessor
 
 # from .ModuleLoader import ModuleLoader
 from .chat import Chat
 from .context_handlers import ContextHandlers
+from .config_service import ConfigService, get_config_service
+from .memory import MemoryStore
+from .message_store import MessageStore
+from .session_manager import SessionManager
 from .ConnectionStatus import ConnectionStatus
 from .LoadTts import LoadTts
+from .local_tts import LocalTts
 from .CommandHandlers import CommandHandlers
 from .DaisyCore import ModuleLoader as DaisyCore
 
@@ -20,11 +27,19 @@ __email__ = "daisy_llm_tools@myrakrusemark.com"
 __all__ = [
     "chat",
     "ContextHandlers",
+    "ConfigService",
+    "get_config_service",
+    "MemoryStore",
+    "MessageStore",
+    "SessionManager",
     "DaisyCore",
     "ChatSpeechProcessor",
     "SoundManager",
+    "PcmClip",
+    "CancellationToken",
     "ConnectionStatus",
     "LoadTts",
+    "LocalTts",
     "CommandHandlers",
     "__name__",
     "__version__",
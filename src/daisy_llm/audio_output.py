@@ -0,0 +1,348 @@
+# Class AudioOutput keeps one PyAudio output stream open and mixes prioritized channels of queued clips into it.
+import logging
+import threading
+import time
+
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Sequence, TypedDict
+
+import numpy as np
+import pyaudio
+from typing_extensions import Self
+
+from .pcm import convert_format
+
+
+class RingBuffer:
+    description = "A fixed size int16 ring buffer addressed by absolute sample positions"
+
+    # Not synchronized, AudioOutput holds its lock around every call
+
+    def __init__(self: Self, capacity: int) -> None:
+        self.data = np.zeros(capacity, np.int16)
+        self.capacity = capacity
+        self.read_total = 0  # Samples handed to the mixer so far
+        self.write_total = 0  # Samples written so far
+
+    def available(self: Self) -> int:
+        return self.write_total - self.read_total
+
+    def space(self: Self) -> int:
+        return self.capacity - self.available()
+
+    def write(self: Self, samples: np.ndarray) -> int:
+        # Copies as much as fits, returns how many samples that was
+        count = min(len(samples), self.space())
+        start = self.write_total % self.capacity
+        first = min(count, self.capacity - start)
+        self.data[start : start + first] = samples[:first]
+        self.data[: count - first] = samples[first:count]
+        self.write_total += count
+        return count
+
+    def read_into(self: Self, out: np.ndarray) -> int:
+        # Fills out, with silence after the buffered samples. Returns how many samples were buffered.
+        count = min(len(out), self.available())
+        start = self.read_total % self.capacity
+        first = min(count, self.capacity - start)
+        out[:first] = self.data[start : start + first]
+        out[first:count] = self.data[: count - first]
+        out[count:] = 0
+        self.read_total += count
+        return count
+
+    def truncate(self: Self, position: int) -> None:
+        # Drops whatever was written from position on and has not been read yet
+        self.write_total = max(self.read_total, min(self.write_total, position))
+
+
+class ChannelRules(TypedDict, total=False):
+    name: str
+    priority: int  # Higher priorities duck or pause lower ones while they play
+    volume: float
+    duck: float  # Gain while a higher priority channel is playing
+    pause: bool  # Hold position instead of playing ducked while a higher priority channel plays
+    preempt: bool  # A new clip stops the one playing on this channel instead of queuing behind it
+
+
+DEFAULT_CHANNELS: List[ChannelRules] = [
+    {"name": "alert", "priority": 2, "volume": 1.0, "duck": 1.0, "pause": False, "preempt": True},
+    {"name": "tts", "priority": 1, "volume": 1.0, "duck": 0.3, "pause": False, "preempt": False},
+    {"name": "background", "priority": 0, "volume": 0.6, "duck": 0.15, "pause": False, "preempt": True},
+]
+
+
+class PlaybackHandle:
+    description = "A clip queued on an AudioOutput channel, with the stop() and is_playing() of a simpleaudio PlayObject"
+
+    def __init__(
+        self: Self,
+        channel: "MixerChannel",
+        samples: np.ndarray,
+        stop_events: Sequence[threading.Event] = (),
+    ) -> None:
+        self.channel = channel
+        self.output = channel.output
+        self.samples = samples  # Already in the output format
+        self.stop_events = list(stop_events)
+        self.start: Optional[int] = None  # Ring position of the first sample, once writing began
+        self.written = 0
+        self.end: Optional[int] = None  # Ring position after the last sample, once all of it is written
+        self.stopped = False
+
+    def is_playing(self: Self) -> bool:
+        return self.output.is_playing(self)
+
+    def wait(self: Self, timeout: Optional[float] = None) -> bool:
+        # True once the clip has been played or stopped
+        return self.output.wait(self, timeout)
+
+    def stop(self: Self) -> None:
+        self.output.stop(self)
+
+
+class MixerChannel:
+    description = "One priority channel of the mixer: a queue of clips played back to back through a ring buffer"
+
+    def __init__(self: Self, output: "AudioOutput", rules: ChannelRules, capacity: int) -> None:
+        self.output = output
+        self.name = rules["name"]
+        self.priority = rules.get("priority", 0)
+        self.volume = rules.get("volume", 1.0)
+        self.duck = rules.get("duck", 1.0)
+        self.pause = rules.get("pause", False)
+        self.preempt = rules.get("preempt", False)
+        self.ring = RingBuffer(capacity)
+        self.handles: Deque[PlaybackHandle] = deque()  # Queued or playing, in play order
+        self.gain = self.volume  # Gain of the last block, the next block ramps from it
+        self.underruns = 0
+
+    def is_active(self: Self) -> bool:
+        return bool(self.handles)
+
+    def next_to_write(self: Self) -> Optional[PlaybackHandle]:
+        for handle in self.handles:
+            if handle.end is None:
+                return handle
+        return None
+
+
+class AudioOutput:
+    description = "A long-lived PyAudio output stream that mixes prioritized channels of queued clips"
+
+    # Clips are converted to the output format when queued, and a single writer thread copies them
+    # into their channel's ring buffer as space frees up. The PyAudio callback is the only reader:
+    # every period it takes one block from each channel, applies the channel's gain (ramped over
+    # the block, so ducking does not click), sums the blocks and clips the result to int16. The
+    # stream stays open and outputs silence when nothing is queued, so clips on a channel play
+    # without gaps. Stopping a clip truncates its channel's ring, so the next block is already
+    # silent for it. No thread is started per sound.
+
+    def __init__(
+        self: Self,
+        sample_rate: int = 48000,
+        channels: int = 2,
+        period_ms: float = 10.0,
+        buffer_ms: float = 250.0,
+        mixer_channels: Iterable[ChannelRules] = DEFAULT_CHANNELS,
+    ) -> None:
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.period_frames = max(1, int(sample_rate * period_ms / 1000))
+        self.period = self.period_frames / sample_rate
+        capacity = max(self.period_frames * 2, int(sample_rate * buffer_ms / 1000)) * channels
+        self.mixer_channels: Dict[str, MixerChannel] = {}
+        for rules in sorted(mixer_channels, key=lambda rules: -rules.get("priority", 0)):
+            self.mixer_channels[rules["name"]] = MixerChannel(self, rules, capacity)
+        self.condition = threading.Condition()
+        self.block = np.zeros(self.period_frames * channels, np.int16)
+
+        # Milliseconds from a stop to the callback that handed the device the first block without it
+        self.stop_requested_at: Optional[float] = None
+        self.stop_latencies_ms: List[float] = []
+
+        self.audio: Optional[pyaudio.PyAudio] = None
+        self.stream = None
+        self.writer: Optional[threading.Thread] = None
+        self.closed = False
+
+    @property
+    def underruns(self: Self) -> int:
+        return sum(channel.underruns for channel in self.mixer_channels.values())
+
+    def _open(self: Self) -> None:
+        # Caller holds the lock. The device is opened on first use.
+        if self.stream is not None:
+            return
+        self.audio = pyaudio.PyAudio()
+        self.stream = self.audio.open(
+            format=pyaudio.paInt16,
+            channels=self.channels,
+            rate=self.sample_rate,
+            output=True,
+            frames_per_buffer=self.period_frames,
+            stream_callback=self._callback,
+        )
+        self.writer = threading.Thread(target=self._write_loop, name="audio-writer")
+        self.writer.daemon = True
+        self.writer.start()
+        logging.info(f"Opened audio output: {self.sample_rate} Hz, {self.channels} channels, {self.period * 1000:.0f} ms period")
+
+    def _callback(self: Self, in_data, frame_count, time_info, status):
+        size = frame_count * self.channels
+        if len(self.block) != size:
+            self.block = np.zeros(size, np.int16)
+        mix = np.zeros(size, np.float32)
+        with self.condition:
+            self._stop_by_events()
+            higher_active = False
+            for channel in self.mixer_channels.values():  # Highest priority first
+                active = channel.is_active()
+                ducked = higher_active
+                higher_active = higher_active or active
+                if not active or (ducked and channel.pause):
+                    continue
+                count = channel.ring.read_into(self.block)
+                if count < size and channel.next_to_write() is not None:
+                    channel.underruns += 1
+                target = channel.volume * (channel.duck if ducked else 1.0)
+                if target == channel.gain == 1.0:
+                    mix += self.block
+                else:
+                    ramp = np.linspace(channel.gain, target, frame_count, dtype=np.float32)
+                    mix += (self.block.reshape(-1, self.channels) * ramp[:, None]).reshape(-1)
+                channel.gain = target
+                # Forget the clips that have been played
+                while channel.handles and channel.handles[0].end is not None and channel.handles[0].end <= channel.ring.read_total:
+                    channel.handles.popleft()
+            if self.stop_requested_at is not None:
+                self.stop_latencies_ms.append((time.perf_counter() - self.stop_requested_at) * 1000)
+                self.stop_requested_at = None
+            self.condition.notify_all()
+        np.clip(mix, -32768, 32767, out=mix)
+        return mix.astype(np.int16).tobytes(), pyaudio.paContinue
+
+    def _stop_by_events(self: Self) -> None:
+        # Caller holds the lock. Plain stop events are checked once per period, here, so that
+        # sounds played without a waiting thread still stop within one period.
+        for channel in self.mixer_channels.values():
+            for handle in list(channel.handles):
+                if any(event.is_set() for event in handle.stop_events):
+                    self._stop(handle)
+                    break
+
+    def _write_loop(self: Self) -> None:
+        with self.condition:
+            while not self.closed:
+                wrote = False
+                blocked = False
+                for channel in self.mixer_channels.values():
+                    handle = channel.next_to_write()
+                    if handle is None:
+                        continue
+                    if handle.start is None:
+                        handle.start = channel.ring.write_total
+                    count = channel.ring.write(handle.samples[handle.written :])
+                    handle.written += count
+                    wrote = wrote or count > 0
+                    if handle.written < len(handle.samples):
+                        blocked = True
+                        continue
+                    handle.end = handle.start + handle.written
+                if wrote:
+                    self.condition.notify_all()
+                if blocked or not wrote:
+                    self.condition.wait()  # Until the callback frees space, or something is queued
+
+    def play(
+        self: Self,
+        samples: np.ndarray,
+        sample_rate: int,
+        channels: int,
+        channel: str = "tts",
+        stop_events: Sequence[threading.Event] = (),
+    ) -> PlaybackHandle:
+        # Queues interleaved int16 samples on a mixer channel and returns at once. The clip plays
+        # after whatever is queued on that channel, or instead of it if the channel preempts.
+        mixer_channel = self.mixer_channels[channel]
+        samples = convert_format(samples, channels, sample_rate, self.channels, self.sample_rate)
+        handle = PlaybackHandle(mixer_channel, samples, stop_events)
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("Audio output is closed")
+            self._open()
+            if mixer_channel.preempt and mixer_channel.handles:
+                self._stop(mixer_channel.handles[0])
+            mixer_channel.handles.append(handle)
+            self.condition.notify_all()
+        return handle
+
+    def _is_playing(self: Self, handle: PlaybackHandle) -> bool:
+        if handle.stopped:
+            return False
+        if handle.end is None:
+            return True
+        return handle.channel.ring.read_total < handle.end
+
+    def is_playing(self: Self, handle: PlaybackHandle) -> bool:
+        with self.condition:
+            return self._is_playing(handle)
+
+    def wait(self: Self, handle: PlaybackHandle, timeout: Optional[float] = None) -> bool:
+        with self.condition:
+            return self.condition.wait_for(lambda: not self._is_playing(handle), timeout)
+
+    def _stop(self: Self, handle: PlaybackHandle) -> None:
+        # Caller holds the lock. Silences this clip and drops the clips queued after it on its channel.
+        channel = handle.channel
+        if handle not in channel.handles:
+            return  # Played or stopped already
+        if handle.start is not None:
+            channel.ring.truncate(handle.start)
+        while channel.handles[-1] is not handle:
+            channel.handles.pop().stopped = True
+        channel.handles.pop().stopped = True
+        self.stop_requested_at = time.perf_counter()
+        self.condition.notify_all()
+
+    def stop(self: Self, handle: PlaybackHandle) -> None:
+        with self.condition:
+            self._stop(handle)
+
+    def stop_channel(self: Self, channel: str) -> None:
+        with self.condition:
+            mixer_channel = self.mixer_channels[channel]
+            if mixer_channel.handles:
+                self._stop(mixer_channel.handles[0])
+
+    def stop_all(self: Self) -> None:
+        with self.condition:
+            for mixer_channel in self.mixer_channels.values():
+                if mixer_channel.handles:
+                    self._stop(mixer_channel.handles[0])
+
+    def close(self: Self) -> None:
+        self.stop_all()
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+            stream, audio = self.stream, self.audio
+            self.stream = self.audio = None
+        if stream is not None:
+            stream.stop_stream()
+            stream.close()
+        if audio is not None:
+            audio.terminate()
+
+
+output: Optional[AudioOutput] = None
+output_lock = threading.Lock()
+
+
+def get_audio_output() -> AudioOutput:
+    # The one output stream of the process, shared by every SoundManager
+    global output
+    with output_lock:
+        if output is None:
+            output = AudioOutput()
+        return output
@@ -0,0 +1,129 @@
+# Class CancellationToken is a stop event that also runs callbacks, so blocked work can be aborted the moment it is set.
+import logging
+import threading
+import time
+
+from concurrent.futures import Future, wait as futures_wait
+from typing import Any, Callable, List, Optional
+from typing_extensions import Self
+
+
+class CancellationToken(threading.Event):
+    description = "A threading.Event that runs registered callbacks when it is set"
+
+    # It can be passed anywhere a stop_event is expected. Pollers keep working, and work that
+    # blocks (audio playback, waiting on synthesis, waiting on a stream) registers a callback instead.
+
+    def __init__(self: Self) -> None:
+        super().__init__()
+        self.callbacks_lock = threading.Lock()
+        self.callbacks: List[Callable[[], Any]] = []
+        self.cancelled_at: Optional[float] = None  # time.perf_counter() when set
+
+    def set(self: Self) -> None:
+        with self.callbacks_lock:
+            if threading.Event.is_set(self):
+                return
+            self.cancelled_at = time.perf_counter()
+            super().set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logging.error(f"Error in cancellation callback: {e}")
+
+    cancel = set
+
+    def clear(self: Self) -> None:
+        with self.callbacks_lock:
+            super().clear()
+            self.cancelled_at = None
+
+    def on_cancel(self: Self, callback: Callable[[], Any]) -> Callable[[], None]:
+        # Runs callback once, when the token is set, or right away if it is set already.
+        # Returns a function that unregisters the callback.
+        with self.callbacks_lock:
+            if not threading.Event.is_set(self):
+                self.callbacks.append(callback)
+                return lambda: self.remove_callback(callback)
+        callback()
+        return lambda: None
+
+    def remove_callback(self: Self, callback: Callable[[], Any]) -> None:
+        with self.callbacks_lock:
+            if callback in self.callbacks:
+                self.callbacks.remove(callback)
+
+
+class LinkedToken(CancellationToken):
+    description = "A CancellationToken that follows another stop event, for callers that pass a plain one"
+
+    # The stop event is left as it is. It is read whenever this token is checked (is_set, wait),
+    # and the token is set then, which runs the callbacks. Nothing watches the stop event in
+    # between, so the callbacks of a linked token run when a poller notices, not the moment it is
+    # set: callers that want that pass a CancellationToken.
+
+    def __init__(self: Self, source: Any, poll_interval: float = 0.05) -> None:
+        super().__init__()
+        self.source = source  # Anything with is_set()
+        self.poll_interval = poll_interval
+
+    def is_set(self: Self) -> bool:
+        if not super().is_set() and self.source.is_set():
+            self.set()
+        return super().is_set()
+
+    def wait(self: Self, timeout: Optional[float] = None) -> bool:
+        # The stop event cannot wake this token, so it is checked every poll_interval
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.is_set():
+            wait = self.poll_interval if deadline is None else min(self.poll_interval, deadline - time.monotonic())
+            if wait <= 0:
+                return False
+            super().wait(wait)
+        return True
+
+    def on_cancel(self: Self, callback: Callable[[], Any]) -> Callable[[], None]:
+        self.is_set()  # Catch up with the stop event first
+        return super().on_cancel(callback)
+
+
+def as_token(event: Optional[Any] = None) -> CancellationToken:
+    # A token for any stop event: anything with is_set(), a threading.Event or a subclass. Tokens
+    # are returned as they are, None gets a new one, and anything else a LinkedToken that follows it.
+    # Callers that create stop events should create CancellationTokens, whose callbacks run at once.
+    if isinstance(event, CancellationToken):
+        return event
+    if event is None:
+        return CancellationToken()
+    return LinkedToken(event)
+
+
+def on_cancel(event: Optional[Any], callback: Callable[[], Any]) -> Callable[[], None]:
+    # CancellationToken.on_cancel for any stop event. Other stop events cannot run callbacks, their users poll.
+    if isinstance(event, CancellationToken):
+        return event.on_cancel(callback)
+    return lambda: None
+
+
+def wait_future(future: Future, token: Optional[Any], timeout: Optional[float] = None, poll_interval: float = 0.05) -> bool:
+    # Waits until the future is done or the token is set. Returns whether the future is done.
+    # A CancellationToken wakes it the moment it is set, any other stop event is checked every poll_interval.
+    if token is not None and (not isinstance(token, CancellationToken) or isinstance(token, LinkedToken)):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not future.done() and not token.is_set():
+            wait = poll_interval if deadline is None else min(poll_interval, deadline - time.monotonic())
+            if wait <= 0:
+                break
+            futures_wait([future], wait)
+        return future.done()
+
+    woken = threading.Event()
+    future.add_done_callback(lambda _: woken.set())
+    remove = on_cancel(token, woken.set)
+    try:
+        woken.wait(timeout)
+    finally:
+        remove()
+    return future.done()
@@ -1,9 +1,10 @@
+import inspect
 import openai
 import logging
 import nltk.data
+import socket
 import threading
 import time
-import yaml
 import json
 import requests
 import re
@@ -13,9 +14,50 @@ import traceback
 from .ChatSpeechProcessor import ChatSpeechProcessor
 from .SoundManager import SoundManager
 from .text import print_text, delete_last_lines
+from .config_service import get_config_service
+from .cancellation import CancellationToken, as_token
 import pprint
 
 
+def find_http_response(response, depth=4):
+    # The requests.Response under openai's streaming generators (openai < 1), found through the
+    # locals of their frames, which are there while the generators run or wait
+    generators = [response]
+    for _ in range(depth):
+        found = []
+        for generator in generators:
+            frame = getattr(generator, "gi_frame", None)
+            if frame is None:
+                continue
+            for value in frame.f_locals.values():
+                if isinstance(value, requests.Response):
+                    return value
+                if inspect.isgenerator(value):
+                    found.append(value)
+        generators = found
+    return None
+
+
+def close_stream(response):
+    # Ends a streamed completion from any thread, so a read waiting for the next chunk fails at
+    # once. A Stream (openai >= 1) has close(). A generator cannot be closed while another thread
+    # reads it, so the socket of its HTTP response is shut down instead.
+    if not inspect.isgenerator(response):
+        if hasattr(response, "close"):
+            response.close()
+        return
+    raw = getattr(find_http_response(response), "raw", None)
+    if hasattr(raw, "shutdown"):
+        raw.shutdown()  # urllib3 >= 2.3
+        return
+    sock = getattr(getattr(raw, "_connection", None), "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass  # Already closed
+
+
 class Chat:
     description = "Implements a chatbot using OpenAI's GPT-3 language model and allows for interaction with the user through speech or text."
 
@@ -28,13 +70,16 @@ class Chat:
 
         self.commh.data = self.commh.load_commands()
 
-        with open("configs.yaml", "r") as f:
-            self.configs = yaml.safe_load(f)
-        openai.api_key = self.configs["keys"]["openai"]
-        self.speak_thoughts = self.configs["chaining"]["speak_thoughts"]
+        self.config = get_config_service()
+        self.config.subscribe(self.on_config_change)
 
         # nltk.data.load('tokenizers/punkt/english.pickle')
 
+    def on_config_change(self, configs):
+        self.configs = configs
+        openai.api_key = self.config.get_str("keys", "openai")
+        self.speak_thoughts = self.config.get_bool("chaining", "speak_thoughts")
+
     def request(
         self,
         messages,
@@ -50,21 +95,12 @@ class Chat:
     ):
         # Handle LLM request. Optionally convert to sentences and queue for tts, if needed.
 
-        # Queues for handling chunks, sentences, and tts sounds
-        sentences = [[]]  # create a queue to hold the sentences
-
-        if not stop_event:
-            stop_event = threading.Event()
+        # The stream, the TTS pipeline and playback all watch one cancellation token, so setting
+        # stop_event stops all of them at once. Pass a CancellationToken: another stop event is
+        # followed by a LinkedToken, which only notices it when checked (once per chunk).
+        stop_event = as_token(stop_event)
         if not sound_stop_event:
-            sound_stop_event = threading.Event()
-
-        # Flags for handling chunks, sentences, and tts sounds
-        sentence_queue_canceled = [
-            False
-        ]  # use a list to make response_canceled mutable
-        sentence_queue_complete = [
-            False
-        ]  # use a list to make response_complete mutable
+            sound_stop_event = CancellationToken()
 
         threads = []  # keep track of all threads created
         text_stream = [""]
@@ -92,19 +128,26 @@ class Chat:
                         request_timeout=5,
                     )
 
-                # Handle chunks. Optionally convert to sentences for sentence_queue, if needed.
+                # Completed sentences are handed to the TTS pipeline as they stream in
+                tts_pipeline = None
+                if tts:
+                    tts_pipeline = self.csp.create_tts_pipeline(
+                        stop_event, sound_stop_event
+                    )
+
+                # Handle chunks. Optionally convert to sentences for the TTS pipeline, if needed.
+                stream_done = threading.Event()
                 arguments = {
                     "response": response,
                     "text_stream": text_stream,
-                    "sentences": sentences,
-                    "sentence_queue_canceled": sentence_queue_canceled,
-                    "sentence_queue_complete": sentence_queue_complete,
+                    "tts_pipeline": tts_pipeline,
                     "return_text": return_text,
                     "stop_event": stop_event,
                     "sound_stop_event": sound_stop_event,
                     "silent": silent,
                     "model": model,
                     "response_label": response_label,
+                    "stream_done": stream_done,
                 }
                 t = threading.Thread(
                     target=self.stream_queue_sentences, args=(arguments,)
@@ -112,22 +155,17 @@ class Chat:
                 t.start()
                 threads.append(t)
 
-                if tts:
-                    self.csp.queue_and_tts_sentences(
-                        tts=tts,
-                        sentences=sentences,
-                        sentence_queue_canceled=sentence_queue_canceled,
-                        sentence_queue_complete=sentence_queue_complete,
-                        stop_event=stop_event,
-                        sound_stop_event=sound_stop_event,
-                    )
-
-                while not return_text[0] and not stop_event.is_set():
-                    time.sleep(0.1)  # wait a bit before checking again
+                if tts_pipeline:
+                    # Blocks until the spoken response has finished playing
+                    self.csp.queue_and_tts_sentences(tts_pipeline)
 
-                # return response_complete and return_text[0] when return_text is set
-
-                t.join()
+                # Return when the stream ends, or right away when stopped. Stopping also closes the
+                # HTTP response, so the stream thread does not wait for the next chunk to notice.
+                remove_close = stop_event.on_cancel(lambda: close_stream(response))
+                remove_callback = stop_event.on_cancel(stream_done.set)
+                stream_done.wait()
+                remove_callback()
+                remove_close()
 
                 return return_text[0]
 
@@ -168,7 +206,7 @@ class Chat:
         logging.info("Checking for tool forms...")
 
         if not stop_event:
-            stop_event = threading.Event()
+            stop_event = CancellationToken()
 
         # Get the task, if any
         print_text("Task: ", "yellow")
@@ -535,18 +573,18 @@ class Chat:
     def stream_queue_sentences(self, arguments_dict):
         response = arguments_dict["response"]
         text_stream = arguments_dict["text_stream"]
-        sentences = arguments_dict["sentences"]
-        sentence_queue_canceled = arguments_dict.get("sentence_queue_canceled", [False])
-        sentence_queue_complete = arguments_dict.get("sentence_queue_complete", [False])
+        tts_pipeline = arguments_dict.get("tts_pipeline")
         return_text = arguments_dict["return_text"]
         stop_event = arguments_dict["stop_event"]
         sound_stop_event = arguments_dict["sound_stop_event"]
         silent = arguments_dict["silent"]
         model = arguments_dict["model"]
         response_label = arguments_dict["response_label"]
+        stream_done = arguments_dict.get("stream_done")
 
         collected_chunks = []
         collected_messages = []
+        completed = False
 
         try:
             if not silent and response_label:
@@ -554,32 +592,27 @@ class Chat:
 
             for chunk in response:
                 try:
-                    if not sentence_queue_canceled[0]:
-                        if not stop_event.is_set():
-                            temp_sentences = []
-                            collected_chunks.append(chunk)
-                            chunk_message = chunk["choices"][0]["delta"]
-                            collected_messages.append(chunk_message)
-                            text_stream[0] = "".join(
-                                [m.get("content", "") for m in collected_messages]
-                            )
-                            logging.debug(text_stream[0])
+                    if not stop_event.is_set():
+                        collected_chunks.append(chunk)
+                        chunk_message = chunk["choices"][0]["delta"]
+                        collected_messages.append(chunk_message)
+                        text_stream[0] = "".join(
+                            [m.get("content", "") for m in collected_messages]
+                        )
+                        logging.debug(text_stream[0])
 
-                            if not silent:
-                                if "content" in chunk_message:
-                                    print_text(chunk_message["content"])
+                        if not silent:
+                            if "content" in chunk_message:
+                                print_text(chunk_message["content"])
 
-                            # Tokenize the text into sentences
-                            temp_sentences = self.csp.nltk_sentence_tokenize(
-                                text_stream[0]
-                            )
-                            sentences[
-                                0
-                            ] = temp_sentences  # put the sentences into the queue
-                        else:
-                            sentence_queue_canceled[0] = True
-                            logging.info("Sentence queue canceled")
-                            return
+                        if tts_pipeline and "content" in chunk_message:
+                            # Queue whatever the chunking policy considers ready to speak
+                            tts_pipeline.feed_text(text_stream[0])
+                    else:
+                        logging.info("Sentence queue canceled")
+                        if hasattr(response, "close"):
+                            response.close()  # Drops the HTTP stream
+                        return
                 except ValueError as e:  # Handle the ValueError for each chunk
                     if "invalid literal for int() with base 16" in str(e):
                         logging.error(
@@ -589,23 +622,38 @@ class Chat:
                         continue  # Skip to the next chunk
                     else:
                         raise e
+            completed = True
             if not silent:
                 print_text("\n\n")
-        except requests.exceptions.ConnectionError as e:
-            logging.error(
-                "stream_queue_sentences(): Request timeout. Check your internet connection."
-            )
-            sentence_queue_canceled[0] = True
+        except Exception as e:
+            if stop_event.is_set():
+                # The stop event closed the response while a chunk was being read
+                logging.info(f"Sentence queue canceled: {e}")
+            elif isinstance(e, requests.exceptions.ConnectionError):
+                logging.error(
+                    "stream_queue_sentences(): Request timeout. Check your internet connection."
+                )
+            else:
+                raise
+        finally:
+            if tts_pipeline:
+                if not completed:
+                    tts_pipeline.cancel()
+                else:
+                    # The last sentence is complete once the stream ends
+                    tts_pipeline.finish_text(text_stream[0])
+            if not completed and stream_done:
+                stream_done.set()
 
-        time.sleep(0.01)
-        sentence_queue_complete[0] = True
         return_text[0] = text_stream[0]
         sound_stop_event.set()
         logging.info("Sentence queue complete")
+        if stream_done:
+            stream_done.set()
         return
 
     def display_messages(self, chat_handlers):
         """Displays the messages stored in the messages attribute of ContectHandlers."""
-        for message in chat_handlers.get_context():
+        for message in chat_handlers.get_context_snapshot():
             # Check if the message role is in the list of roles to display
             print(f"{message['role'].upper()}: {message['content']}\n\n")
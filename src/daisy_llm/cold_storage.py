@@ -0,0 +1,307 @@
+# Class ColdStorage packs the messages of idle conversations into one compressed blob each.
+import datetime
+import json
+import logging
+import time
+import zlib
+
+from typing import TYPE_CHECKING, List, Optional, Sequence, Tuple, TypedDict
+from typing_extensions import Self
+
+from .message_store import TIMESTAMP_FORMAT
+
+if TYPE_CHECKING:
+    from .context_handlers import ContextHandlers
+
+
+# (rowid, timestamp, role, message), the same shape as ContextHandlers.get_conversation_rows
+ArchivedRow = Tuple[int, str, str, str]
+
+
+class ArchiveReport(TypedDict):
+    conversations: int
+    messages: int
+    text_bytes: int
+    compressed_bytes: int
+    saved_bytes: int
+    freed_bytes: int
+    seconds: float
+
+
+class ColdStorage:
+    description = "A class that moves old conversations out of the messages table into compressed blobs"
+
+    def __init__(
+        self: Self, ch: "ContextHandlers", level: int = 9, batch_size: int = 100
+    ) -> None:
+        self.ch = ch
+        self.level = level
+        # Conversations archived per transaction
+        self.batch_size = batch_size
+
+    def create_archive_table_if_not_exists(self: Self) -> None:
+        with self.ch.connection_pool.get_connection() as conn:
+            conn.execute(
+                """
+				CREATE TABLE IF NOT EXISTS archived_messages (
+					conversation_id TEXT PRIMARY KEY,
+					message_count INTEGER NOT NULL,
+					last_rowid INTEGER NOT NULL,
+					last_timestamp TEXT,
+					archived_at INTEGER NOT NULL,
+					data BLOB NOT NULL
+				);
+			"""
+            )
+
+    def _pack(self: Self, rows: Sequence[ArchivedRow]) -> bytes:
+        payload = json.dumps([list(row) for row in rows], ensure_ascii=False, separators=(",", ":"))
+        return zlib.compress(payload.encode("utf-8"), self.level)
+
+    def _unpack(self: Self, data: bytes) -> List[ArchivedRow]:
+        return [tuple(row) for row in json.loads(zlib.decompress(data).decode("utf-8"))]  # type: ignore[misc]
+
+    def is_archived(self: Self, conversation_id: str) -> bool:
+        with self.ch.connection_pool.get_connection() as conn:
+            return (
+                conn.execute(
+                    """
+					SELECT 1 FROM archived_messages WHERE conversation_id = ?;
+				""",
+                    (conversation_id,),
+                ).fetchone()
+                is not None
+            )
+
+    def get_rows(self: Self, conversation_id: str) -> Optional[List[ArchivedRow]]:
+        # Decompressed rows of an archived conversation, or None if it is not archived
+        with self.ch.connection_pool.get_connection() as conn:
+            row = conn.execute(
+                """
+				SELECT data FROM archived_messages WHERE conversation_id = ?;
+			""",
+                (conversation_id,),
+            ).fetchone()
+        return self._unpack(row[0]) if row else None
+
+    def get_stale_conversation_ids(
+        self: Self, older_than_days: float, exclude_conversation_ids: Sequence[str] = ()
+    ) -> List[str]:
+        # Timestamps are compared as parsed dates (julianday), not as text. julianday is NULL for
+        # an empty or non-ISO timestamp, and a conversation with one is never stale: its age is unknown.
+        cutoff = (
+            datetime.datetime.now() - datetime.timedelta(days=older_than_days)
+        ).strftime(TIMESTAMP_FORMAT)
+        with self.ch.connection_pool.get_connection() as conn:
+            rows = conn.execute(
+                """
+				SELECT conversation_id FROM messages
+				GROUP BY conversation_id
+				HAVING COUNT(julianday(timestamp)) = COUNT(*) AND MAX(julianday(timestamp)) < julianday(?)
+			""",
+                (cutoff,),
+            ).fetchall()
+        excluded = set(exclude_conversation_ids)
+        return [row[0] for row in rows if row[0] not in excluded]
+
+    def archive(
+        self: Self,
+        older_than_days: float = 30,
+        exclude_conversation_ids: Sequence[str] = (),
+        vacuum: bool = True,
+    ) -> ArchiveReport:
+        self.create_archive_table_if_not_exists()
+        start = time.perf_counter()
+        report: ArchiveReport = {
+            "conversations": 0,
+            "messages": 0,
+            "text_bytes": 0,
+            "compressed_bytes": 0,
+            "saved_bytes": 0,
+            "freed_bytes": 0,
+            "seconds": 0.0,
+        }
+
+        conversation_ids = self.get_stale_conversation_ids(
+            older_than_days, exclude_conversation_ids
+        )
+        pages_before, free_before = self.get_page_counts()
+
+        with self.ch.connection_pool.get_connection() as conn:
+            for i, conversation_id in enumerate(conversation_ids):
+                rows: List[ArchivedRow] = conn.execute(
+                    """
+					SELECT rowid, timestamp, role, message FROM messages
+					WHERE conversation_id = ? ORDER BY rowid
+				""",
+                    (conversation_id,),
+                ).fetchall()
+                if not rows:
+                    continue
+
+                # A conversation that was archived before keeps its older rows in front
+                existing = conn.execute(
+                    """
+					SELECT data FROM archived_messages WHERE conversation_id = ?;
+				""",
+                    (conversation_id,),
+                ).fetchone()
+                all_rows = (self._unpack(existing[0]) if existing else []) + rows
+
+                data = self._pack(all_rows)
+                conn.execute(
+                    """
+					INSERT OR REPLACE INTO archived_messages
+					(conversation_id, message_count, last_rowid, last_timestamp, archived_at, data)
+					VALUES (?, ?, ?, ?, ?, ?);
+				""",
+                    (
+                        conversation_id,
+                        len(all_rows),
+                        all_rows[-1][0],
+                        all_rows[-1][1],
+                        int(time.time()),
+                        data,
+                    ),
+                )
+                conn.execute(
+                    """
+					DELETE FROM messages WHERE conversation_id = ?;
+				""",
+                    (conversation_id,),
+                )
+
+                report["conversations"] += 1
+                report["messages"] += len(rows)
+                report["text_bytes"] += sum(
+                    len(row[1].encode("utf-8")) + len(row[2].encode("utf-8")) + len(row[3].encode("utf-8"))
+                    for row in rows
+                )
+                report["compressed_bytes"] += len(data)
+
+                if (i + 1) % self.batch_size == 0:
+                    conn.commit()
+            conn.commit()
+
+        if vacuum:
+            self.incremental_vacuum()
+        # saved_bytes is the drop in pages in use, freed_bytes what the file shrank by
+        pages_after, free_after = self.get_page_counts()
+        page_size = self.get_page_size()
+        report["saved_bytes"] = max(0, (pages_before - free_before) - (pages_after - free_after)) * page_size
+        report["freed_bytes"] = max(0, pages_before - pages_after) * page_size
+        report["seconds"] = time.perf_counter() - start
+        logging.info(
+            f"Archived {report['messages']} messages from {report['conversations']} conversations, "
+            f"{report['text_bytes']} bytes of text into {report['compressed_bytes']} bytes, "
+            f"{report['saved_bytes']} bytes saved, {report['freed_bytes']} bytes returned to the file system"
+        )
+        return report
+
+    def restore(self: Self, conversation_id: str) -> int:
+        # Move an archived conversation back into the messages table. Returns the number of rows restored.
+        rows = self.get_rows(conversation_id)
+        if rows is None:
+            return 0
+
+        with self.ch.connection_pool.get_connection() as conn:
+            # Messages written after archiving stay after the archived ones
+            newer = conn.execute(
+                """
+				SELECT timestamp, role, message FROM messages
+				WHERE conversation_id = ? ORDER BY rowid
+			""",
+                (conversation_id,),
+            ).fetchall()
+            conn.execute(
+                """
+				DELETE FROM messages WHERE conversation_id = ?;
+			""",
+                (conversation_id,),
+            )
+            conn.executemany(
+                """
+				INSERT INTO messages (conversation_id, timestamp, role, message)
+				VALUES (?, ?, ?, ?);
+			""",
+                [(conversation_id, row[1], row[2], row[3]) for row in rows]
+                + [(conversation_id, row[0], row[1], row[2]) for row in newer],
+            )
+            last_restored = conn.execute(
+                """
+				SELECT rowid FROM messages WHERE conversation_id = ?
+				ORDER BY rowid LIMIT 1 OFFSET ?
+			""",
+                (conversation_id, len(rows) - 1),
+            ).fetchone()[0]
+
+            # A summary that covered the archived rows still covers them under their new rowids
+            if conn.execute(
+                """
+				SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'conversation_summary_state';
+			"""
+            ).fetchone():
+                conn.execute(
+                    """
+					UPDATE conversation_summary_state SET last_message_rowid = ?
+					WHERE conversation_id = ? AND last_message_rowid >= ?;
+				""",
+                    (last_restored, conversation_id, rows[-1][0]),
+                )
+
+            conn.execute(
+                """
+				DELETE FROM archived_messages WHERE conversation_id = ?;
+			""",
+                (conversation_id,),
+            )
+        logging.info(f"Restored {len(rows)} archived messages for conversation {conversation_id}")
+        return len(rows)
+
+    def delete(self: Self, conversation_id: str) -> None:
+        with self.ch.connection_pool.get_connection() as conn:
+            conn.execute(
+                """
+				DELETE FROM archived_messages WHERE conversation_id = ?;
+			""",
+                (conversation_id,),
+            )
+
+    def get_page_size(self: Self) -> int:
+        with self.ch.connection_pool.get_connection() as conn:
+            return conn.execute("PRAGMA page_size").fetchone()[0]
+
+    def get_page_counts(self: Self) -> Tuple[int, int]:
+        # (pages in the file, pages on the free list)
+        with self.ch.connection_pool.get_connection() as conn:
+            page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+            freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return page_count, freelist_count
+
+    def is_incremental_vacuum_enabled(self: Self) -> bool:
+        with self.ch.connection_pool.get_connection() as conn:
+            return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+    def enable_incremental_vacuum(self: Self) -> None:
+        # An explicit, one-time step: a database created without auto_vacuum needs a full VACUUM
+        # to switch to incremental mode. That rewrites the whole file under an exclusive lock.
+        with self.ch.connection_pool.get_connection() as conn:
+            conn.commit()
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                return
+            logging.info("Enabling incremental vacuum, rebuilding the database")
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+
+    def incremental_vacuum(self: Self, pages: Optional[int] = None) -> None:
+        # Give free pages back to the file system, which is cheap in incremental mode. Without it
+        # (see enable_incremental_vacuum) nothing is done: SQLite reuses the free pages for new rows.
+        with self.ch.connection_pool.get_connection() as conn:
+            conn.commit()
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                logging.debug("Incremental vacuum is not enabled, free pages stay in the database file")
+                return
+            if pages:
+                conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+            else:
+                conn.execute("PRAGMA incremental_vacuum").fetchall()
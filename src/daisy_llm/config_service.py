@@ -0,0 +1,203 @@
+# Class ConfigService parses configs.yaml once and keeps it up to date for everyone.
+import logging
+import os
+import threading
+import time
+
+from ruamel.yaml import YAML
+from typing import Any, Callable, Dict, List, Optional
+from typing_extensions import Self
+
+
+ConfigCallback = Callable[[Dict[str, Any]], None]
+
+# Seconds between checks of the file for changes, unless set by config_reload_interval in the file
+DEFAULT_POLL_INTERVAL = 1.0
+
+
+class ConfigService:
+    description = "A class that caches configs.yaml, reloads it when the file changes and notifies subscribers"
+
+    # The file is watched by a thread only while someone is subscribed. Without subscribers, reads
+    # check it for changes themselves, at most once per poll interval.
+
+    def __init__(self: Self, path: str = "configs.yaml", poll_interval: Optional[float] = None) -> None:
+        self.path = path
+        self.poll_interval = poll_interval  # None: config_reload_interval from the file
+        self.yaml = YAML()
+        self.yaml.allow_duplicate_keys = True
+
+        self.data: Dict[str, Any] = {}
+        self.mtime: Optional[float] = None
+        self.loaded = False
+        self.checked = 0.0
+        self.lock = threading.RLock()
+        self.subscribers: List[ConfigCallback] = []
+
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def interval(self: Self) -> float:
+        if self.poll_interval is not None:
+            return self.poll_interval
+        value = self.data.get("config_reload_interval") if isinstance(self.data, dict) else None
+        try:
+            return float(value) if value is not None else DEFAULT_POLL_INTERVAL
+        except (TypeError, ValueError):
+            return DEFAULT_POLL_INTERVAL
+
+    def _ensure_loaded(self: Self) -> None:
+        if not self.loaded:
+            with self.lock:
+                if not self.loaded:
+                    self.reload()
+        elif self.thread is None and time.monotonic() - self.checked >= self.interval():
+            self.reload()
+
+    def reload(self: Self, force: bool = False) -> bool:
+        # Parse the file again if it changed since the last load. Returns True if it was reloaded.
+        self.checked = time.monotonic()
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            if not self.loaded:
+                logging.warning(f"Config file not found: {self.path}")
+                self.loaded = True
+            return False
+
+        with self.lock:
+            if not force and self.loaded and mtime == self.mtime:
+                return False
+            try:
+                with open(self.path, "r") as f:
+                    data = self.yaml.load(f) or {}
+            except Exception as e:
+                logging.warning(f"Failed to load {self.path}: {str(e)}")
+                self.loaded = True
+                return False
+            first_load = not self.loaded
+            self.data = data
+            self.mtime = mtime
+            self.loaded = True
+            subscribers = list(self.subscribers)
+
+        if not first_load:
+            logging.info(f"Reloaded {self.path}")
+        for callback in subscribers:
+            self._notify(callback, data)
+        return True
+
+    def _notify(self: Self, callback: ConfigCallback, data: Dict[str, Any]) -> None:
+        try:
+            callback(data)
+        except Exception as e:
+            logging.error(f"Config subscriber failed: {str(e)}")
+
+    def _watch(self: Self, stop_event: threading.Event) -> None:
+        while not stop_event.wait(self.interval()):
+            self.reload()
+
+    def start_watching(self: Self) -> None:
+        with self.lock:
+            if self.thread is None:
+                self.stop_event = threading.Event()
+                self.thread = threading.Thread(target=self._watch, args=(self.stop_event,))
+                self.thread.daemon = True
+                self.thread.start()
+
+    def stop_watching(self: Self) -> None:
+        with self.lock:
+            self.stop_event.set()
+            self.thread = None
+
+    def subscribe(self: Self, callback: ConfigCallback, call_now: bool = True) -> ConfigCallback:
+        # callback(data) runs on the watcher thread after every reload
+        self._ensure_loaded()
+        with self.lock:
+            self.subscribers.append(callback)
+            data = self.data
+            self.start_watching()
+        if call_now:
+            self._notify(callback, data)
+        return callback
+
+    def unsubscribe(self: Self, callback: ConfigCallback) -> None:
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+                if not self.subscribers:
+                    self.stop_watching()
+
+    def get_data(self: Self) -> Dict[str, Any]:
+        self._ensure_loaded()
+        return self.data
+
+    def get(self: Self, *keys: str, default: Any = None) -> Any:
+        # Nested lookup from the cached data, no file I/O
+        self._ensure_loaded()
+        value: Any = self.data
+        for key in keys:
+            if not isinstance(value, dict) or key not in value:
+                return default
+            value = value[key]
+        return default if value is None else value
+
+    def get_str(self: Self, *keys: str, default: Optional[str] = None) -> Optional[str]:
+        value = self.get(*keys)
+        return default if value is None else str(value)
+
+    def get_int(self: Self, *keys: str, default: int = 0) -> int:
+        try:
+            return int(self.get(*keys, default=default))
+        except (TypeError, ValueError):
+            return default
+
+    def get_float(self: Self, *keys: str, default: float = 0.0) -> float:
+        try:
+            return float(self.get(*keys, default=default))
+        except (TypeError, ValueError):
+            return default
+
+    def get_bool(self: Self, *keys: str, default: bool = False) -> bool:
+        value = self.get(*keys, default=default)
+        if isinstance(value, str):
+            return value.strip().lower() in ("true", "yes", "on", "1")
+        return bool(value)
+
+    def edit(self: Self, change: Callable[[Dict[str, Any]], Any]) -> None:
+        # Read-modify-write of the file (comments are kept), then reload and notify
+        with self.lock:
+            with open(self.path, "r") as f:
+                data = self.yaml.load(f) or {}
+            change(data)
+            with open(self.path, "w") as f:
+                self.yaml.dump(data, f)
+        self.reload(force=True)
+
+    def set(self: Self, *keys: str, value: Any) -> None:
+        def change(data: Dict[str, Any]) -> None:
+            for key in keys[:-1]:
+                if not isinstance(data.get(key), dict):
+                    data[key] = {}
+                data = data[key]
+            data[keys[-1]] = value
+
+        self.edit(change)
+
+
+config_services: Dict[str, ConfigService] = {}
+config_services_lock = threading.Lock()
+
+
+def get_config_service(path: str = "configs.yaml", poll_interval: Optional[float] = None) -> ConfigService:
+    # One shared service per config file in the process. poll_interval overrides the file's
+    # config_reload_interval for everyone using the service.
+    key = os.path.abspath(path)
+    with config_services_lock:
+        service = config_services.get(key)
+        if service is None:
+            service = ConfigService(path, poll_interval)
+            config_services[key] = service
+        elif poll_interval is not None:
+            service.poll_interval = poll_interval
+        return service
@@ -1,52 +1,82 @@
 # Class ConnectionPool is a class that manages a pool of sqlite3 connections.
 import sqlite3
 import threading
+import weakref
 
 from sqlite3 import Connection
-from typing import Dict, Optional
+from typing import List, Optional, Set
 from typing_extensions import Self
 
 
+class Lease:
+    # A thread's hold on a connection. It lives in the pool's thread-local storage, so it is
+    # dropped when the thread ends, and dropping it gives the connection back to the pool.
+    def __init__(self: Self, pool: "ConnectionPool", conn: Connection, generation: int) -> None:
+        self.conn = conn
+        self.generation = generation
+        # Not at exit, when daemon threads may still be using their connections
+        weakref.finalize(self, pool._return, conn, generation).atexit = False
+
+
 class ConnectionPool:
-    def __init__(self: Self, db_path: str, max_connections: int = 5) -> None:
+    # Each thread uses one connection until the thread ends or calls release_connection(). The
+    # connection then goes back to the pool for the next thread, so a thread per request server
+    # holds at most max_connections at once. A thread that finds them all in use waits up to
+    # timeout seconds for one. Connections move between threads, so they are opened with
+    # check_same_thread=False, but only one thread holds a connection at a time.
+    def __init__(self: Self, db_path: str, max_connections: int = 5, timeout: float = 30.0) -> None:
         self.db_path = db_path
         self.max_connections = max_connections
-        self.connections: Dict[int, Optional[Connection]] = {}
-        self.lock = threading.Lock()
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        self.local = threading.local()
+        self.idle: List[Connection] = []
+        self.connections: Set[Connection] = set()  # Every open connection, idle or leased
+        self.generation = 0  # Bumped by close_all_connections(), older leases are not returned
 
     def get_connection(self: Self) -> Connection:
-        thread_id = threading.get_ident()
-        self.lock.acquire()
-        try:
-            if thread_id in self.connections:
-                conn = self.connections[thread_id]
-                if conn is None:
-                    conn = sqlite3.connect(self.db_path)
-                    self.connections[thread_id] = conn
-                return conn
-            elif len(self.connections) < self.max_connections:
-                conn = sqlite3.connect(self.db_path)
-                self.connections[thread_id] = conn
-                return conn
-            else:
+        lease: Optional[Lease] = getattr(self.local, "lease", None)
+        if lease is not None and lease.generation == self.generation:
+            return lease.conn
+
+        with self.condition:
+            if not self.condition.wait_for(
+                lambda: self.idle or len(self.connections) < self.max_connections, self.timeout
+            ):
                 raise Exception("Connection pool exhausted")
-        finally:
-            self.lock.release()
+            if self.idle:
+                conn = self.idle.pop()
+            else:
+                conn = sqlite3.connect(self.db_path, check_same_thread=False)
+                self.connections.add(conn)
+            self.local.lease = Lease(self, conn, self.generation)
+        return conn
+
+    def release_connection(self: Self) -> None:
+        # Give the calling thread's connection back to the pool, for threads that stay alive but idle
+        self.local.lease = None
 
     def put_connection(self: Self, conn: sqlite3.Connection) -> None:
-        thread_id = threading.get_ident()
-        self.lock.acquire()
-        try:
-            if thread_id in self.connections:
-                self.connections[thread_id] = None
-            else:
-                conn.close()
-        finally:
-            self.lock.release()
+        lease: Optional[Lease] = getattr(self.local, "lease", None)
+        if lease is not None and lease.conn is conn:
+            self.release_connection()
+        elif conn not in self.connections:
+            conn.close()
+
+    def _return(self: Self, conn: Connection, generation: int) -> None:
+        with self.condition:
+            if generation != self.generation or conn not in self.connections:
+                return
+            if conn.in_transaction:
+                conn.rollback()
+            self.idle.append(conn)
+            self.condition.notify()
 
     def close_all_connections(self: Self) -> None:
-        with self.lock:
-            for conn in self.connections.values():
-                if conn is not None:
-                    conn.close()
+        with self.condition:
+            for conn in self.connections:
+                conn.close()
             self.connections.clear()
+            self.idle.clear()
+            self.generation += 1
+            self.condition.notify_all()
@@ -1,22 +1,31 @@
+import bisect
 import datetime
 import json
 import logging
 import re
+import threading
 import time
+import uuid
+
+from array import array
 
 from enum import Enum
-from ruamel.yaml import YAML
-from typing import Any, List, Optional, Tuple, TypedDict
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence, Tuple, TypedDict
 from typing_extensions import Self
 
 
 from .chat import Chat
+from .cold_storage import ArchiveReport, ColdStorage
 from .text import print_text
+from .config_service import get_config_service
 from .connection_pool import ConnectionPool
+from .conversation_transfer import ConversationTransfer, TransferStats
+from .memory import EmbedFunction, MemoryMatch, MemoryStore
+from .message_store import MessageStore, estimate_tokens
+from .summarizer import CompletionClient, ConversationSummarizer, SummaryScheduler, record_activity
 
-
-# Initialize YAML parser
-yaml = YAML()
+if TYPE_CHECKING:
+    from .session_manager import SessionManager
 
 
 class Role(Enum):
@@ -36,70 +45,276 @@ class StartPrompt(TypedDict):
     content: str
 
 
+def new_conversation_id() -> str:
+    # Second resolution keeps ids sorting by creation time, the random suffix keeps them unique
+    return str(int(time.time())) + "-" + uuid.uuid4().hex[:8]
+
+
+class FrozenMessage(dict):
+    # A read-only message dict. Cached get_context_snapshot() entries are shared between callers, so
+    # changing one in place would change it for everyone. It is still a dict, so it serializes to
+    # JSON as before.
+
+    def _read_only(self: Self, *args: Any, **kwargs: Any) -> Any:
+        raise TypeError("Context messages are read-only, copy one with dict(message) to change it")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only  # type: ignore[assignment]
+    clear = pop = popitem = setdefault = update = _read_only  # type: ignore[assignment]
+
+    def __reduce__(self: Self) -> Tuple[Any, ...]:
+        return (FrozenMessage, (dict(self),))
+
+
+ContextSnapshot = Tuple[Message, ...]
+
+# Columns list_conversations() may return. Names are checked against this before they go into SQL.
+CONVERSATION_LIST_COLUMNS = ("id", "name", "summary")
+
+
+class ConversationPage(TypedDict):
+    rows: List[Dict[str, Any]]
+    next_cursor: Optional[str]
+    estimated_total: int
+
+
 class ContextHandlers:
     description = (
         "A class for handling and managing messages in the chatGPT context object"
     )
 
-    def __init__(self: Self, db_path: str) -> None:
-        self.chat: Chat = Chat()
-
-        # Get and set conversation_id from configs.yaml
-        self.conversation_id: str | None = None
-        with open("configs.yaml", "r") as f:
-            configs = yaml.load(f)
-        if (
-            "conversation_id" in configs
-        ):  # TODO: Ask @myrakrusemark about this. What exactly is this?
-            self.conversation_id = configs.get("conversation_id")
-            logging.info(
-                "Using conversation id from configs: " + str(self.conversation_id)
-            )
+    def __init__(
+        self: Self,
+        db_path: str,
+        embed_fn: Optional[EmbedFunction] = None,
+        window_messages: Optional[int] = None,
+        window_tokens: Optional[int] = None,
+        conversation_id: Optional[str] = None,
+        configs_yaml: Optional[str] = "configs.yaml",
+        connection_pool: Optional[ConnectionPool] = None,
+        memory: Optional[MemoryStore] = None,
+        session_manager: Optional["SessionManager"] = None,
+        enable_memory: Optional[bool] = None,
+    ) -> None:
+        self._chat: Optional[Chat] = None
+        # Set for handles served by a SessionManager, whose resident conversations are open
+        self.session_manager = session_manager
+
+        # Get and set conversation_id from configs.yaml, unless one was passed in.
+        # Handles created with configs_yaml=None never touch the file.
+        self.conversation_id: str | None = conversation_id
+        self.configs_yaml = configs_yaml
+        if self.conversation_id is None and self.configs_yaml:
+            configs = get_config_service(self.configs_yaml).get_data()
+            if (
+                "conversation_id" in configs
+            ):  # TODO: Ask @myrakrusemark about this. What exactly is this?
+                self.conversation_id = configs.get("conversation_id")
+                logging.info(
+                    "Using conversation id from configs: " + str(self.conversation_id)
+                )
 
         self.db_path = db_path
-        self.messages: List[Message] = []
+        self.messages = MessageStore()
         self.start_prompts: List[StartPrompt] = []
-        self.connection_pool = ConnectionPool(db_path)
-
-    def load_context(self: Self) -> None:
-        self.messages = []
+        self.connection_pool = connection_pool or ConnectionPool(db_path)
+
+        # Long-term memory embeds every message, with OpenAI unless embed_fn is given, so it is
+        # off unless asked for: enable_memory, an embed_fn or memory passed in, or memory: enabled
+        # in configs.yaml. When it is off, self.memory is None and searches find nothing.
+        if enable_memory is None:
+            enable_memory = memory is not None or embed_fn is not None
+            if not enable_memory and self.configs_yaml:
+                enable_memory = get_config_service(self.configs_yaml).get_bool("memory", "enabled")
+        self.memory: Optional[MemoryStore] = None
+        if enable_memory:
+            self.memory = memory or MemoryStore(self.connection_pool, embed_fn)
+        self.cold_storage = ColdStorage(self)
+
+        # Windowed loading. When set, only the most recent messages are loaded and
+        # older ones are paged in with load_older_messages(). Indexes used by
+        # get_context, delete_message_at_index, etc. are relative to the window.
+        self.window_messages = window_messages
+        self.window_tokens = window_tokens
+        self.has_older_messages = False
+
+        # Database rowid of each loaded message. Messages before _saved_upto are
+        # persisted unchanged; rows from _dirty_rowid onward are rewritten on save.
+        self.message_rowids = array("q")
+        self._saved_upto = 0
+        self._dirty_rowid: Optional[int] = None
+
+        # Held by whoever uses the handle from a SessionManager, and while it is spilled
+        self.lock = threading.RLock()
+
+        # Time of the last change to the context, used to detect when the system is idle.
+        # Changes are also recorded for the whole database with record_activity().
+        self.last_activity = time.monotonic()
+
+        # Cached get_context_snapshot() tuples, invalidated by _context_changed()
+        self._context_version = 0
+        self._snapshot: ContextSnapshot = ()
+        self._snapshot_key: Tuple[int, ...] = ()
+        self._snapshot_views: Dict[Tuple[bool, bool], ContextSnapshot] = {}
+
+    @property
+    def chat(self: Self) -> Chat:
+        # Created on first use, so that idle handles stay cheap
+        if self._chat is None:
+            self._chat = Chat()
+        return self._chat
+
+    @chat.setter
+    def chat(self: Self, chat: Chat) -> None:
+        self._chat = chat
+
+    def has_chat(self: Self) -> bool:
+        # Whether a Chat was set on (or already created by) this handle
+        return self._chat is not None
+
+    def create_summary_client(self: Self) -> CompletionClient:
+        # A client for background summaries, ConversationSummarizer makes one per worker thread
+        api_key = get_config_service(self.configs_yaml).get_str("keys", "openai") if self.configs_yaml else None
+        return CompletionClient(api_key)
+
+    def has_unsaved_changes(self: Self) -> bool:
+        return self._saved_upto < len(self.messages) or self._dirty_rowid is not None
+
+    def load_context(
+        self: Self,
+        window_messages: Optional[int] = None,
+        window_tokens: Optional[int] = None,
+    ) -> None:
+        self.messages = MessageStore()
+        self.message_rowids = array("q")
+        self._saved_upto = 0
+        self._dirty_rowid = None
+        self.has_older_messages = False
+        self._context_changed()
         self.create_conversations_table_if_not_exists()
-        with self.connection_pool.get_connection() as conn:
-            cursor = conn.cursor()
 
-            # If conversation_id is not set, create a new conversation ID
-            if not self.conversation_id:
-                self.conversation_id = str(int(time.time()))
+        window_messages = window_messages or self.window_messages
+        window_tokens = window_tokens or self.window_tokens
+
+        # If conversation_id is not set, create a new conversation ID
+        if not self.conversation_id:
+            self.conversation_id = new_conversation_id()
 
-                print_text("Creating new conversation: ", "yellow")
-                print_text(str(self.conversation_id), None, "\n")
+            print_text("Creating new conversation: ", "yellow")
+            print_text(str(self.conversation_id), None, "\n")
 
-            logging.info("Conversation id: " + str(self.conversation_id))
+        logging.info("Conversation id: " + str(self.conversation_id))
 
+        # An archived conversation becomes live again when it is loaded
+        self.cold_storage.restore(self.conversation_id)
+
+        if window_messages or window_tokens:
+            rows = self._fetch_window(window_messages, window_tokens)
+        else:
             # Get the messages from the conversation ID
-            cursor.execute(
-                """
-				SELECT * FROM messages WHERE conversation_id = ?
-			""",
-                (self.conversation_id,),
+            with self.connection_pool.get_connection() as conn:
+                rows = conn.execute(
+                    """
+					SELECT rowid, timestamp, role, message FROM messages
+					WHERE conversation_id = ? ORDER BY rowid
+				""",
+                    (self.conversation_id,),
+                ).fetchall()
+
+        self._prepend_rows(rows)
+        if rows:
+            print_text(
+                "Loaded "
+                + str(len(rows))
+                + " messages from conversation id: "
+                + str(self.conversation_id),
+                "yellow",
+                "\n",
             )
-            rows = cursor.fetchall()
-            if rows:
-                for row in rows:
-                    message: Message = {
-                        "timestamp": row[1],
-                        "role": row[2],
-                        "content": row[3],
-                    }
-                    self.messages.append(message)
-                print_text(
-                    "Loaded "
-                    + str(len(rows))
-                    + " messages from conversation id: "
-                    + str(self.conversation_id),
-                    "yellow",
-                    "\n",
-                )
+
+    def _fetch_page(
+        self: Self, before_rowid: Optional[int], limit: int
+    ) -> List[Tuple[int, str, str, str]]:
+        # Keyset pagination on rowid, newest first
+        with self.connection_pool.get_connection() as conn:
+            if before_rowid is None:
+                rows = conn.execute(
+                    """
+					SELECT rowid, timestamp, role, message FROM messages
+					WHERE conversation_id = ? ORDER BY rowid DESC LIMIT ?
+				""",
+                    (self.conversation_id, limit),
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    """
+					SELECT rowid, timestamp, role, message FROM messages
+					WHERE conversation_id = ? AND rowid < ? ORDER BY rowid DESC LIMIT ?
+				""",
+                    (self.conversation_id, before_rowid, limit),
+                ).fetchall()
+        return rows
+
+    def _fetch_window(
+        self: Self,
+        count: Optional[int],
+        tokens: Optional[int],
+        before_rowid: Optional[int] = None,
+        page_size: int = 50,
+    ) -> List[Tuple[int, str, str, str]]:
+        # Fetch the newest messages older than before_rowid, stopping at count messages
+        # or once the token budget is used up (at least one message is always returned)
+        rows: List[Tuple[int, str, str, str]] = []
+        used_tokens = 0
+        while True:
+            limit = page_size if count is None else min(page_size, count - len(rows))
+            if limit <= 0:
+                self.has_older_messages = bool(self._fetch_page(before_rowid, 1))
+                break
+            page = self._fetch_page(before_rowid, limit)
+            if not page:
+                self.has_older_messages = False
+                break
+
+            for row in page:
+                row_tokens = estimate_tokens(row[3])
+                if tokens is not None and rows and used_tokens + row_tokens > tokens:
+                    self.has_older_messages = True
+                    return list(reversed(rows))
+                rows.append(row)
+                used_tokens += row_tokens
+            before_rowid = page[-1][0]
+        return list(reversed(rows))
+
+    def _prepend_rows(self: Self, rows: List[Tuple[int, str, str, str]]) -> None:
+        self.messages.prepend_rows(rows)
+        self.message_rowids[:0] = array("q", [row[0] for row in rows])
+        self._saved_upto += len(rows)
+        self._context_changed()
+
+    def load_older_messages(
+        self: Self, count: Optional[int] = 50, tokens: Optional[int] = None
+    ) -> int:
+        # Page older messages into the start of the window
+        if self.has_unsaved_changes():
+            self.save_context()
+        if not self.message_rowids:
+            return 0
+
+        rows = self._fetch_window(count, tokens, self.message_rowids[0])
+        self._prepend_rows(rows)
+        logging.info(
+            f"Loaded {len(rows)} older messages for conversation {self.conversation_id}"
+        )
+        return len(rows)
+
+    def _mark_dirty(self: Self, index: int) -> None:
+        # Call before changing the message at index. It and every later message are rewritten on save.
+        self._context_changed()
+        if 0 <= index < self._saved_upto:
+            rowid = self.message_rowids[index]
+            if self._dirty_rowid is None or rowid < self._dirty_rowid:
+                self._dirty_rowid = rowid
+            self._saved_upto = index
 
     def create_conversations_table_if_not_exists(self: Self) -> None:
         with self.connection_pool.get_connection() as conn:
@@ -123,6 +338,13 @@ class ContextHandlers:
 				);
 			"""
             )
+            cursor.execute(
+                """
+				CREATE INDEX IF NOT EXISTS messages_conversation_id
+				ON messages (conversation_id);
+			"""
+            )
+        self.cold_storage.create_archive_table_if_not_exists()
 
     def save_context(self: Self) -> None:
         logging.info("Saving context: " + str(self.conversation_id))
@@ -132,9 +354,11 @@ class ContextHandlers:
 				PRAGMA foreign_keys=OFF;
 			"""
             )
+            # IMMEDIATE takes the write lock up front. A deferred transaction that reads first
+            # fails at once with "database is locked" when another thread is writing too.
             conn.execute(
                 """
-				BEGIN TRANSACTION;
+				BEGIN IMMEDIATE TRANSACTION;
 			"""
             )
 
@@ -154,24 +378,43 @@ class ContextHandlers:
                     (self.conversation_id, "No name", "No summary"),
                 )
 
-            # Save messages
-            conn.execute(
-                """
-				DELETE FROM messages WHERE conversation_id = ?;
-			""",
-                (self.conversation_id,),
-            )
-            for message in self.messages:
+            # Save messages. Only rows that changed since the last save are rewritten,
+            # everything older (including messages outside the window) is left alone.
+            summarized_index: Optional[int] = None
+            if self._dirty_rowid is not None:
+                summarized_index = self._summarized_index(conn)
                 conn.execute(
+                    """
+					DELETE FROM messages WHERE conversation_id = ? AND rowid >= ?;
+				""",
+                    (self.conversation_id, self._dirty_rowid),
+                )
+            del self.message_rowids[self._saved_upto :]
+            for i in range(self._saved_upto, len(self.messages)):
+                cursor = conn.execute(
                     """
 					INSERT INTO messages (conversation_id, timestamp, role, message)
 					VALUES (?, ?, ?, ?);
 				""",
                     (
                         self.conversation_id,
-                        message.get("timestamp"),
-                        message.get("role"),
-                        message.get("content"),
+                        # The column is NOT NULL, a message without a timestamp is stored with an empty one
+                        self.messages.timestamp_at(i) or "",
+                        self.messages.role_at(i),
+                        self.messages.content_at(i),
+                    ),
+                )
+                self.message_rowids.append(cursor.lastrowid)
+            if summarized_index is not None and self.message_rowids:
+                # The summary covered rewritten rows, which now have new rowids. Its high-water mark
+                # moves to the new row of the last message it covered, so they are not summarized again.
+                conn.execute(
+                    """
+					UPDATE conversation_summary_state SET last_message_rowid = ? WHERE conversation_id = ?;
+				""",
+                    (
+                        self.message_rowids[min(summarized_index, len(self.message_rowids) - 1)],
+                        self.conversation_id,
                     ),
                 )
             conn.execute(
@@ -179,53 +422,97 @@ class ContextHandlers:
 				COMMIT;
 			"""
             )
-            row_count = conn.execute(
-                """
-				SELECT COUNT(*) FROM messages WHERE conversation_id = ?;
-			""",
-                (self.conversation_id,),
-            ).fetchone()[0]
             logging.info(
-                f"Inserted {row_count} rows for conversation {self.conversation_id}."
+                f"Inserted {len(self.messages) - self._saved_upto} rows for conversation {self.conversation_id}."
             )
+            self._saved_upto = len(self.messages)
+            self._dirty_rowid = None
+
+    def _summarized_index(self: Self, conn: Any) -> Optional[int]:
+        # Index of the last summarized message, when the summary covers rows about to be rewritten
+        if not conn.execute(
+            """
+			SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'conversation_summary_state';
+		"""
+        ).fetchone():
+            return None
+        row = conn.execute(
+            """SELECT last_message_rowid FROM conversation_summary_state WHERE conversation_id = ?""",
+            (self.conversation_id,),
+        ).fetchone()
+        if row is None or self._dirty_rowid is None or row[0] < self._dirty_rowid:
+            return None
+        return bisect.bisect_right(self.message_rowids, row[0]) - 1
+
+    def _context_changed(self: Self) -> None:
+        self._context_version += 1
+        self.last_activity = time.monotonic()
+        record_activity(self.db_path)
+
+    def _get_snapshot(self: Self) -> ContextSnapshot:
+        # Rebuilt only when messages or start prompts change. Lengths and list identity
+        # are part of the key so direct appends to self.messages are also picked up.
+        key = (
+            self._context_version,
+            id(self.messages),
+            len(self.messages),
+            id(self.start_prompts),
+            len(self.start_prompts),
+        )
+        if key != self._snapshot_key:
+            snapshot: List[Message] = []
+            for message in self.start_prompts:
+                snapshot.append(
+                    FrozenMessage(  # type: ignore[arg-type]
+                        timestamp=message["timestamp"],
+                        role=self._role_value(message["role"]),
+                        content=message["content"],
+                    )
+                )
+            # The message store hands out fresh dicts with plain string roles
+            snapshot.extend(FrozenMessage(message) for message in self.messages)  # type: ignore[misc]
+            self._snapshot = tuple(snapshot)
+            self._snapshot_views = {}
+            self._snapshot_key = key
+        return self._snapshot
 
     def get_context(
         self: Self, include_timestamp: bool = True, include_system: bool = True
     ) -> List[Message]:
-        context: List[Message] = []
-        # Append start prompts to messages
-        for start_prompt in self.start_prompts:
-            if include_system or start_prompt["role"] != Role.system:
-                new_prompt: Message = {
-                    "role": start_prompt["role"],
-                    "content": start_prompt["content"],
-                    "timestamp": None,
-                }
-                if include_timestamp:
-                    new_prompt["timestamp"] = start_prompt["timestamp"]
-                context.append(new_prompt)  # append new_message, not start_prompt
-
-        # Do the same for the regular messages
-        for message in self.messages:
-            if include_system or message["role"] != Role.system:
-                new_message: Message = {
-                    "role": message["role"],
-                    "content": message["content"],
-                    "timestamp": None,
-                }
-                if include_timestamp:
-                    new_message["timestamp"] = message["timestamp"]
-                context.append(new_message)  # append new_message, not message
-
-        return context
+        # Returns new message dicts each call, so callers may change them and the list freely.
+        # Roles are the Role values as plain strings ("user", "system", ...), for messages added in
+        # this session as well as for ones loaded from the database.
+        return [
+            dict(message)  # type: ignore[misc]
+            for message in self.get_context_snapshot(include_timestamp, include_system)
+        ]
+
+    def get_context_snapshot(
+        self: Self, include_timestamp: bool = True, include_system: bool = True
+    ) -> ContextSnapshot:
+        # Like get_context without the copies: a cached tuple of read-only message dicts shared
+        # between callers, rebuilt only when the context changes. For callers that only read it.
+        snapshot = self._get_snapshot()
+        if include_timestamp and include_system:
+            return snapshot
+
+        view_key = (include_timestamp, include_system)
+        view = self._snapshot_views.get(view_key)
+        if view is None:
+            view = tuple(
+                message
+                if include_timestamp
+                else FrozenMessage(  # type: ignore[misc]
+                    timestamp=None, role=message["role"], content=message["content"]
+                )
+                for message in snapshot
+                if include_system or message["role"] != Role.system.value
+            )
+            self._snapshot_views[view_key] = view
+        return view
 
     def get_context_without_timestamp(self: Self) -> List[Message]:
-        messages_without_timestamp: List[Message] = []
-        for message in self.get_context():
-            message_without_timestamp = message.copy()
-            message_without_timestamp["timestamp"] = None
-            messages_without_timestamp.append(message_without_timestamp)
-        return messages_without_timestamp
+        return self.get_context(include_timestamp=False)
 
     def get_conversation_name_summary(
         self: Self, limit: Optional[int] = None
@@ -234,14 +521,74 @@ class ContextHandlers:
             cursor = conn.cursor()
             query = """SELECT id, name, summary FROM conversations ORDER BY id DESC"""
             if limit:
-                query += f" LIMIT {limit}"
-            cursor.execute(query)
+                cursor.execute(query + " LIMIT ?", (int(limit),))
+            else:
+                cursor.execute(query)
             rows = cursor.fetchall()
             if rows:
                 return [(id, name, summary) for id, name, summary in rows]
             else:
                 return None
 
+    def list_conversations(
+        self: Self,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        columns: Sequence[str] = ("id", "name"),
+        name_contains: Optional[str] = None,
+        summarized: Optional[bool] = None,
+        archived: Optional[bool] = None,
+    ) -> ConversationPage:
+        # Newest first, one page at a time. Pass the returned next_cursor to get the next page.
+        # Paging walks the primary key index on id, so every page costs the same however deep it is.
+        unknown = [column for column in columns if column not in CONVERSATION_LIST_COLUMNS]
+        if unknown:
+            raise ValueError("Unknown conversation columns: " + ", ".join(unknown))
+        selected = ["id"] + [column for column in columns if column != "id"]
+
+        conditions: List[str] = []
+        params: List[Any] = []
+        if cursor is not None:
+            conditions.append("c.id < ?")
+            params.append(cursor)
+        if name_contains:
+            conditions.append("c.name LIKE ? ESCAPE '\\'")
+            params.append(
+                "%"
+                + name_contains.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                + "%"
+            )
+        if summarized is not None:
+            conditions.append("c.summary != 'No summary'" if summarized else "c.summary = 'No summary'")
+        if archived is not None:
+            conditions.append(
+                ("" if archived else "NOT ")
+                + "EXISTS (SELECT 1 FROM archived_messages a WHERE a.conversation_id = c.id)"
+            )
+
+        query = "SELECT " + ", ".join("c." + column for column in selected) + " FROM conversations c"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY c.id DESC LIMIT ?"
+        params.append(int(limit) + 1)  # One extra row tells whether there is another page
+
+        self.create_conversations_table_if_not_exists()
+        with self.connection_pool.get_connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+            # MAX(rowid) is read from the end of the table b-tree. It counts deleted
+            # conversations too and ignores filters, which is fine for a scrollbar or "about N".
+            estimated_total = conn.execute(
+                """SELECT IFNULL(MAX(rowid), 0) FROM conversations"""
+            ).fetchone()[0]
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        return {
+            "rows": [dict(zip(selected, row)) for row in rows],
+            "next_cursor": rows[-1][0] if has_more and rows else None,
+            "estimated_total": estimated_total,
+        }
+
     def single_message_context(
         self: Self, role: Role, user_message: str, incl_timestamp: bool = True
     ) -> Message:
@@ -257,19 +604,20 @@ class ContextHandlers:
     ) -> None:
         start_prompt = self.single_message_context(role, user_message)
         self.start_prompts.append(start_prompt)
+        self._context_changed()
 
     def add_message_object(self: Self, role: Role, message: str) -> None:
         logging.debug("Adding " + role.value + " message to context")
         now = datetime.datetime.now()
         timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
-        new_message: Message = {
-            "role": role,
-            "timestamp": timestamp,
-            "content": str(message),
-        }
-        self.messages.append(new_message)
+        self.messages.append_values(timestamp, role, str(message))
+        self._context_changed()
         self.save_context()
-        logging.debug(self.messages)
+
+        if role != Role.system and self.conversation_id and self.memory is not None:
+            self.memory.enqueue(
+                self.conversation_id, timestamp, self._role_value(role), str(message)
+            )
 
     def add_message_object_at_start(self: Self, role: Role, message: str) -> None:
         logging.debug("Appending " + role.value + " message at start of context")
@@ -280,12 +628,13 @@ class ContextHandlers:
             "timestamp": timestamp,
             "content": str(message),
         }
+        self._mark_dirty(0)
         self.messages.insert(0, new_message)
         self.save_context()
-        logging.debug(self.messages)
 
     def remove_last_message_object(self: Self) -> None:
         if self.messages:
+            self._mark_dirty(len(self.messages) - 1)
             self.messages.pop()
             self.save_context()
 
@@ -293,9 +642,9 @@ class ContextHandlers:
         self: Self, user_type: Optional[Role] = None
     ) -> Message | bool:
         if user_type:
-            for message in reversed(self.messages):
-                if message["role"] == user_type:
-                    return message
+            index = self.messages.find_last(user_type)
+            if index >= 0:
+                return self.messages[index]
         else:
             if self.messages:
                 return self.messages[-1]
@@ -305,18 +654,20 @@ class ContextHandlers:
         self: Self, message: str, user_type: Optional[Role] = None
     ) -> None:
         if user_type:
-            for i in reversed(range(len(self.messages))):
-                if self.messages[i]["role"] == user_type:
-                    self.messages[i]["content"] = message
-                    self.save_context()
-                    return
+            index = self.messages.find_last(user_type)
+            if index >= 0:
+                self._mark_dirty(index)
+                self.messages.set_content(index, message)
+                self.save_context()
         elif message and self.messages:
-            self.messages[-1]["content"] = message
+            self._mark_dirty(len(self.messages) - 1)
+            self.messages.set_content(-1, message)
             self.save_context()
 
     def delete_message_at_index(self: Self, index: int) -> bool:
         try:
             if index < len(self.messages) and index >= 0:
+                self._mark_dirty(index)
                 self.messages.pop(index)
                 self.save_context()
                 return True
@@ -327,9 +678,10 @@ class ContextHandlers:
     def update_message_at_index(self: Self, message: str, index: int) -> None:
         try:
             if index < len(self.messages) and index >= 0:
-                self.messages[index]["content"] = message
+                self._mark_dirty(index)
+                self.messages.set_content(index, message)
                 now = datetime.datetime.now()
-                self.messages[index]["timestamp"] = now.strftime("%Y-%m-%d %H:%M:%S")
+                self.messages.set_timestamp(index, now.strftime("%Y-%m-%d %H:%M:%S"))
                 self.save_context()
             else:
                 raise ValueError("Index out of range")
@@ -337,20 +689,35 @@ class ContextHandlers:
             raise ValueError("Index must be an integer")
 
     def update_conversation_name_summary(
-        self: Self, conversation_id: Optional[str] = None, update_all: bool = False
+        self: Self,
+        conversation_id: Optional[str] = None,
+        update_all: bool = False,
+        max_workers: int = 4,
+        requests_per_minute: float = 60,
+        chat_factory: Optional[Callable[[], Any]] = None,
     ) -> None:
-        self.chat = Chat()
+        # Up to max_workers requests at once, each worker thread with its own client
+        summarizer = ConversationSummarizer(
+            self,
+            max_workers=max_workers,
+            requests_per_minute=requests_per_minute,
+            chat_factory=chat_factory or self.create_summary_client,
+        )
+
+        if update_all:
+            # Resumable: conversations already summarized up to their last message are skipped
+            summarizer.run(resume=True)
+            return
 
         conversation_ids: List[str] = []
 
         if conversation_id:
             conversation_ids.append(conversation_id)
-        elif update_all:
-            conversation_ids = self.get_conversation_ids()
         else:
-            conversation_ids.append(
-                self.conversation_id
-            )  # TODO: Ask @myrakrusemark about this
+            if self.conversation_id:
+                conversation_ids.append(
+                    self.conversation_id
+                )  # TODO: Ask @myrakrusemark about this
             # Get conversations with missing name or summary
             conversations = self.get_conversation_name_summary(limit=None)
             if conversations is None:
@@ -360,79 +727,100 @@ class ContextHandlers:
                     if conv_id not in conversation_ids:
                         conversation_ids.append(conv_id)
 
+        summarizer.run(conversation_ids, resume=False)
+
+    def start_summary_scheduler(
+        self: Self, idle_seconds: float = 120, interval: float = 30
+    ) -> SummaryScheduler:
+        # Refresh rolling summaries in the background once nothing has changed for idle_seconds
+        scheduler = SummaryScheduler(self, idle_seconds=idle_seconds, interval=interval)
+        scheduler.start()
+        return scheduler
+
+    def get_conversation_rows(
+        self: Self, conversation_id: str, after_rowid: Optional[int] = None
+    ) -> List[Tuple[int, str, str, str]]:
+        # (rowid, timestamp, role, message) rows of a stored conversation, oldest first.
+        # Archived rows keep their original rowids and come before any written after archiving.
+        with self.connection_pool.get_connection() as conn:
+            rows = conn.execute(
+                """
+				SELECT rowid, timestamp, role, message FROM messages
+				WHERE conversation_id = ? AND rowid > ? ORDER BY rowid
+			""",
+                (conversation_id, after_rowid or 0),
+            ).fetchall()
+        archived = self.cold_storage.get_rows(conversation_id)
+        if archived:
+            rows = [row for row in archived if row[0] > (after_rowid or 0)] + rows
+        return rows
+
+    def _role_value(self: Self, role: Role | str) -> str:
+        return role.value if isinstance(role, Role) else str(role)
+
+    def index_memories(self: Self, conversation_id: Optional[str] = None) -> int:
+        # Queue stored messages for embedding. Conversations that already have memories are skipped.
+        if self.memory is None:
+            return 0
+        if conversation_id:
+            conversation_ids = [conversation_id]
+        else:
+            indexed = set(self.memory.get_indexed_conversation_ids())
+            conversation_ids = [
+                conv_id
+                for conv_id in self.get_conversation_ids()
+                if conv_id not in indexed
+            ]
+
+        queued = 0
         for conv_id in conversation_ids:
-            messages = self.get_conversation_context_by_id(
-                conv_id, include_timestamp=False
-            )
-            # If there are no messages in the context, delete it
-
-            if not messages:
-                self.delete_conversation_by_id(
-                    conv_id
-                )  # TODO: Ask @myrakrusemark about this. Needs implementation.
-
-            # Get the name of the current conversation from the LLM
-            time.sleep(1)
-            logging.info("Updating conversation name and summary for: " + conv_id)
-
-            while True:
-                prompt = """
-				Please respond with a name, and summary for this conversation.
-				1. The name should be a single word or short phrase, no more than 5 words."
-				2. The summary should be a fairly verbose summary of the conversation, as short as possible while still containing all of the important topics, names, places, and sentiment of conversation.
-				3. The output must follow the following JSON format: {"name": name, "summary": summary}
-				4. If the conversation is empty, please respond with "Empty"
-				"""
-                if messages:
-                    messages.append(
-                        self.single_message_context(Role.system, prompt, False)
+            messages = self.get_conversation_context_by_id(conv_id)
+            for message in messages or []:
+                if message["role"] != Role.system.value:
+                    self.memory.enqueue(
+                        conv_id,
+                        message["timestamp"],
+                        message["role"],
+                        message["content"],
                     )
+                    queued += 1
+        logging.info(f"Queued {queued} messages for memory indexing")
+        return queued
 
-                    print_text("Conversation info (" + str(conv_id) + "): ", "yellow")
-                    response = self.chat.request(
-                        messages=messages, silent=False, response_label=False
-                    )
-                else:
-                    response = '{"name": "Empty Conversation", "summary": "None"}'
-
-                # Extract the JSON response from the string
-                response_match = re.search(r"{.*}", response)
-                if response_match:
-                    response_json = response_match.group(0)
-                    break
-                elif response == "Empty":
-                    response_json = '{"name": "Empty Conversation", "summary": "None"}'
-                    break
-                else:
-                    logging.error(
-                        "Invalid response format while setting conversation name and summary. Trying again..."
-                    )
-
-            # Convert the JSON response to an object
-            try:
-                response_obj = json.loads(response_json)
-            except Exception as e:
-                logging.error(
-                    "Invalid JSON response while setting conversation name and summary: "
-                    + str(e)
-                )
-                return
-
-            # Update the name and summary of the current conversation in the database
-            with self.connection_pool.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    """UPDATE conversations SET name = ?, summary = ? WHERE id = ?""",
-                    (response_obj["name"], response_obj["summary"], conv_id),
-                )
-                conn.commit()
-
-            logging.info(
-                "Name and summary updated for conversation "
-                + conv_id
+    def search_memories(
+        self: Self,
+        query: str,
+        k: int = 3,
+        include_current: bool = False,
+        min_score: float = 0.0,
+    ) -> List[MemoryMatch]:
+        if self.memory is None:
+            return []
+        exclude = []
+        if not include_current and self.conversation_id:
+            exclude.append(self.conversation_id)
+        return self.memory.search(query, k, exclude, min_score)
+
+    def get_memory_context(
+        self: Self, query: str, k: int = 3, min_score: float = 0.0
+    ) -> List[Message]:
+        # A single system message with the most relevant snippets, to prepend to a Chat.request
+        matches = self.search_memories(query, k, min_score=min_score)
+        if not matches:
+            return []
+
+        content = "Relevant snippets from past conversations:\n"
+        for match in matches:
+            content += (
+                "- ("
+                + str(match["timestamp"] or "summary")
+                + ") "
+                + match["role"].upper()
                 + ": "
-                + response_obj["name"]
+                + match["content"]
+                + "\n"
             )
+        return [self.single_message_context(Role.system.value, content, False)]
 
     def get_conversation_ids(self: Self) -> List[Any]:
         with self.connection_pool.get_connection() as conn:
@@ -441,21 +829,90 @@ class ContextHandlers:
             rows = cursor.fetchall()
             return [row[0] for row in rows]
 
+    def export_conversations(
+        self: Self, path: str, compression: Optional[str] = None
+    ) -> TransferStats:
+        # Stream every conversation and message to a JSONL file (.gz, .bz2 and .xz are compressed)
+        if self.conversation_id is not None and self.has_unsaved_changes():
+            self.save_context()
+        return ConversationTransfer(self).export_jsonl(path, compression)
+
+    def import_conversations(
+        self: Self,
+        path: str,
+        compression: Optional[str] = None,
+        on_conflict: str = "replace",
+    ) -> TransferStats:
+        if self.conversation_id is not None and self.has_unsaved_changes():
+            self.save_context()
+        stats = ConversationTransfer(self).import_jsonl(path, compression, on_conflict)
+        # The current conversation may have been replaced, so its rowids are stale
+        if self.conversation_id is not None:
+            self.load_context()
+        return stats
+
+    def archive_old_conversations(
+        self: Self,
+        older_than_days: float = 30,
+        vacuum: bool = True,
+        exclude_conversation_ids: Sequence[str] = (),
+    ) -> ArchiveReport:
+        # Compress conversations not touched in older_than_days. Open conversations are never
+        # archived: the current one, the ones passed in, and every session resident in the
+        # SessionManager this handle came from. vacuum only shrinks the file once
+        # cold_storage.enable_incremental_vacuum() has been run.
+        self.create_conversations_table_if_not_exists()
+        exclude = list(exclude_conversation_ids)
+        if self.conversation_id:
+            exclude.append(self.conversation_id)
+        if self.session_manager is not None:
+            exclude.extend(self.session_manager.resident_conversation_ids())
+        return self.cold_storage.archive(older_than_days, exclude, vacuum)
+
+    def delete_conversation_by_id(self: Self, conversation_id: str) -> None:
+        logging.info("Deleting conversation: " + conversation_id)
+        self.create_conversations_table_if_not_exists()
+        with self.connection_pool.get_connection() as conn:
+            for query in (
+                """DELETE FROM messages WHERE conversation_id = ?""",
+                """DELETE FROM archived_messages WHERE conversation_id = ?""",
+                """DELETE FROM conversations WHERE id = ?""",
+            ):
+                conn.execute(query, (conversation_id,))
+            if conn.execute(
+                """
+				SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'conversation_summary_state';
+			"""
+            ).fetchone():
+                conn.execute(
+                    """DELETE FROM conversation_summary_state WHERE conversation_id = ?""",
+                    (conversation_id,),
+                )
+        if self.memory is not None:
+            self.memory.delete_conversation(conversation_id)
+
+        # The deleted conversation may be the current one
+        if conversation_id == self.conversation_id:
+            self.new_conversation()
+
     def new_conversation(self: Self) -> None:
         # Generate a new conversation ID
-        conversation_id = str(int(time.time()))
+        conversation_id = new_conversation_id()
         logging.info("Creating a new conversation: " + conversation_id)
 
         # Set the new conversation ID in configs.yaml
-        with open("configs.yaml", "r") as f:
-            configs = yaml.load(f)
-        configs["conversation_id"] = conversation_id
-        with open("configs.yaml", "w") as f:
-            yaml.dump(configs, f)
+        if self.configs_yaml:
+            get_config_service(self.configs_yaml).set(
+                "conversation_id", value=conversation_id
+            )
 
         # Update the conversation ID and load the context
+        previous_id = self.conversation_id
         self.conversation_id = conversation_id
         self.load_context()
+        if self.session_manager is not None and previous_id is not None:
+            # A managed handle is served under its conversation id
+            self.session_manager.rekey(previous_id, self)
 
     def get_conversation_name_by_id(self: Self, conversation_id: str) -> Any | None:
         with self.connection_pool.get_connection() as conn:
@@ -492,11 +949,15 @@ class ContextHandlers:
                 cursor = conn.cursor()
                 cursor.execute(
                     """
-					SELECT timestamp, role, message FROM messages WHERE conversation_id = ?;
+					SELECT timestamp, role, message FROM messages WHERE conversation_id = ? ORDER BY rowid;
 				""",
                     (conversation_id,),
                 )
                 rows = cursor.fetchall()
+            # Messages archived before any that were written after archiving
+            archived = self.cold_storage.get_rows(conversation_id)
+            if archived:
+                rows = [row[1:] for row in archived] + rows
 
             context: List[Message] = []
             if rows:
@@ -0,0 +1,302 @@
+# Class ConversationTransfer streams conversations and messages to and from JSONL files.
+import bz2
+import gzip
+import json
+import logging
+import lzma
+import time
+
+from typing import IO, TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Set, Tuple, TypedDict
+from typing_extensions import Self
+
+if TYPE_CHECKING:
+    from .context_handlers import ContextHandlers
+
+
+COMPRESSION_OPENERS = {
+    "gzip": gzip.open,
+    "bz2": bz2.open,
+    "lzma": lzma.open,
+}
+
+COMPRESSION_EXTENSIONS = {
+    ".gz": "gzip",
+    ".bz2": "bz2",
+    ".xz": "lzma",
+    ".lzma": "lzma",
+}
+
+
+class TransferStats(TypedDict):
+    conversations: int
+    messages: int
+    skipped_conversations: int
+    seconds: float
+
+
+def open_jsonl(path: str, mode: str, compression: Optional[str] = None) -> IO[str]:
+    # compression is "gzip", "bz2", "lzma" or "none". If not given it is picked from the file extension.
+    if compression is None:
+        compression = next(
+            (c for ext, c in COMPRESSION_EXTENSIONS.items() if path.endswith(ext)), "none"
+        )
+    if compression == "none":
+        return open(path, mode + "t", encoding="utf-8")
+    if compression not in COMPRESSION_OPENERS:
+        raise ValueError(f"Unknown compression: {compression}")
+    return COMPRESSION_OPENERS[compression](path, mode + "t", encoding="utf-8")
+
+
+class ConversationTransfer:
+    description = "A class that exports and imports the conversation store as JSONL with constant memory"
+
+    def __init__(
+        self: Self,
+        ch: "ContextHandlers",
+        batch_size: int = 5000,
+        commit_every: int = 200000,
+    ) -> None:
+        self.ch = ch
+        self.batch_size = batch_size
+        # Rows written per transaction on import
+        self.commit_every = commit_every
+
+    def iter_records(self: Self) -> Iterator[Dict[str, Any]]:
+        # All conversations first, then every message in insertion order.
+        # Rows are pulled from the cursor in batches, so memory does not grow with the store.
+        with self.ch.connection_pool.get_connection() as conn:
+            cursor = conn.execute(
+                """
+				SELECT id, name, summary FROM conversations ORDER BY rowid;
+			"""
+            )
+            while True:
+                rows = cursor.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield {"type": "conversation", "id": row[0], "name": row[1], "summary": row[2]}
+
+            # Archived messages are older than any live message of the same conversation,
+            # so they go first. Blobs are unpacked one conversation at a time.
+            self.ch.cold_storage.create_archive_table_if_not_exists()
+            cursor = conn.execute(
+                """
+				SELECT conversation_id, data FROM archived_messages ORDER BY rowid;
+			"""
+            )
+            while True:
+                rows = cursor.fetchmany(1)
+                if not rows:
+                    break
+                for archived in self.ch.cold_storage._unpack(rows[0][1]):
+                    yield {
+                        "type": "message",
+                        "conversation_id": rows[0][0],
+                        "timestamp": archived[1],
+                        "role": archived[2],
+                        "message": archived[3],
+                    }
+
+            cursor = conn.execute(
+                """
+				SELECT conversation_id, timestamp, role, message FROM messages ORDER BY rowid;
+			"""
+            )
+            while True:
+                rows = cursor.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield {
+                        "type": "message",
+                        "conversation_id": row[0],
+                        "timestamp": row[1],
+                        "role": row[2],
+                        "message": row[3],
+                    }
+
+    def export_jsonl(self: Self, path: str, compression: Optional[str] = None) -> TransferStats:
+        self.ch.create_conversations_table_if_not_exists()
+        start = time.perf_counter()
+        stats: TransferStats = {
+            "conversations": 0,
+            "messages": 0,
+            "skipped_conversations": 0,
+            "seconds": 0.0,
+        }
+
+        lines: List[str] = []
+        with open_jsonl(path, "w", compression) as f:
+            for record in self.iter_records():
+                if record["type"] == "conversation":
+                    stats["conversations"] += 1
+                else:
+                    stats["messages"] += 1
+                lines.append(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+                if len(lines) >= self.batch_size:
+                    f.writelines(lines)
+                    lines = []
+            f.writelines(lines)
+
+        stats["seconds"] = time.perf_counter() - start
+        logging.info(
+            f"Exported {stats['conversations']} conversations and {stats['messages']} messages to {path}"
+        )
+        return stats
+
+    def import_jsonl(
+        self: Self,
+        path: str,
+        compression: Optional[str] = None,
+        on_conflict: str = "replace",
+    ) -> TransferStats:
+        # on_conflict="replace" overwrites conversations that already exist (and their messages, archived or not),
+        # on_conflict="skip" keeps the existing ones and ignores their records in the file.
+        # Either is decided when a conversation id is first read, from its conversation record or
+        # from a message, so the records of a conversation may come in any order.
+        if on_conflict not in ("replace", "skip"):
+            raise ValueError(f"Unknown on_conflict: {on_conflict}")
+
+        self.ch.create_conversations_table_if_not_exists()
+        self.ch.cold_storage.create_archive_table_if_not_exists()
+        start = time.perf_counter()
+        stats: TransferStats = {
+            "conversations": 0,
+            "messages": 0,
+            "skipped_conversations": 0,
+            "seconds": 0.0,
+        }
+
+        seen: Set[str] = set()
+        skipped: Set[str] = set()
+        conversations: List[Tuple[str, str, str]] = []
+        messages: List[Tuple[str, str, str, str]] = []
+        uncommitted = 0
+
+        with self.ch.connection_pool.get_connection() as conn:
+            # Replaced conversations are summarized again from their new messages
+            replace_queries = [
+                """DELETE FROM messages WHERE conversation_id = ?""",
+                """DELETE FROM archived_messages WHERE conversation_id = ?""",
+            ]
+            if conn.execute(
+                """
+				SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'conversation_summary_state';
+			"""
+            ).fetchone():
+                replace_queries.append(
+                    """DELETE FROM conversation_summary_state WHERE conversation_id = ?"""
+                )
+
+            def first_seen(conversation_id: str) -> bool:
+                # Called once per conversation id, before any of its rows are written.
+                # False if the conversation is skipped.
+                seen.add(conversation_id)
+                if on_conflict == "skip":
+                    if conn.execute(
+                        """
+						SELECT 1 FROM conversations WHERE id = ?;
+					""",
+                        (conversation_id,),
+                    ).fetchone():
+                        skipped.add(conversation_id)
+                        stats["skipped_conversations"] += 1
+                        return False
+                else:
+                    for query in replace_queries:
+                        conn.execute(query, (conversation_id,))
+                return True
+
+            def flush_conversations() -> None:
+                nonlocal conversations, uncommitted
+                if not conversations:
+                    return
+                # Existing rows are either ours (placeholders written for messages that came before
+                # their conversation record) or being replaced. Skipped conversations never get here.
+                conn.executemany(
+                    """
+					INSERT OR REPLACE INTO conversations (id, name, summary)
+					VALUES (?, ?, ?);
+				""",
+                    conversations,
+                )
+                uncommitted += len(conversations)
+                conversations = []
+
+            def flush_messages() -> None:
+                nonlocal messages, uncommitted
+                if not messages:
+                    return
+                conn.executemany(
+                    """
+					INSERT INTO messages (conversation_id, timestamp, role, message)
+					VALUES (?, ?, ?, ?);
+				""",
+                    messages,
+                )
+                uncommitted += len(messages)
+                messages = []
+                if uncommitted >= self.commit_every:
+                    conn.commit()
+                    uncommitted = 0
+
+            try:
+                with open_jsonl(path, "r", compression) as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        record = json.loads(line)
+
+                        if record.get("type") == "conversation":
+                            conversation_id = record["id"]
+                            if conversation_id in skipped:
+                                continue
+                            if conversation_id not in seen and not first_seen(conversation_id):
+                                continue
+                            conversations.append(
+                                (conversation_id, record.get("name", "No name"), record.get("summary", "No summary"))
+                            )
+                            stats["conversations"] += 1
+                            if len(conversations) >= self.batch_size:
+                                flush_conversations()
+
+                        elif record.get("type") == "message":
+                            conversation_id = record["conversation_id"]
+                            if conversation_id in skipped:
+                                continue
+                            if conversation_id not in seen:
+                                if not first_seen(conversation_id):
+                                    continue
+                                # Until its conversation record is read, if there is one, a message
+                                # gets a placeholder conversation, like save_context
+                                conn.execute(
+                                    """
+									INSERT OR IGNORE INTO conversations (id, name, summary)
+									VALUES (?, ?, ?);
+								""",
+                                    (conversation_id, "No name", "No summary"),
+                                )
+                            messages.append(
+                                (conversation_id, record["timestamp"], record["role"], record["message"])
+                            )
+                            stats["messages"] += 1
+                            if len(messages) >= self.batch_size:
+                                flush_messages()
+
+                        else:
+                            logging.warning("Skipping unknown record type: " + str(record.get("type")))
+
+                    flush_conversations()
+                    flush_messages()
+                conn.commit()
+            except Exception:
+                # Rows from earlier transactions stay, the current one is rolled back
+                conn.rollback()
+                raise
+
+        stats["seconds"] = time.perf_counter() - start
+        logging.info(
+            f"Imported {stats['conversations']} conversations and {stats['messages']} messages from {path}"
+        )
+        return stats
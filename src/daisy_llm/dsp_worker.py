@@ -0,0 +1,402 @@
+# Class DspWorker runs time-stretching, volume and format conversion in a separate process, so the audio path does not compete for the GIL.
+import ast
+import functools
+import logging
+import multiprocessing
+import sys
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import Future, InvalidStateError
+from multiprocessing import shared_memory
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+from typing_extensions import Self
+
+from .pcm import PcmClip, apply_volume, convert_format
+from .time_stretch import time_stretch
+
+ALIGNMENT = 64
+
+
+def process_samples(
+    samples: np.ndarray,
+    channels: int,
+    sample_rate: int,
+    speed: float = 1.0,
+    volume: float = 1.0,
+    out_channels: Optional[int] = None,
+    out_sample_rate: Optional[int] = None,
+    in_place: bool = False,
+) -> np.ndarray:
+    # Time-stretch, then volume, then conversion to the output format. Unchanged input is returned as is.
+    # The input is only changed with in_place, for buffers the caller does not use again.
+    out_channels = out_channels or channels
+    out_sample_rate = out_sample_rate or sample_rate
+    if speed != 1.0:
+        samples = time_stretch(samples, channels, sample_rate, speed)
+        in_place = True  # A new buffer
+    samples = apply_volume(samples, volume, in_place)
+    return convert_format(samples, channels, sample_rate, out_channels, out_sample_rate)
+
+
+def process_clip(
+    clip: PcmClip,
+    speed: float = 1.0,
+    volume: float = 1.0,
+    out_channels: Optional[int] = None,
+    out_sample_rate: Optional[int] = None,
+) -> PcmClip:
+    out_channels = out_channels or clip.channels
+    out_sample_rate = out_sample_rate or clip.sample_rate
+    samples = process_samples(clip.samples, clip.channels, clip.sample_rate, speed, volume, out_channels, out_sample_rate)
+    return PcmClip(samples, out_channels, out_sample_rate)
+
+
+def output_length(frames: int, sample_rate: int, speed: float, out_channels: int, out_sample_rate: int) -> int:
+    # Upper bound on the samples process_samples returns, as computed there
+    if speed != 1.0:
+        frames = int(round(frames / speed))
+    if out_sample_rate != sample_rate:
+        frames = int(round(frames * out_sample_rate / sample_rate))
+    return (frames + 1) * out_channels
+
+
+def worker_main(shm_name: str, connection: Any) -> None:
+    # Runs in the worker process. Jobs name regions of the shared memory, only these small tuples
+    # go through the pipe.
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        while True:
+            try:
+                job = connection.recv()
+            except EOFError:
+                break
+            if job is None:
+                break
+            job_id, in_offset, in_count, channels, sample_rate, speed, volume, out_channels, out_sample_rate, out_offset, out_count = job
+            samples = np.ndarray((in_count,), np.int16, shm.buf, in_offset)
+            out = np.ndarray((out_count,), np.int16, shm.buf, out_offset)
+            result = None
+            try:
+                # The input region belongs to this job, so volume may be applied to it in place
+                result = process_samples(samples, channels, sample_rate, speed, volume, out_channels, out_sample_rate, in_place=True)
+                count = min(len(result), out_count)
+                out[:count] = result[:count]
+                reply = (job_id, count, None)
+            except Exception as e:
+                reply = (job_id, 0, str(e))
+            # Views of the shared memory have to be gone before it can be closed
+            del samples, out, result
+            connection.send(reply)
+    finally:
+        shm.close()
+
+
+def is_main_guard(node: ast.stmt) -> bool:
+    # if __name__ == "__main__":
+    test = getattr(node, "test", None)
+    return (
+        isinstance(node, ast.If)
+        and isinstance(test, ast.Compare)
+        and isinstance(test.left, ast.Name)
+        and test.left.id == "__name__"
+        and len(test.comparators) == 1
+        and isinstance(test.comparators[0], ast.Constant)
+        and test.comparators[0].value == "__main__"
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def spawn_is_safe() -> bool:
+    # spawn imports the main script again in the worker process. That is only harmless when the
+    # script does its work under an `if __name__ == "__main__":` guard, so its source is checked:
+    # at the top level only imports, definitions, docstrings and assignments without calls.
+    path = getattr(sys.modules.get("__main__"), "__file__", None)
+    if path is None:
+        return True  # An interactive session, nothing is imported again
+    try:
+        with open(path, encoding="utf-8") as f:
+            tree = ast.parse(f.read())
+    except (OSError, SyntaxError, ValueError):
+        return False
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+        if isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant):
+            continue
+        if isinstance(node, (ast.Assign, ast.AnnAssign)) and not any(isinstance(n, ast.Call) for n in ast.walk(node)):
+            continue
+        if is_main_guard(node):
+            continue
+        return False
+    return True
+
+
+class RingAllocator:
+    description = "Allocates regions of a shared memory block in ring order, freed in any order"
+
+    # Not synchronized, DspWorker holds its lock around every call
+
+    def __init__(self: Self, start: int, capacity: int) -> None:
+        self.start = start
+        self.capacity = capacity
+        self.head = 0  # Offset of the oldest live region, relative to start
+        self.tail = 0  # Offset after the newest one
+        self.regions: Deque[List[Any]] = deque()  # [offset, size, freed], in allocation order
+
+    def allocate(self: Self, size: int) -> Optional[int]:
+        size = (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+        if size > self.capacity:
+            return None
+        if not self.regions:
+            self.head = self.tail = 0
+        if self.tail >= self.head:
+            if self.tail + size <= self.capacity:
+                offset = self.tail
+            elif size < self.head:  # Wrap around, the end of the block is left unused
+                offset = 0
+            else:
+                return None
+        elif self.tail + size < self.head:
+            offset = self.tail
+        else:
+            return None
+        self.regions.append([offset, size, False])
+        self.tail = offset + size
+        return self.start + offset
+
+    def free(self: Self, offset: int) -> None:
+        for region in self.regions:
+            if region[0] == offset - self.start:
+                region[2] = True
+                break
+        while self.regions and self.regions[0][2]:
+            self.regions.popleft()
+        if self.regions:
+            self.head = self.regions[0][0]
+
+
+class DspWorker:
+    description = "A worker process that processes PCM clips through shared memory ring buffers"
+
+    # The shared memory block holds an input ring and an output ring. The caller copies a clip into
+    # the input ring and reserves room for the result in the output ring, the worker reads one and
+    # writes the other, and the caller copies the result out. Clips larger than a ring are processed
+    # in this process instead, and so is everything once the worker has died: pending jobs, and
+    # clips that process() has waited timeout seconds for.
+    # The worker process is started on the first clip. It is started with spawn, which imports the
+    # main script again in the worker, so it is only started when that is safe (spawn_is_safe).
+    # Otherwise, and after close(), clips are processed in this process.
+
+    def __init__(self: Self, ring_bytes: int = 16 * 1024 * 1024, timeout: float = 5.0) -> None:
+        self.ring_bytes = ring_bytes
+        self.timeout = timeout
+        self.lock = threading.Condition()
+        self.shm: Optional[shared_memory.SharedMemory] = None
+        self.worker_process: Optional[multiprocessing.process.BaseProcess] = None
+        self.connection: Any = None
+        self.receiver: Optional[threading.Thread] = None
+        self.exited = False  # Set by the receiver once the worker is gone and its jobs are taken over
+        self.inputs = RingAllocator(0, ring_bytes)
+        self.outputs = RingAllocator(ring_bytes, ring_bytes)
+        # job id: (future, input offset, output offset, arguments of process_clip)
+        self.jobs: Dict[int, Tuple[Future, int, int, Tuple[Any, ...]]] = {}
+        self.next_job_id = 0
+        self.fallbacks = 0
+        self.closed = False
+
+    def start(self: Self) -> bool:
+        # Starts the worker process if it is not running. Returns whether it was started (or running).
+        with self.lock:
+            if self.worker_process is not None:
+                return True
+            if self.closed:
+                return False
+            if not spawn_is_safe():
+                self.closed = True
+                logging.warning(
+                    "The main script runs code outside an if __name__ == \"__main__\": guard, "
+                    "audio is processed in process instead of a DSP worker"
+                )
+                return False
+            self.shm = shared_memory.SharedMemory(create=True, size=2 * self.ring_bytes)
+            # Spawn rather than fork: the parent has audio and network threads running
+            context = multiprocessing.get_context("spawn")
+            self.connection, child_connection = context.Pipe()
+            self.worker_process = context.Process(target=worker_main, args=(self.shm.name, child_connection), name="dsp-worker")
+            self.worker_process.daemon = True
+            self.worker_process.start()
+            self.exited = False
+            child_connection.close()
+            self.receiver = threading.Thread(target=self._receive_loop, name="dsp-receiver")
+            self.receiver.daemon = True
+            self.receiver.start()
+            logging.info(f"Started DSP worker process {self.worker_process.pid}")
+            return True
+
+    def _receive_loop(self: Self) -> None:
+        while True:
+            try:
+                job_id, count, error = self.connection.recv()
+            except (EOFError, OSError):
+                break
+            with self.lock:
+                future, in_offset, out_offset, job = self.jobs.pop(job_id)
+                _, _, _, out_channels, out_sample_rate = job
+                if error is None:
+                    # Copy the result out, so the output region can be reused
+                    samples = np.ndarray((count,), np.int16, self.shm.buf, out_offset).copy()  # type: ignore[union-attr]
+                self.inputs.free(in_offset)
+                self.outputs.free(out_offset)
+                self.lock.notify_all()
+            try:
+                if error is None:
+                    future.set_result(PcmClip(samples, out_channels, out_sample_rate))
+                else:
+                    future.set_exception(RuntimeError(f"DSP worker: {error}"))
+            except InvalidStateError:
+                pass  # Already processed here after a timeout
+        # The worker is gone, whatever is still waiting is processed here
+        with self.lock:
+            jobs, self.jobs = self.jobs, {}
+            self.exited = True
+            self.lock.notify_all()
+        if jobs:
+            logging.warning(f"DSP worker exited, processing {len(jobs)} pending clips in process")
+        for future, _, _, job in jobs.values():
+            self._process_here(future, job)
+
+    def is_alive(self: Self) -> bool:
+        return self.worker_process is not None and not self.exited and self.worker_process.is_alive()
+
+    def _process_here(self: Self, future: "Future[PcmClip]", job: Tuple[Any, ...]) -> None:
+        self.fallbacks += 1
+        try:
+            try:
+                future.set_result(process_clip(*job))
+            except Exception as e:
+                future.set_exception(e)
+        except InvalidStateError:
+            pass  # The worker answered meanwhile
+
+    def submit(
+        self: Self,
+        clip: PcmClip,
+        speed: float = 1.0,
+        volume: float = 1.0,
+        out_channels: Optional[int] = None,
+        out_sample_rate: Optional[int] = None,
+    ) -> "Future[PcmClip]":
+        out_channels = out_channels or clip.channels
+        out_sample_rate = out_sample_rate or clip.sample_rate
+        job = (clip, speed, volume, out_channels, out_sample_rate)
+        future: "Future[PcmClip]" = Future()
+        in_count = len(clip.samples)
+        out_count = output_length(clip.frames, clip.sample_rate, speed, out_channels, out_sample_rate)
+        if 2 * max(in_count, out_count) > self.ring_bytes:
+            self._process_here(future, job)
+            return future
+
+        if not self.start():
+            self._process_here(future, job)
+            return future
+        deadline = time.monotonic() + self.timeout
+        with self.lock:
+            in_offset = out_offset = None
+            while self.is_alive():
+                in_offset = self.inputs.allocate(2 * in_count)
+                out_offset = self.outputs.allocate(2 * out_count) if in_offset is not None else None
+                if out_offset is not None:
+                    break
+                if in_offset is not None:
+                    self.inputs.free(in_offset)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break  # The worker holds the rings, maybe stuck
+                self.lock.wait(remaining)  # Until a running job frees its regions or the worker exits
+            if out_offset is not None and self.is_alive():
+                np.ndarray((in_count,), np.int16, self.shm.buf, in_offset)[:] = clip.samples  # type: ignore[union-attr]
+                job_id = self.next_job_id
+                self.next_job_id += 1
+                self.jobs[job_id] = (future, in_offset, out_offset, job)
+                try:
+                    self.connection.send(
+                        (job_id, in_offset, in_count, clip.channels, clip.sample_rate, speed, volume, out_channels, out_sample_rate, out_offset, out_count)
+                    )
+                    return future
+                except (BrokenPipeError, OSError):
+                    del self.jobs[job_id]
+            if out_offset is not None:
+                self.inputs.free(in_offset)  # type: ignore[arg-type]
+                self.outputs.free(out_offset)
+            alive = self.is_alive()
+        if alive:
+            logging.warning(f"DSP worker had no room for {self.timeout} seconds, processing the clip in process")
+        else:
+            logging.debug("DSP worker is not running, processing the clip in process")
+        self._process_here(future, job)
+        return future
+
+    def process(
+        self: Self,
+        clip: PcmClip,
+        speed: float = 1.0,
+        volume: float = 1.0,
+        out_channels: Optional[int] = None,
+        out_sample_rate: Optional[int] = None,
+    ) -> PcmClip:
+        future = self.submit(clip, speed, volume, out_channels, out_sample_rate)
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            # A stuck worker must not stall playback, the late result is dropped
+            logging.warning(f"DSP worker did not answer in {self.timeout} seconds, processing the clip in process")
+            self._process_here(future, (clip, speed, volume, out_channels, out_sample_rate))
+            return future.result()
+
+    def close(self: Self) -> None:
+        # Stops the worker process, later clips are processed in this process
+        with self.lock:
+            self.closed = True
+            process, self.worker_process = self.worker_process, None
+            if process is None:
+                return
+            try:
+                self.connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass  # Already exited
+        process.join(timeout=5)
+        if process.is_alive():
+            process.kill()
+        self.connection.close()
+        if self.receiver is not None:
+            self.receiver.join(timeout=5)
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+
+worker: Optional[DspWorker] = None
+worker_lock = threading.Lock()
+
+
+def get_dsp_worker() -> DspWorker:
+    # The one DSP worker of the process. Its process is started by the first clip.
+    global worker
+    with worker_lock:
+        if worker is None:
+            worker = DspWorker()
+        return worker
+
+
+def close_dsp_worker() -> None:
+    # Stops the DSP worker of the process, if there is one. A later get_dsp_worker() makes a new one.
+    global worker
+    with worker_lock:
+        closing, worker = worker, None
+    if closing is not None:
+        closing.close()
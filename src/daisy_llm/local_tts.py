@@ -0,0 +1,123 @@
+# Class LocalTts is a built-in offline TTS module that renders speech to in-memory 16-bit WAV with espeak or pyttsx3.
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, List, Optional
+from typing_extensions import Self
+
+from .pcm import decode_audio, parse_wav_header
+
+BACKENDS = ("espeak", "pyttsx3")
+
+
+def find_espeak() -> Optional[str]:
+    return shutil.which("espeak-ng") or shutil.which("espeak")
+
+
+class LocalTts:
+    description = "Offline text-to-speech, rendered to 16-bit WAV buffers on a worker thread"
+
+    # Has the interface of a Tts hook module: create_tts_audio(text) returns audio bytes, so
+    # ChatSpeechProcessor uses it like any other TTS module (cache, speed, pipeline).
+    # - espeak runs espeak-ng (or espeak) with --stdout, one process per sentence, so sentences
+    #   from parallel pipeline workers are rendered at the same time.
+    # - pyttsx3 renders with save_to_file into a temporary file. Its engine is not thread safe and
+    #   belongs to the thread that created it, so a single worker thread owns it and renders in turn.
+    # "auto" picks espeak when it is installed, and pyttsx3 otherwise.
+    # Settings come from the LocalTts section in configs.yaml: backend, voice, rate (words a minute).
+
+    def __init__(
+        self: Self,
+        backend: str = "auto",
+        voice: Optional[str] = None,
+        rate: Optional[int] = None,
+    ) -> None:
+        self.voice = voice
+        self.rate = rate
+        self.espeak = find_espeak()
+        if backend == "auto":
+            backend = "espeak" if self.espeak else "pyttsx3"
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown local TTS backend: {backend}")
+        if backend == "espeak" and self.espeak is None:
+            raise RuntimeError("espeak-ng or espeak is not installed")
+        self.backend = backend
+
+        # espeak renders sentences side by side. The pyttsx3 engine is created by the one worker
+        # thread on its first job and only used from it.
+        self.executor = ThreadPoolExecutor(
+            max_workers=4 if backend == "espeak" else 1, thread_name_prefix="local-tts"
+        )
+        self.engine: Any = None
+        self.lock = threading.Lock()
+        self.active = 0  # create_tts_audio calls under way
+        self.closing = False
+
+    def render(self: Self, text: str) -> "Future[bytes]":
+        # Starts rendering and returns at once. The future's result is a 16-bit WAV.
+        # Raises RuntimeError once the executor is shut down.
+        render = self._render_espeak if self.backend == "espeak" else self._render_pyttsx3
+        return self.executor.submit(lambda: normalize_wav(render(text)))
+
+    def create_tts_audio(self: Self, text: str) -> bytes:
+        # Blocks the calling thread, a TTS pipeline worker, until the sentence is rendered
+        with self.lock:
+            self.active += 1
+        try:
+            return self.render(text).result()
+        finally:
+            with self.lock:
+                self.active -= 1
+                if self.closing and self.active == 0:
+                    self.executor.shutdown(wait=False)
+
+    def close(self: Self) -> None:
+        # Returns at once. Sentences being rendered, and renders already queued, still finish,
+        # and the executor shuts down once the last create_tts_audio call returns.
+        with self.lock:
+            self.closing = True
+            if self.active == 0:
+                self.executor.shutdown(wait=False)
+
+    def _render_espeak(self: Self, text: str) -> bytes:
+        command: List[str] = [str(self.espeak), "--stdout"]
+        if self.voice:
+            command += ["-v", self.voice]
+        if self.rate:
+            command += ["-s", str(int(self.rate))]
+        result = subprocess.run(command, input=text.encode("utf-8"), capture_output=True, check=True)
+        return result.stdout
+
+    def _render_pyttsx3(self: Self, text: str) -> bytes:
+        if self.engine is None:
+            import pyttsx3
+
+            self.engine = pyttsx3.init()
+            if self.voice:
+                self.engine.setProperty("voice", self.voice)
+            if self.rate:
+                self.engine.setProperty("rate", int(self.rate))
+
+        handle, path = tempfile.mkstemp(suffix=".wav", prefix="daisy_tts_")
+        os.close(handle)
+        try:
+            self.engine.save_to_file(text, path)
+            self.engine.runAndWait()
+            with open(path, "rb") as f:
+                return f.read()
+        finally:
+            os.remove(path)
+
+
+def normalize_wav(data: bytes) -> bytes:
+    # 16-bit WAV is returned as is. Anything else the engine wrote (AIFF on macOS, 8-bit wav) is
+    # decoded once here, so playback never has to.
+    if not data:
+        raise RuntimeError("The local TTS backend rendered no audio")
+    if parse_wav_header(data) is not None:
+        return data
+    return decode_audio(data).to_wav()
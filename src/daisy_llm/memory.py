@@ -0,0 +1,272 @@
+# Long-term semantic memory over past conversations.
+import logging
+import queue
+import threading
+
+import numpy as np
+import openai
+
+from typing import Callable, List, Optional, Sequence, Tuple, TypedDict
+from typing_extensions import Self
+
+from .connection_pool import ConnectionPool
+
+
+EmbedFunction = Callable[[List[str]], np.ndarray]
+
+
+class MemoryMatch(TypedDict):
+    conversation_id: str
+    timestamp: Optional[str]
+    role: str
+    content: str
+    score: float
+
+
+def openai_embed(texts: List[str]) -> np.ndarray:
+    response = openai.Embedding.create(model="text-embedding-ada-002", input=texts)
+    data = sorted(response["data"], key=lambda item: item["index"])
+    return np.array([item["embedding"] for item in data], dtype=np.float32)
+
+
+class MemoryStore:
+    description = "A class for embedding past messages in the background and retrieving the most relevant ones"
+
+    # Embeddings are unit-normalized and stored as float16 blobs, so cosine similarity is a dot product
+    dtype = np.float16
+    max_chars = 4000
+
+    def __init__(
+        self: Self,
+        connection_pool: ConnectionPool,
+        embed_fn: Optional[EmbedFunction] = None,
+        batch_size: int = 16,
+    ) -> None:
+        self.connection_pool = connection_pool
+        self.embed_fn: EmbedFunction = embed_fn or openai_embed
+        self.batch_size = batch_size
+
+        # In-memory copy of the vector table, refreshed incrementally by id
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.conversation_ids = np.zeros(0, dtype=object)
+        self.last_id = 0
+        self.lock = threading.Lock()
+
+        # The embedding thread is started by the first enqueue()
+        self.queue: queue.Queue[Tuple[str, Optional[str], str, str]] = queue.Queue()
+        self.thread: Optional[threading.Thread] = None
+
+    def create_memories_table_if_not_exists(self: Self) -> None:
+        with self.connection_pool.get_connection() as conn:
+            conn.execute(
+                """
+				CREATE TABLE IF NOT EXISTS memories (
+					id INTEGER PRIMARY KEY,
+					conversation_id TEXT NOT NULL,
+					timestamp TEXT,
+					role TEXT NOT NULL,
+					content TEXT NOT NULL,
+					embedding BLOB NOT NULL
+				);
+			"""
+            )
+            conn.execute(
+                """
+				CREATE INDEX IF NOT EXISTS memories_conversation_id
+				ON memories (conversation_id);
+			"""
+            )
+
+    def enqueue(
+        self: Self,
+        conversation_id: str,
+        timestamp: Optional[str],
+        role: str,
+        content: str,
+    ) -> None:
+        if content and content.strip():
+            self.queue.put((conversation_id, timestamp, role, content))
+            if self.thread is None:
+                with self.lock:
+                    if self.thread is None:
+                        self.thread = threading.Thread(target=self._embed_loop)
+                        self.thread.daemon = True
+                        self.thread.start()
+
+    def _embed_loop(self: Self) -> None:
+        self.create_memories_table_if_not_exists()
+        while True:
+            if self.queue.empty():
+                # Nothing to store, so the pooled connection goes back to the pool while waiting
+                self.connection_pool.release_connection()
+            batch = [self.queue.get()]  # Block until there is work to do
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self._store(batch)
+            except Exception as e:
+                logging.error("Failed to embed memories: " + str(e))
+
+    def _store(self: Self, batch: List[Tuple[str, Optional[str], str, str]]) -> None:
+        vectors = self._normalize(
+            self.embed_fn([content[: self.max_chars] for _, _, _, content in batch])
+        )
+        replaced: List[int] = []
+        with self.connection_pool.get_connection() as conn:
+            for (conversation_id, timestamp, role, content), vector in zip(
+                batch, vectors
+            ):
+                # A conversation only has one summary memory, replace the old one
+                if role == "summary":
+                    replaced += [
+                        row[0]
+                        for row in conn.execute(
+                            """SELECT id FROM memories WHERE conversation_id = ? AND role = ?""",
+                            (conversation_id, role),
+                        )
+                    ]
+                    conn.execute(
+                        """DELETE FROM memories WHERE conversation_id = ? AND role = ?""",
+                        (conversation_id, role),
+                    )
+                conn.execute(
+                    """
+					INSERT INTO memories (conversation_id, timestamp, role, content, embedding)
+					VALUES (?, ?, ?, ?, ?);
+				""",
+                    (
+                        conversation_id,
+                        timestamp,
+                        role,
+                        content,
+                        vector.astype(self.dtype).tobytes(),
+                    ),
+                )
+        if replaced:
+            with self.lock:
+                self._forget(~np.isin(self.ids, replaced))
+        logging.debug(f"Stored {len(batch)} memories")
+
+    def _normalize(self: Self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _refresh(self: Self) -> None:
+        # Only pull rows added since the last refresh
+        with self.connection_pool.get_connection() as conn:
+            rows = conn.execute(
+                """SELECT id, conversation_id, embedding FROM memories WHERE id > ? ORDER BY id""",
+                (self.last_id,),
+            ).fetchall()
+
+        # Deleted rows are removed from the matrix by whoever deletes them, with _forget()
+        if not rows:
+            return
+
+        new_matrix = np.vstack(
+            [np.frombuffer(row[2], dtype=self.dtype) for row in rows]
+        ).astype(np.float32)
+        if self.matrix.size:
+            self.matrix = np.vstack([self.matrix, new_matrix])
+        else:
+            self.matrix = new_matrix
+        self.ids = np.concatenate([self.ids, np.array([row[0] for row in rows])])
+        self.conversation_ids = np.concatenate(
+            [self.conversation_ids, np.array([row[1] for row in rows], dtype=object)]
+        )
+        self.last_id = rows[-1][0]
+
+    def _forget(self: Self, keep: np.ndarray) -> None:
+        # Called with self.lock held. Drops the rows of the matrix where keep is False.
+        if self.ids.size and not keep.all():
+            self.matrix = self.matrix[keep]
+            self.ids = self.ids[keep]
+            self.conversation_ids = self.conversation_ids[keep]
+            # SQLite gives a new row the largest id plus one, so ids of deleted rows at the end
+            # are handed out again and have to be refreshed
+            self.last_id = int(self.ids.max()) if self.ids.size else 0
+
+    def reload(self: Self) -> None:
+        with self.lock:
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+            self.ids = np.zeros(0, dtype=np.int64)
+            self.conversation_ids = np.zeros(0, dtype=object)
+            self.last_id = 0
+            self._refresh()
+
+    def search(
+        self: Self,
+        query: str,
+        k: int = 3,
+        exclude_conversation_ids: Sequence[str] = (),
+        min_score: float = 0.0,
+    ) -> List[MemoryMatch]:
+        self.create_memories_table_if_not_exists()
+        with self.lock:
+            self._refresh()
+            if not self.ids.size or k <= 0:
+                return []
+
+            query_vector = self._normalize(self.embed_fn([query[: self.max_chars]]))[0]
+            scores = self.matrix @ query_vector
+            if exclude_conversation_ids:
+                scores[np.isin(self.conversation_ids, list(exclude_conversation_ids))] = -np.inf
+
+            # Partial sort for the top k, then order just those
+            k = min(k, scores.size)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            top = top[scores[top] >= min_score]
+            top_ids = self.ids[top].tolist()
+            top_scores = scores[top].tolist()
+
+        if not top_ids:
+            return []
+
+        with self.connection_pool.get_connection() as conn:
+            rows = conn.execute(
+                f"""SELECT id, conversation_id, timestamp, role, content FROM memories
+				WHERE id IN ({",".join("?" * len(top_ids))})""",
+                top_ids,
+            ).fetchall()
+        rows_by_id = {row[0]: row for row in rows}
+
+        matches: List[MemoryMatch] = []
+        for memory_id, score in zip(top_ids, top_scores):
+            row = rows_by_id.get(memory_id)
+            if row:
+                matches.append(
+                    MemoryMatch(
+                        conversation_id=row[1],
+                        timestamp=row[2],
+                        role=row[3],
+                        content=row[4],
+                        score=score,
+                    )
+                )
+        return matches
+
+    def delete_conversation(self: Self, conversation_id: str) -> None:
+        self.create_memories_table_if_not_exists()
+        with self.connection_pool.get_connection() as conn:
+            conn.execute(
+                """DELETE FROM memories WHERE conversation_id = ?""",
+                (conversation_id,),
+            )
+        with self.lock:
+            self._forget(self.conversation_ids != conversation_id)
+
+    def get_indexed_conversation_ids(self: Self) -> List[str]:
+        self.create_memories_table_if_not_exists()
+        with self.connection_pool.get_connection() as conn:
+            rows = conn.execute(
+                """SELECT DISTINCT conversation_id FROM memories"""
+            ).fetchall()
+            return [row[0] for row in rows]
@@ -0,0 +1,267 @@
+# Class MessageStore keeps conversation messages in compact columnar arrays.
+import datetime
+import sys
+
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, overload
+from typing_extensions import Self
+
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+NO_TIMESTAMP = -(2**63)
+# Timestamps that are not stored as epoch seconds are kept as strings. Their entry in the timestamps
+# array is a code from RAW_TIMESTAMP up, far below any real epoch, that keys the string table.
+RAW_TIMESTAMP = NO_TIMESTAMP + 1
+RAW_TIMESTAMP_LIMIT = -(2**62)
+
+
+def estimate_tokens(text: str) -> int:
+    # Rough token count (about four characters per token) plus per-message overhead
+    return len(text) // 4 + 4
+
+
+def timestamp_to_epoch(timestamp: Optional[str]) -> Optional[int]:
+    # Epoch seconds, only for timestamps that epoch_to_timestamp gives back unchanged
+    # ("%Y-%m-%d %H:%M:%S" local time). None for anything else: other formats, time zones,
+    # fractions of a second.
+    if not timestamp:
+        return None
+    try:
+        epoch = int(datetime.datetime.fromisoformat(timestamp).timestamp())
+    except (ValueError, OverflowError, OSError):
+        return None
+    return epoch if epoch_to_timestamp(epoch) == timestamp else None
+
+
+def epoch_to_timestamp(epoch: int) -> Optional[str]:
+    if epoch == NO_TIMESTAMP:
+        return None
+    return datetime.datetime.fromtimestamp(epoch).strftime(TIMESTAMP_FORMAT)
+
+
+class MessageStore:
+    description = "A compact, list-like store of messages that are converted to message dicts only when read"
+
+    # Roles are interned into a small table and stored as one byte per message.
+    # Timestamps are epoch seconds when that round-trips exactly, any other timestamp string is
+    # kept as it is. All message text lives in one UTF-8 buffer where message i is
+    # text[offsets[i]:offsets[i + 1]].
+    __slots__ = (
+        "_roles", "_role_names", "_role_ids", "_timestamps", "_raw_timestamps", "_next_raw", "_offsets", "_text"
+    )
+
+    def __init__(self: Self, messages: Iterable[Dict[str, Any]] = ()) -> None:
+        self._roles = array("B")
+        self._role_names: List[str] = []
+        self._role_ids: Dict[str, int] = {}
+        self._timestamps = array("q")
+        # code -> timestamp string, entries are dropped with the message that uses them
+        self._raw_timestamps: Dict[int, str] = {}
+        self._next_raw = RAW_TIMESTAMP
+        self._offsets = array("Q", [0])
+        self._text = bytearray()
+        self.extend(messages)
+
+    def _role_id(self: Self, role: Any) -> int:
+        name = getattr(role, "value", role)
+        role_id = self._role_ids.get(name)
+        if role_id is None:
+            role_id = len(self._role_names)
+            self._role_names.append(sys.intern(str(name)))
+            self._role_ids[name] = role_id
+        return role_id
+
+    def _encode_timestamp(self: Self, timestamp: Optional[str]) -> int:
+        if not timestamp:
+            return NO_TIMESTAMP
+        epoch = timestamp_to_epoch(timestamp)
+        if epoch is not None:
+            return epoch
+        code = self._next_raw
+        self._next_raw += 1
+        self._raw_timestamps[code] = str(timestamp)
+        return code
+
+    def _decode_timestamp(self: Self, code: int) -> Optional[str]:
+        if RAW_TIMESTAMP <= code < RAW_TIMESTAMP_LIMIT:
+            return self._raw_timestamps[code]
+        return epoch_to_timestamp(code)
+
+    def _release_timestamp(self: Self, code: int) -> None:
+        self._raw_timestamps.pop(code, None)
+
+    def _index(self: Self, index: int) -> int:
+        length = len(self._roles)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("message index out of range")
+        return index
+
+    def __len__(self: Self) -> int:
+        return len(self._roles)
+
+    @overload
+    def __getitem__(self: Self, index: int) -> Dict[str, Any]:
+        ...
+
+    @overload
+    def __getitem__(self: Self, index: slice) -> List[Dict[str, Any]]:
+        ...
+
+    def __getitem__(self: Self, index: int | slice) -> Dict[str, Any] | List[Dict[str, Any]]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index = self._index(index)
+        return {
+            "timestamp": self._decode_timestamp(self._timestamps[index]),
+            "role": self._role_names[self._roles[index]],
+            "content": self.content_at(index),
+        }
+
+    def __iter__(self: Self) -> Iterator[Dict[str, Any]]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def __reversed__(self: Self) -> Iterator[Dict[str, Any]]:
+        for i in reversed(range(len(self))):
+            yield self[i]
+
+    def __bool__(self: Self) -> bool:
+        return len(self._roles) > 0
+
+    def role_at(self: Self, index: int) -> str:
+        return self._role_names[self._roles[self._index(index)]]
+
+    def timestamp_at(self: Self, index: int) -> Optional[str]:
+        return self._decode_timestamp(self._timestamps[self._index(index)])
+
+    def content_at(self: Self, index: int) -> str:
+        index = self._index(index)
+        return self._text[self._offsets[index] : self._offsets[index + 1]].decode("utf-8")
+
+    def append(self: Self, message: Dict[str, Any]) -> None:
+        self.append_values(
+            message.get("timestamp"), message.get("role"), message.get("content")
+        )
+
+    def append_values(self: Self, timestamp: Optional[str], role: Any, content: Any) -> None:
+        self._roles.append(self._role_id(role))
+        self._timestamps.append(self._encode_timestamp(timestamp))
+        self._text += str(content).encode("utf-8")
+        self._offsets.append(len(self._text))
+
+    def extend(self: Self, messages: Iterable[Dict[str, Any]]) -> None:
+        for message in messages:
+            self.append(message)
+
+    def prepend_rows(self: Self, rows: Sequence[Tuple[Any, ...]]) -> None:
+        # rows are (rowid, timestamp, role, content) as read from the messages table
+        prefix = MessageStore()
+        for row in rows:
+            prefix.append_values(row[1], row[2], row[3])
+        self.insert_store(0, prefix)
+
+    def insert(self: Self, index: int, message: Dict[str, Any]) -> None:
+        self.insert_store(index, MessageStore([message]))
+
+    def insert_store(self: Self, index: int, other: "MessageStore") -> None:
+        length = len(self)
+        index = max(0, min(length + index if index < 0 else index, length))
+        if index == length:
+            for i in range(len(other)):
+                self.append_values(
+                    other.timestamp_at(i), other.role_at(i), other.content_at(i)
+                )
+            return
+
+        start = self._offsets[index]
+        size = len(other._text)
+        self._roles[index:index] = array(
+            "B", [self._role_id(other._role_names[r]) for r in other._roles]
+        )
+        self._timestamps[index:index] = array(
+            "q", [self._encode_timestamp(other._decode_timestamp(code)) for code in other._timestamps]
+        )
+        self._text[start:start] = other._text
+        self._offsets = (
+            self._offsets[:index]
+            + array("Q", [start + offset for offset in other._offsets[:-1]])
+            + array("Q", [offset + size for offset in self._offsets[index:]])
+        )
+
+    def pop(self: Self, index: int = -1) -> Dict[str, Any]:
+        index = self._index(index)
+        message = self[index]
+        del self[index]
+        return message
+
+    def __delitem__(self: Self, index: int) -> None:
+        index = self._index(index)
+        start = self._offsets[index]
+        end = self._offsets[index + 1]
+        del self._roles[index]
+        self._release_timestamp(self._timestamps[index])
+        del self._timestamps[index]
+        del self._text[start:end]
+        size = end - start
+        if index == len(self._roles):
+            del self._offsets[index + 1]
+        else:
+            self._offsets = self._offsets[: index + 1] + array(
+                "Q", [offset - size for offset in self._offsets[index + 2 :]]
+            )
+
+    def __setitem__(self: Self, index: int, message: Dict[str, Any]) -> None:
+        index = self._index(index)
+        self._roles[index] = self._role_id(message.get("role"))
+        self.set_timestamp(index, message.get("timestamp"))
+        self.set_content(index, message.get("content"))
+
+    def set_content(self: Self, index: int, content: Any) -> None:
+        # Moves the text and offsets of every later message, so the cost is linear in what follows
+        # index. Edits are almost always to the last messages, where it is cheap.
+        index = self._index(index)
+        start = self._offsets[index]
+        end = self._offsets[index + 1]
+        encoded = str(content).encode("utf-8")
+        self._text[start:end] = encoded
+        delta = len(encoded) - (end - start)
+        if delta:
+            self._offsets[index + 1 :] = array(
+                "Q", [offset + delta for offset in self._offsets[index + 1 :]]
+            )
+
+    def set_timestamp(self: Self, index: int, timestamp: Optional[str]) -> None:
+        index = self._index(index)
+        self._release_timestamp(self._timestamps[index])
+        self._timestamps[index] = self._encode_timestamp(timestamp)
+
+    def find_last(self: Self, role: Any) -> int:
+        # Index of the last message with the given role, or -1
+        role_id = self._role_ids.get(getattr(role, "value", role))
+        if role_id is None:
+            return -1
+        for i in reversed(range(len(self._roles))):
+            if self._roles[i] == role_id:
+                return i
+        return -1
+
+    def clear(self: Self) -> None:
+        del self._roles[:]
+        del self._timestamps[:]
+        self._raw_timestamps.clear()
+        del self._text[:]
+        self._offsets = array("Q", [0])
+
+    def nbytes(self: Self) -> int:
+        # Approximate heap usage of the store's buffers
+        return (
+            sys.getsizeof(self._roles)
+            + sys.getsizeof(self._timestamps)
+            + sys.getsizeof(self._raw_timestamps)
+            + sum(sys.getsizeof(timestamp) for timestamp in self._raw_timestamps.values())
+            + sys.getsizeof(self._offsets)
+            + sys.getsizeof(self._text)
+            + sum(sys.getsizeof(name) for name in self._role_names)
+        )
@@ -0,0 +1,144 @@
+# Class PcmClip holds decoded audio as a NumPy int16 buffer, so playback needs no further conversion.
+import struct
+
+from io import BytesIO
+from typing import Optional, Tuple
+
+import numpy as np
+from pydub import AudioSegment
+from typing_extensions import Self
+
+
+class PcmClip:
+    description = "Decoded 16-bit PCM audio, interleaved, backed by a NumPy int16 array"
+
+    __slots__ = ("samples", "channels", "sample_rate")
+
+    def __init__(self: Self, samples: np.ndarray, channels: int, sample_rate: int) -> None:
+        self.samples = samples
+        self.channels = channels
+        self.sample_rate = sample_rate
+
+    @property
+    def frames(self: Self) -> int:
+        return len(self.samples) // self.channels
+
+    @property
+    def duration(self: Self) -> float:
+        return self.frames / self.sample_rate
+
+    @property
+    def nbytes(self: Self) -> int:
+        return self.samples.nbytes
+
+    @classmethod
+    def from_segment(cls, segment: AudioSegment) -> "PcmClip":
+        if segment.sample_width != 2:
+            segment = segment.set_sample_width(2)
+        return cls(np.frombuffer(segment.raw_data, dtype="<i2"), segment.channels, segment.frame_rate)
+
+    def to_wav(self: Self) -> bytes:
+        # A minimal 16-bit PCM WAV, which decode_audio reads back without copying
+        data = self.samples.astype("<i2", copy=False).tobytes()
+        header = struct.pack(
+            "<4sI4s4sIHHIIHH4sI",
+            b"RIFF",
+            36 + len(data),
+            b"WAVE",
+            b"fmt ",
+            16,
+            1,
+            self.channels,
+            self.sample_rate,
+            self.sample_rate * self.channels * 2,
+            self.channels * 2,
+            16,
+            b"data",
+            len(data),
+        )
+        return header + data
+
+    def to_segment(self: Self) -> AudioSegment:
+        return AudioSegment(
+            data=self.samples.tobytes(),
+            sample_width=2,
+            frame_rate=self.sample_rate,
+            channels=self.channels,
+        )
+
+
+def parse_wav_header(data: bytes) -> Optional[Tuple[int, int, int, int]]:
+    # (channels, sample_rate, data offset, data size) for 16-bit PCM WAV, None for anything else
+    if len(data) < 12 or data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        return None
+    fmt: Optional[Tuple[int, int, int, int]] = None
+    position = 12
+    while position + 8 <= len(data):
+        chunk_id = data[position : position + 4]
+        (chunk_size,) = struct.unpack_from("<I", data, position + 4)
+        body = position + 8
+        if chunk_id == b"fmt ":
+            fmt = struct.unpack_from("<HHIIHH", data, body)[:6]  # type: ignore[assignment]
+        elif chunk_id == b"data":
+            if fmt is None:
+                return None
+            audio_format, channels, sample_rate, _, _, bits = fmt  # type: ignore[misc]
+            # WAVE_FORMAT_EXTENSIBLE (0xFFFE) is accepted too, its sub format is PCM for TTS output
+            if audio_format not in (1, 0xFFFE) or bits != 16 or channels == 0 or sample_rate == 0:
+                return None
+            size = min(chunk_size, len(data) - body)
+            return channels, sample_rate, body, size - size % (2 * channels)
+        position = body + chunk_size + (chunk_size & 1)  # Chunks are padded to an even size
+    return None
+
+
+def decode_audio(data: bytes) -> PcmClip:
+    # 16-bit PCM WAV is read in place: the clip's samples are a read-only view of `data`.
+    # Anything else (mp3, 8/24-bit wav, ...) is decoded by pydub.
+    header = parse_wav_header(data)
+    if header:
+        channels, sample_rate, offset, size = header
+        samples = np.frombuffer(data, dtype="<i2", count=size // 2, offset=offset)
+        return PcmClip(samples, channels, sample_rate)
+
+    return PcmClip.from_segment(AudioSegment.from_file(BytesIO(data)))
+
+
+def apply_volume(samples: np.ndarray, volume: float, in_place: bool = False) -> np.ndarray:
+    # Unity volume returns the same buffer. Otherwise the samples are scaled into one new int16
+    # buffer, so a cached clip played again is not scaled twice. in_place is for buffers the
+    # caller owns and will not use again, which are scaled without a copy when writable.
+    if volume == 1.0:
+        return samples
+    out = samples if in_place and samples.flags.writeable else np.empty_like(samples)
+    if volume < 1.0:
+        # No clipping is possible, truncation toward zero is within one LSB
+        np.multiply(samples, volume, out=out, casting="unsafe")
+    else:
+        scaled = np.multiply(samples, volume, dtype=np.float32)
+        np.clip(scaled, -32768, 32767, out=scaled)
+        out[...] = scaled
+    return out
+
+
+def convert_format(
+    samples: np.ndarray, channels: int, sample_rate: int, out_channels: int, out_sample_rate: int
+) -> np.ndarray:
+    # Interleaved int16 in, interleaved int16 out. Channels are mixed down or duplicated, and the
+    # sample rate is changed by linear interpolation, which is enough for speech and alerts.
+    if channels == out_channels and sample_rate == out_sample_rate:
+        return samples
+    frames = samples.reshape(-1, channels)
+    if channels != out_channels:
+        if out_channels == 1:
+            frames = frames.mean(axis=1, keepdims=True)
+        elif channels == 1:
+            frames = np.repeat(frames, out_channels, axis=1)
+        else:
+            frames = frames[:, :out_channels] if channels > out_channels else np.pad(frames, ((0, 0), (0, out_channels - channels)), mode="edge")
+    if sample_rate != out_sample_rate and len(frames):
+        count = int(round(len(frames) * out_sample_rate / sample_rate))
+        positions = np.arange(count) * (sample_rate / out_sample_rate)
+        source = np.arange(len(frames))
+        frames = np.stack([np.interp(positions, source, frames[:, c]) for c in range(out_channels)], axis=1)
+    return np.round(frames).astype(np.int16).reshape(-1)
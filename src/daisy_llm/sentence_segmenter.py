@@ -0,0 +1,217 @@
+# Classes RuleSegmenter and PunktSegmenter find sentence ends in streamed LLM text without re-tokenizing it from the start.
+import bisect
+import functools
+import re
+
+from typing import Any, Callable, List, Optional, Union
+from typing_extensions import Self
+
+
+SEGMENTERS = ("punkt", "rules")
+
+TERMINATOR = re.compile(r"[.!?…]")
+# Further terminators and closing quotes or brackets that belong to the sentence end
+SENTENCE_TAIL = re.compile(r"[.!?…\"'”’»)\]]*")
+WHITESPACE = re.compile(r"\s*")
+# Opening quotes or brackets before the word in front of a period
+WORD_START = re.compile(r"^[\"'“‘«(\[]+")
+INITIALISM = re.compile(r"(?:[A-Za-z]\.)+[A-Za-z]")
+
+# Lowercase, without the period. A period after one of these does not end the sentence,
+# whatever follows it. "etc." is left out, as it usually does end one.
+ABBREVIATIONS = frozenset(
+    (
+        "mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "mt", "ft", "vs", "approx", "dept",
+        "est", "fig", "inc", "ltd", "co", "corp", "no", "vol", "gen", "gov", "sen", "rep",
+        "capt", "col", "lt", "sgt", "rev", "ave", "blvd", "rd", "jan", "feb", "mar", "apr",
+        "jun", "jul", "aug", "sep", "sept", "oct", "nov", "dec", "e.g", "i.e", "a.m", "p.m",
+    )
+)
+
+
+@functools.lru_cache(maxsize=None)
+def find_punkt(language: str = "english") -> Union[Any, ImportError, LookupError]:
+    # The punkt model for a language, or the error that kept it from loading. Both are cached, so
+    # a model that is not downloaded is only looked for once per process.
+    try:
+        from nltk.tokenize import PunktTokenizer  # nltk >= 3.8.2, punkt_tab
+
+        return PunktTokenizer(language)
+    except (ImportError, LookupError):
+        pass
+    try:
+        import nltk.data
+
+        return nltk.data.load(f"tokenizers/punkt/{language}.pickle")
+    except (ImportError, LookupError) as e:
+        return e
+
+
+def load_punkt(language: str = "english") -> Any:
+    # The punkt model for a language, loaded once per process. Raises ImportError or LookupError.
+    punkt = find_punkt(language)
+    if isinstance(punkt, (ImportError, LookupError)):
+        raise punkt.with_traceback(None)
+    return punkt
+
+
+class RuleSegmenter:
+    description = "A rule-based sentence segmenter that scans streamed text once, with abbreviation and decimal handling"
+
+    # A sentence ends at . ! ? or …, with any closing quotes or brackets, followed by whitespace and
+    # a character that is not lowercase. A period does not end one after an abbreviation, a single
+    # capital (an initial), an initialism such as U.S, or a list number at the start of a line.
+    # A period between digits (3.5) or inside a word (example.com) is not followed by whitespace.
+    # The text is expected to grow by appending. Sentence ends found so far are kept, and scanning
+    # resumes where it stopped: at the first terminator whose sentence end depends on text that has
+    # not arrived yet. Any other text starts over.
+
+    def __init__(self: Self) -> None:
+        self.reset()
+
+    def reset(self: Self) -> None:
+        self.text = ""
+        self.position = 0  # Where scanning resumes
+        self.boundaries: List[int] = []  # Offsets just past each sentence end
+
+    def _is_abbreviation(self: Self, text: str, period: int) -> bool:
+        word_start = text.rfind(" ", 0, period) + 1
+        word_start = max(word_start, text.rfind("\n", 0, period) + 1)
+        word = WORD_START.sub("", text[word_start:period])
+        if not word:
+            return False
+        if word.lower() in ABBREVIATIONS or INITIALISM.fullmatch(word):
+            return True
+        if len(word) == 1 and word.isupper():
+            return True
+        # "1. First item", at the start of the text or of a line
+        return word.isdigit() and len(word) <= 2 and (word_start == 0 or text[word_start - 1] == "\n")
+
+    def update(self: Self, text: str) -> None:
+        if not text.startswith(self.text):
+            self.reset()
+        self.text = text
+        position = self.position
+        length = len(text)
+        while True:
+            match = TERMINATOR.search(text, position)
+            if match is None:
+                position = length
+                break
+            terminator = match.start()
+            end = SENTENCE_TAIL.match(text, terminator).end()
+            if end == length:
+                position = terminator  # Undecided until more text arrives
+                break
+            if not text[end].isspace():
+                position = end
+                continue
+            following = WHITESPACE.match(text, end).end()
+            if following == length:
+                position = terminator
+                break
+            position = following
+            if text[following].islower():
+                continue
+            if end == terminator + 1 and text[terminator] == "." and self._is_abbreviation(text, terminator):
+                continue
+            self.boundaries.append(end)
+        self.position = position
+
+    def next_boundary(self: Self, text: str, start: int = 0) -> Optional[int]:
+        # Offset just past the first complete sentence in text[start:], None if there is none yet
+        self.update(text)
+        index = bisect.bisect_right(self.boundaries, start)
+        while index < len(self.boundaries):
+            boundary = self.boundaries[index]
+            if text[start:boundary].strip():
+                return boundary
+            index += 1
+        return None
+
+    def split(self: Self, text: str) -> List[str]:
+        self.update(text)
+        sentences = []
+        start = 0
+        for boundary in self.boundaries + [len(text)]:
+            sentence = text[start:boundary].strip()
+            if sentence:
+                sentences.append(sentence)
+            start = boundary
+        return sentences
+
+
+class PunktSegmenter:
+    description = "A sentence segmenter backed by the NLTK punkt model, loaded once per language"
+
+    # Like RuleSegmenter, it expects the text to grow by appending. Every sentence but the last
+    # one is complete, so their ends are kept and only the last sentence, which may still grow,
+    # is tokenized again when more text arrives. Any other text starts over.
+
+    def __init__(self: Self, language: str = "english") -> None:
+        self.language = language
+        self.tokenizer = load_punkt(language)
+        self.reset()
+
+    def reset(self: Self) -> None:
+        self.text = ""
+        self.position = 0  # Start of the last sentence, where tokenizing resumes
+        self.boundaries: List[int] = []  # Offsets just past each complete sentence
+
+    def update(self: Self, text: str) -> None:
+        if not text.startswith(self.text):
+            self.reset()
+        self.text = text
+        spans = list(self.tokenizer.span_tokenize(text[self.position :]))
+        if len(spans) < 2:
+            return
+        self.boundaries += [self.position + end for _, end in spans[:-1]]
+        self.position += spans[-1][0]
+
+    def next_boundary(self: Self, text: str, start: int = 0) -> Optional[int]:
+        # Offset just past the first complete sentence in text[start:], None if there is none yet
+        self.update(text)
+        index = bisect.bisect_right(self.boundaries, start)
+        while index < len(self.boundaries):
+            boundary = self.boundaries[index]
+            if text[start:boundary].strip():
+                return boundary
+            index += 1
+        return None
+
+    def split(self: Self, text: str) -> List[str]:
+        return self.tokenizer.tokenize(text)
+
+
+class TokenizeSegmenter:
+    description = "Adapts a function that splits text into a list of sentences to the segmenter interface"
+
+    def __init__(self: Self, tokenize: Callable[[str], List[str]]) -> None:
+        self.tokenize = tokenize
+
+    def reset(self: Self) -> None:
+        pass
+
+    def next_boundary(self: Self, text: str, start: int = 0) -> Optional[int]:
+        pending = text[start:]
+        sentences = self.tokenize(pending)
+        if len(sentences) < 2:
+            return None
+        # The tokenizer returns sentences stripped, so find the first one in the text
+        offset = pending.find(sentences[0])
+        return start + (offset if offset >= 0 else 0) + len(sentences[0])
+
+    def split(self: Self, text: str) -> List[str]:
+        return self.tokenize(text)
+
+
+def create_segmenter(name: str = "punkt", language: str = "english") -> Any:
+    # "punkt" falls back to the rules when the punkt model is not downloaded
+    if name not in SEGMENTERS:
+        raise ValueError(f"Unknown sentence segmenter: {name}")
+    if name == "punkt":
+        try:
+            return PunktSegmenter(language)
+        except (ImportError, LookupError):
+            pass
+    return RuleSegmenter()
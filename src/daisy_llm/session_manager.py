@@ -0,0 +1,194 @@
+# Class SessionManager hands out independent ContextHandlers, one per conversation.
+import logging
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import Future, wait
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+from typing_extensions import Self
+
+from .connection_pool import ConnectionPool
+from .context_handlers import ContextHandlers, new_conversation_id
+from .memory import EmbedFunction, MemoryStore
+
+
+class SessionManager:
+    description = "A class for serving many conversations from one process, keeping the most recently used ones in memory"
+
+    def __init__(
+        self: Self,
+        db_path: str,
+        max_resident: int = 32,
+        max_connections: int = 32,
+        embed_fn: Optional[EmbedFunction] = None,
+        window_messages: Optional[int] = None,
+        window_tokens: Optional[int] = None,
+        enable_memory: Optional[bool] = None,
+    ) -> None:
+        self.db_path = db_path
+        self.max_resident = max_resident
+        self.window_messages = window_messages
+        self.window_tokens = window_tokens
+
+        # All handles share one connection pool and one memory indexer. Memory is off unless
+        # enable_memory is set or an embed_fn is given.
+        self.connection_pool = ConnectionPool(db_path, max_connections)
+        if enable_memory is None:
+            enable_memory = embed_fn is not None
+        self.memory: Optional[MemoryStore] = None
+        if enable_memory:
+            self.memory = MemoryStore(self.connection_pool, embed_fn)
+
+        self.sessions: OrderedDict[str, ContextHandlers] = OrderedDict()
+        # Evicted or closed handles waiting to be spilled, which may still be in use
+        self.spilling: Dict[str, ContextHandlers] = {}
+        # Conversations being loaded, outside self.lock. Other threads asking for one wait on its future.
+        self.loading: Dict[str, "Future[ContextHandlers]"] = {}
+        # Never held while waiting for a handle's lock, handle locks are always taken first.
+        # A thread gives back its pooled connection before it waits for a handle's lock or leaves
+        # a session, so threads waiting on locks never hold the connections others need.
+        self.lock = threading.Lock()
+
+    def _create_handle(self: Self, conversation_id: str) -> ContextHandlers:
+        ch = ContextHandlers(
+            self.db_path,
+            window_messages=self.window_messages,
+            window_tokens=self.window_tokens,
+            conversation_id=conversation_id,
+            configs_yaml=None,
+            connection_pool=self.connection_pool,
+            memory=self.memory,
+            session_manager=self,
+            enable_memory=self.memory is not None,
+        )
+        ch.load_context()
+        return ch
+
+    def new_session(self: Self) -> ContextHandlers:
+        return self.get_session(new_conversation_id())
+
+    def get_session(self: Self, conversation_id: str) -> ContextHandlers:
+        # The resident handle of a conversation, loaded if it is not. A handle is not thread safe:
+        # hold ch.lock while using it, or use session(), which also makes sure the handle is
+        # still the resident one. Cold handles are dropped and reloaded from the database.
+        # Loading happens outside self.lock, so a slow load only holds up the threads asking for
+        # the same conversation.
+        while True:
+            loading: Optional["Future[ContextHandlers]"] = None
+            with self.lock:
+                ch = self.sessions.get(conversation_id)
+                if ch is not None:
+                    self.sessions.move_to_end(conversation_id)
+                    return ch
+
+                # An evicted handle that has not been spilled yet (or is still in use) is taken back
+                ch = self.spilling.pop(conversation_id, None)
+                if ch is not None:
+                    self.sessions[conversation_id] = ch
+                    evicted = self._evict()
+                elif conversation_id in self.loading:
+                    loading = self.loading[conversation_id]
+                else:
+                    self.loading[conversation_id] = Future()
+            if ch is not None:
+                self._spill_all(evicted)
+                return ch
+            if loading is not None:
+                # Another thread is loading it, look again once it is done (or failed)
+                self.connection_pool.release_connection()
+                wait([loading])
+                continue
+            return self._load(conversation_id)
+
+    def _load(self: Self, conversation_id: str) -> ContextHandlers:
+        # Called by the thread that put the loading future for conversation_id
+        try:
+            ch = self._create_handle(conversation_id)
+        except BaseException as e:
+            with self.lock:
+                future = self.loading.pop(conversation_id)
+            future.set_exception(e)
+            raise
+        finally:
+            self.connection_pool.release_connection()
+        with self.lock:
+            future = self.loading.pop(conversation_id)
+            self.sessions[conversation_id] = ch
+            evicted = self._evict()
+        future.set_result(ch)
+        self._spill_all(evicted)
+        return ch
+
+    def rekey(self: Self, previous_id: str, ch: ContextHandlers) -> None:
+        # ch switched conversations (new_conversation), it stays resident under its new id
+        with self.lock:
+            for handles in (self.sessions, self.spilling):
+                if handles.get(previous_id) is ch:
+                    del handles[previous_id]
+                    handles[ch.conversation_id] = ch
+
+    @contextmanager
+    def session(self: Self, conversation_id: Optional[str] = None) -> Iterator[ContextHandlers]:
+        # with manager.session(conversation_id) as ch: ... holds the handle's lock for the block,
+        # so no other thread uses or spills it meanwhile. Without an id a new conversation is started.
+        if conversation_id is None:
+            conversation_id = new_conversation_id()
+        while True:
+            ch = self.get_session(conversation_id)
+            with ch.lock:
+                with self.lock:
+                    resident = self.sessions.get(conversation_id) is ch
+                if resident:
+                    try:
+                        yield ch
+                    finally:
+                        self.connection_pool.release_connection()
+                    return
+            # Evicted and spilled before the lock was taken, load it again
+
+    def _evict(self: Self) -> List[Tuple[str, ContextHandlers]]:
+        # Called with self.lock held. The handles are spilled by the caller once self.lock is
+        # released, since spilling waits for each handle's lock.
+        evicted = []
+        while len(self.sessions) > self.max_resident:
+            conversation_id, ch = self.sessions.popitem(last=False)
+            self.spilling[conversation_id] = ch
+            evicted.append((conversation_id, ch))
+            logging.debug("Evicted conversation from memory: " + conversation_id)
+        return evicted
+
+    def _spill(self: Self, conversation_id: str, ch: ContextHandlers) -> None:
+        # Messages are saved as they change, this only catches edits made directly on the store.
+        # Waits until no other thread is using the handle.
+        with ch.lock:
+            if ch.has_unsaved_changes():
+                ch.save_context()
+                self.connection_pool.release_connection()
+            with self.lock:
+                if self.spilling.get(conversation_id) is ch:
+                    del self.spilling[conversation_id]
+
+    def _spill_all(self: Self, handles: List[Tuple[str, ContextHandlers]]) -> None:
+        for conversation_id, ch in handles:
+            self._spill(conversation_id, ch)
+
+    def close_session(self: Self, conversation_id: str) -> None:
+        with self.lock:
+            ch = self.sessions.pop(conversation_id, None)
+            if ch is None:
+                return
+            self.spilling[conversation_id] = ch
+        self._spill(conversation_id, ch)
+
+    def close(self: Self) -> None:
+        with self.lock:
+            closed = list(self.sessions.items())
+            self.sessions.clear()
+            self.spilling.update(closed)
+        self._spill_all(closed)
+
+    def resident_conversation_ids(self: Self) -> List[str]:
+        # Conversations that are open, including evicted ones that are still being spilled
+        with self.lock:
+            return list(self.sessions.keys()) + list(self.spilling.keys())
@@ -0,0 +1,148 @@
+# Class SoundAssets is the process-wide registry of sound files, decoded on first use.
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+
+from importlib import resources
+from typing import Dict, List, Optional
+
+import numpy as np
+from typing_extensions import Self
+
+from .pcm import PcmClip, decode_audio, parse_wav_header
+
+SOUND_EXTENSIONS = (".wav", ".mp3")
+
+# Header of a pre-decoded cache file: magic, source mtime (ns), source size, channels, sample rate
+CACHE_HEADER = struct.Struct("<4sqqHI")
+CACHE_MAGIC = b"DPC1"
+
+
+def user_cache_directory(name: str) -> str:
+    # A directory under the user's cache directory, never the working directory
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "daisy_llm", name)
+
+
+def default_cache_directory() -> str:
+    return user_cache_directory("sounds")
+
+
+def map_file(path: str) -> mmap.mmap:
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class SoundAssets:
+    description = "A registry of the sounds in a directory, decoded lazily and shared by every SoundManager"
+
+    # 16-bit WAV files are memory-mapped and played from the mapping, so they are never decoded.
+    # Anything else (mp3, 8/24-bit wav) is decoded once and written to a PCM cache file next to
+    # the other cached sounds. The cache file is mapped on later runs, until the source's mtime or
+    # size changes.
+
+    def __init__(self: Self, directory: str, cache_directory: Optional[str] = None) -> None:
+        self.directory = directory
+        self.cache_directory = cache_directory or default_cache_directory()
+        self.lock = threading.Lock()
+        self.clips: Dict[str, PcmClip] = {}
+        self.failed: Dict[str, str] = {}
+
+        # Listing the directory is all that happens up front
+        self.files: Dict[str, str] = {}
+        for filename in sorted(os.listdir(self.directory)):
+            name, extension = os.path.splitext(filename)
+            if extension in SOUND_EXTENSIONS:
+                self.files[name] = os.path.join(self.directory, filename)
+
+    def names(self: Self) -> List[str]:
+        return list(self.files)
+
+    def __contains__(self: Self, name: object) -> bool:
+        return name in self.files
+
+    def get(self: Self, name: str) -> Optional[PcmClip]:
+        # None for unknown names and files that cannot be decoded, like dict.get
+        with self.lock:
+            clip = self.clips.get(name)
+            if clip is not None or name not in self.files or name in self.failed:
+                return clip
+            try:
+                clip = self._load(self.files[name])
+            except Exception as e:
+                logging.warning(f"Failed to load sound file '{self.files[name]}': {e}")
+                self.failed[name] = str(e)
+                return None
+            self.clips[name] = clip
+            return clip
+
+    def _load(self: Self, path: str) -> PcmClip:
+        mapped = map_file(path)
+        if parse_wav_header(mapped):
+            return decode_audio(mapped)  # type: ignore[arg-type]
+        mapped.close()
+
+        stat = os.stat(path)
+        # Sounds from different directories may share a file name
+        prefix = hashlib.sha256(os.path.abspath(path).encode("utf-8")).hexdigest()[:16]
+        cache_path = os.path.join(self.cache_directory, f"{prefix}-{os.path.basename(path)}.pcm")
+        clip = self._load_cache(cache_path, stat)
+        if clip is not None:
+            return clip
+
+        with open(path, "rb") as f:
+            clip = decode_audio(f.read())
+        try:
+            self._write_cache(cache_path, stat, clip)
+        except OSError as e:
+            logging.warning(f"Failed to write sound cache file: {e}")
+            return clip
+        return self._load_cache(cache_path, stat) or clip
+
+    def _load_cache(self: Self, cache_path: str, stat: os.stat_result) -> Optional[PcmClip]:
+        try:
+            mapped = map_file(cache_path)
+        except (OSError, ValueError):  # Missing, or empty
+            return None
+        if len(mapped) < CACHE_HEADER.size:
+            mapped.close()
+            return None
+        magic, mtime_ns, size, channels, sample_rate = CACHE_HEADER.unpack_from(mapped)
+        if magic != CACHE_MAGIC or mtime_ns != stat.st_mtime_ns or size != stat.st_size:
+            mapped.close()
+            return None
+        samples = np.frombuffer(mapped, dtype="<i2", offset=CACHE_HEADER.size)
+        return PcmClip(samples, channels, sample_rate)
+
+    def _write_cache(self: Self, cache_path: str, stat: os.stat_result, clip: PcmClip) -> None:
+        os.makedirs(self.cache_directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_directory)
+        with os.fdopen(fd, "wb") as f:
+            f.write(CACHE_HEADER.pack(CACHE_MAGIC, stat.st_mtime_ns, stat.st_size, clip.channels, clip.sample_rate))
+            f.write(clip.samples.astype("<i2", copy=False).tobytes())
+        os.replace(tmp_path, cache_path)
+
+    def preload(self: Self) -> None:
+        for name in self.files:
+            self.get(name)
+
+
+assets: Dict[str, SoundAssets] = {}
+assets_lock = threading.Lock()
+
+
+def get_sound_assets(directory: str = "sounds") -> SoundAssets:
+    # One registry per directory. A relative directory is looked up inside the daisy_llm package.
+    if not os.path.isabs(directory):
+        directory = str(resources.files(__package__).joinpath(directory))
+    directory = os.path.abspath(directory)
+    with assets_lock:
+        registry = assets.get(directory)
+        if registry is None:
+            registry = SoundAssets(directory)
+            assets[directory] = registry
+        return registry
@@ -0,0 +1,102 @@
+# Class SpeechChunker decides when streamed LLM text is ready to be sent to TTS.
+import re
+
+from typing import Any, Callable, List, Optional
+from typing_extensions import Self
+
+from .sentence_segmenter import TokenizeSegmenter, create_segmenter
+
+
+CHUNKING_POLICIES = ("sentence", "clause", "words")
+
+# A clause ends at , ; : or a dash, followed by whitespace
+CLAUSE_BOUNDARY = re.compile(r"(?:[,;:]|\s[-–—])\s")
+WORD = re.compile(r"\S+\s")
+
+
+class SpeechChunker:
+    description = "A class that splits streaming text into speakable chunks, flushing early for a faster first word"
+
+    # Policies:
+    #   sentence: only complete sentences are spoken (the old behaviour)
+    #   clause:   a chunk may also end at a clause boundary once it has enough words
+    #   words:    a chunk may also end after enough words, wherever that is
+    # With clause and words, chunk n needs min_words * growth**n words, so the first chunk is
+    # short and later ones grow while the earlier audio is playing. A sentence end always flushes.
+    # Sentence ends come from a segmenter (sentence_segmenter.py), by default create_segmenter():
+    # the cached punkt model, or the rule-based one when punkt is not downloaded.
+    # A tokenize function that splits text into sentences is accepted instead, as before.
+
+    def __init__(
+        self: Self,
+        policy: str = "sentence",
+        tokenize: Optional[Callable[[str], List[str]]] = None,
+        min_words: int = 4,
+        growth: float = 2.0,
+        max_words: int = 40,
+        segmenter: Optional[Any] = None,
+    ) -> None:
+        if policy not in CHUNKING_POLICIES:
+            raise ValueError(f"Unknown chunking policy: {policy}")
+        self.policy = policy
+        if segmenter is None:
+            segmenter = TokenizeSegmenter(tokenize) if tokenize else create_segmenter()
+        self.segmenter = segmenter
+        self.min_words = max(1, min_words)
+        self.growth = max(1.0, growth)
+        self.max_words = max(self.min_words, max_words)
+        self.reset()
+
+    def reset(self: Self) -> None:
+        self.spoken = 0  # Characters of the text that have been handed out
+        self.chunk_count = 0
+        self.segmenter.reset()
+
+    def threshold(self: Self) -> int:
+        return min(self.max_words, int(round(self.min_words * self.growth**self.chunk_count)))
+
+    def _emit(self: Self, text: str, end: int, chunks: List[str]) -> None:
+        chunk = text[self.spoken : self.spoken + end].strip()
+        self.spoken += end
+        if chunk:
+            chunks.append(chunk)
+            self.chunk_count += 1
+
+    def _early_end(self: Self, pending: str) -> Optional[int]:
+        # Where to cut an unfinished sentence, if anywhere yet
+        threshold = self.threshold()
+        if self.policy == "clause":
+            for match in CLAUSE_BOUNDARY.finditer(pending):
+                if len(WORD.findall(pending[: match.end()])) >= threshold:
+                    return match.end()
+            return None
+        # words: count only words that are followed by whitespace, the last one may still be growing
+        words = list(WORD.finditer(pending))
+        if len(words) >= threshold:
+            return words[threshold - 1].end()
+        return None
+
+    def feed(self: Self, text: str) -> List[str]:
+        # text is everything streamed so far. Returns the chunks that became ready.
+        chunks: List[str] = []
+        while True:
+            pending = text[self.spoken :]
+            if not pending.strip():
+                break
+            end = self.segmenter.next_boundary(text, self.spoken)
+            if end is not None:
+                self._emit(text, end - self.spoken, chunks)
+                continue
+            if self.policy == "sentence":
+                break
+            end = self._early_end(pending)
+            if end is None:
+                break
+            self._emit(text, end, chunks)
+        return chunks
+
+    def finish(self: Self, text: str) -> List[str]:
+        # The stream has ended, so whatever is left is complete
+        chunks = self.feed(text)
+        self._emit(text, len(text) - self.spoken, chunks)
+        return chunks
@@ -0,0 +1,460 @@
+# Class ConversationSummarizer names and summarizes stored conversations in bulk.
+import json
+import logging
+import openai
+import os
+import queue
+import re
+import threading
+import time
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from tqdm import tqdm
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence, Tuple
+from typing_extensions import Self
+
+from .message_store import estimate_tokens
+
+if TYPE_CHECKING:
+    from .context_handlers import ContextHandlers
+
+
+SUMMARY_PROMPT = """
+Please respond with a name, and summary for this conversation.
+1. The name should be a single word or short phrase, no more than 5 words."
+2. The summary should be a fairly verbose summary of the conversation, as short as possible while still containing all of the important topics, names, places, and sentiment of conversation.
+3. The output must follow the following JSON format: {"name": name, "summary": summary}
+4. If the conversation is empty, please respond with "Empty"
+"""
+
+ROLLING_SUMMARY_PROMPT = """
+Please respond with an updated name, and summary for this conversation.
+1. Start from the current name and summary above, and add what is new in the messages since then.
+2. The name should be a single word or short phrase, no more than 5 words. Keep the current name unless the topic has changed.
+3. The summary should be a fairly verbose summary of the whole conversation, as short as possible while still containing all of the important topics, names, places, and sentiment of conversation.
+4. The output must follow the following JSON format: {"name": name, "summary": summary}
+"""
+
+EMPTY_NAME_SUMMARY = {"name": "Empty Conversation", "summary": "None"}
+
+# (conversation_id, name, summary, last summarized message rowid)
+SummaryResult = Tuple[str, str, str, int]
+
+# (new messages, rowid of the newest one, previous name and summary if any)
+SummaryJob = Tuple[List[Dict[str, Any]], int, Optional[Dict[str, str]]]
+
+# Time of the last change to any context of a database in this process, by absolute path.
+# SummaryScheduler waits for all of them to be idle, not only its own handle.
+last_activity_by_db: Dict[str, float] = {}
+
+
+def record_activity(db_path: str) -> None:
+    last_activity_by_db[os.path.abspath(db_path)] = time.monotonic()
+
+
+def get_last_activity(db_path: str) -> float:
+    return last_activity_by_db.get(os.path.abspath(db_path), 0.0)
+
+
+def parse_name_summary(response: Any) -> Optional[Dict[str, str]]:
+    if not response:
+        return None
+    if str(response).strip() == "Empty":
+        return dict(EMPTY_NAME_SUMMARY)
+
+    # Extract the JSON response from the string
+    response_match = re.search(r"{.*}", str(response), re.DOTALL)
+    if not response_match:
+        return None
+    try:
+        response_obj = json.loads(response_match.group(0))
+    except json.JSONDecodeError as e:
+        logging.error(
+            "Invalid JSON response while setting conversation name and summary: "
+            + str(e)
+        )
+        return None
+    if "name" not in response_obj or "summary" not in response_obj:
+        return None
+    return {"name": str(response_obj["name"]), "summary": str(response_obj["summary"])}
+
+
+class CompletionClient:
+    description = "A plain, non-streaming OpenAI chat client for background requests such as summaries"
+
+    # Chat needs the whole assistant (ml) and streams for speech, summaries only need the text of
+    # one answer. Each summarizer worker thread gets its own client, so requests run side by side.
+
+    def __init__(self: Self, api_key: Optional[str] = None, request_timeout: float = 60) -> None:
+        self.api_key = api_key  # None uses openai.api_key
+        self.request_timeout = request_timeout
+
+    def request(
+        self: Self,
+        messages: List[Dict[str, Any]],
+        model: str = "gpt-3.5-turbo",
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None,
+        **kwargs: Any,
+    ) -> Optional[str]:
+        # Takes Chat.request's arguments, the ones about streaming and printing are ignored
+        options: Dict[str, Any] = {}
+        if self.api_key:
+            options["api_key"] = self.api_key
+        if max_tokens:
+            options["max_tokens"] = max_tokens
+        response = openai.ChatCompletion.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            request_timeout=self.request_timeout,
+            **options,
+        )
+        return response["choices"][0]["message"]["content"]
+
+
+class RateLimiter:
+    description = "Spaces out calls so that no more than a given number start per minute"
+
+    def __init__(self: Self, requests_per_minute: float) -> None:
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self: Self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ConversationSummarizer:
+    description = "A class for naming and summarizing many conversations through a bounded, rate limited worker pool"
+
+    def __init__(
+        self: Self,
+        ch: "ContextHandlers",
+        max_workers: int = 4,
+        requests_per_minute: float = 60,
+        batch_size: int = 20,
+        max_attempts: int = 3,
+        model: str = "gpt-3.5-turbo",
+        incremental: bool = True,
+        max_tokens_per_request: int = 3000,
+        chat_factory: Optional[Callable[[], Any]] = None,
+    ) -> None:
+        self.ch = ch
+        # Each worker thread makes its own client with chat_factory, by default the handle's
+        # create_summary_client. A Chat set on the handle is not safe to use from several threads,
+        # so without chat_factory the workers take turns with it.
+        if chat_factory is None and not ch.has_chat():
+            chat_factory = ch.create_summary_client
+        self.chat_factory = chat_factory
+        self.local = threading.local()
+        self.chat_lock = threading.Lock()
+        self.incremental = incremental
+        self.max_tokens_per_request = max_tokens_per_request
+        self.max_workers = max_workers
+        self.rate_limiter = RateLimiter(requests_per_minute)
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.model = model
+
+    def create_summary_state_table_if_not_exists(self: Self) -> None:
+        with self.ch.connection_pool.get_connection() as conn:
+            conn.execute(
+                """
+				CREATE TABLE IF NOT EXISTS conversation_summary_state (
+					conversation_id TEXT PRIMARY KEY,
+					last_message_rowid INTEGER NOT NULL,
+					updated_at INTEGER NOT NULL
+				);
+			"""
+            )
+
+    def get_pending_conversation_ids(
+        self: Self, conversation_ids: Optional[Sequence[str]] = None
+    ) -> List[str]:
+        # Conversations with messages newer than their last summary, or never summarized
+        self.create_summary_state_table_if_not_exists()
+        with self.ch.connection_pool.get_connection() as conn:
+            rows = conn.execute(
+                """
+				SELECT c.id FROM conversations c
+				LEFT JOIN conversation_summary_state s ON s.conversation_id = c.id
+				WHERE s.last_message_rowid IS NULL
+					OR s.last_message_rowid < (
+						SELECT MAX(rowid) FROM messages m WHERE m.conversation_id = c.id
+					)
+				ORDER BY c.id
+			"""
+            ).fetchall()
+        pending = [row[0] for row in rows]
+        if conversation_ids is not None:
+            wanted = set(pending)
+            pending = [conv_id for conv_id in conversation_ids if conv_id in wanted]
+        return pending
+
+    def request_name_summary(
+        self: Self, messages: List[Dict[str, Any]], conversation_id: str, prompt: str
+    ) -> Optional[Dict[str, str]]:
+        request_messages = list(messages)
+        request_messages.append({"role": "system", "content": prompt})
+        for attempt in range(self.max_attempts):
+            self.rate_limiter.acquire()
+            response = self.request_chat(
+                messages=request_messages,
+                model=self.model,
+                silent=True,
+                response_label=False,
+            )
+            response_obj = parse_name_summary(response)
+            if response_obj:
+                return response_obj
+            logging.error(
+                "Invalid response format while setting conversation name and summary for "
+                + conversation_id
+                + ". Trying again..."
+            )
+        return None
+
+    def request_chat(self: Self, **kwargs: Any) -> Any:
+        if self.chat_factory is None:
+            with self.chat_lock:
+                return self.ch.chat.request(**kwargs)
+        chat = getattr(self.local, "chat", None)
+        if chat is None:
+            chat = self.local.chat = self.chat_factory()
+        return chat.request(**kwargs)
+
+    def prepare(self: Self, conversation_id: str) -> SummaryJob:
+        # Database reads stay on the calling thread, workers only talk to the LLM.
+        # With a previous summary, only messages after its high-water mark are read.
+        with self.ch.connection_pool.get_connection() as conn:
+            row = conn.execute(
+                """
+				SELECT s.last_message_rowid, c.name, c.summary FROM conversations c
+				LEFT JOIN conversation_summary_state s ON s.conversation_id = c.id
+				WHERE c.id = ?
+			""",
+                (conversation_id,),
+            ).fetchone()
+
+        previous: Optional[Dict[str, str]] = None
+        after_rowid: Optional[int] = None
+        if self.incremental and row and row[0] is not None and row[2] != "No summary":
+            previous = {"name": row[1], "summary": row[2]}
+            after_rowid = row[0]
+
+        rows = self.ch.get_conversation_rows(conversation_id, after_rowid)
+        last_rowid = rows[-1][0] if rows else (after_rowid or 0)
+        messages = [{"role": row[2], "content": row[3]} for row in rows]
+        return messages, last_rowid, previous
+
+    def chunk_messages(
+        self: Self, messages: List[Dict[str, Any]]
+    ) -> List[List[Dict[str, Any]]]:
+        # Split into chunks of at most max_tokens_per_request, so a request never grows with the conversation
+        chunks: List[List[Dict[str, Any]]] = []
+        chunk: List[Dict[str, Any]] = []
+        chunk_tokens = 0
+        for message in messages:
+            tokens = estimate_tokens(message["content"])
+            if chunk and chunk_tokens + tokens > self.max_tokens_per_request:
+                chunks.append(chunk)
+                chunk = []
+                chunk_tokens = 0
+            chunk.append(message)
+            chunk_tokens += tokens
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def summarize(
+        self: Self, conversation_id: str, job: SummaryJob
+    ) -> Optional[SummaryResult]:
+        messages, last_rowid, previous = job
+        if not messages:
+            logging.debug("No new messages to summarize for " + conversation_id)
+            return None
+
+        current = previous
+        for chunk in self.chunk_messages(messages):
+            if current is None:
+                response_obj = self.request_name_summary(
+                    chunk, conversation_id, SUMMARY_PROMPT
+                )
+            else:
+                summary_message = {
+                    "role": "system",
+                    "content": "Current conversation name: "
+                    + current["name"]
+                    + "\nCurrent summary: "
+                    + current["summary"]
+                    + "\nThe messages below are new since this summary was written.",
+                }
+                response_obj = self.request_name_summary(
+                    [summary_message, *chunk], conversation_id, ROLLING_SUMMARY_PROMPT
+                )
+            if not response_obj:
+                return None
+            current = response_obj
+
+        if not current:
+            return None
+        return (conversation_id, current["name"], current["summary"], last_rowid)
+
+    def write_results(self: Self, results: List[SummaryResult]) -> None:
+        if not results:
+            return
+        now = int(time.time())
+        # One transaction per batch
+        with self.ch.connection_pool.get_connection() as conn:
+            conn.executemany(
+                """UPDATE conversations SET name = ?, summary = ? WHERE id = ?""",
+                [(name, summary, conv_id) for conv_id, name, summary, _ in results],
+            )
+            conn.executemany(
+                """
+				INSERT OR REPLACE INTO conversation_summary_state (conversation_id, last_message_rowid, updated_at)
+				VALUES (?, ?, ?)
+			""",
+                [(conv_id, last_rowid, now) for conv_id, _, _, last_rowid in results],
+            )
+        for conv_id, name, summary, _ in results:
+            logging.info("Name and summary updated for conversation " + conv_id + ": " + name)
+            if self.ch.memory is not None:
+                self.ch.memory.enqueue(conv_id, None, "summary", summary)
+
+    def mark_summarized(self: Self, conversation_id: str, last_rowid: int) -> None:
+        with self.ch.connection_pool.get_connection() as conn:
+            conn.execute(
+                """
+				INSERT OR REPLACE INTO conversation_summary_state (conversation_id, last_message_rowid, updated_at)
+				VALUES (?, ?, ?)
+			""",
+                (conversation_id, last_rowid, int(time.time())),
+            )
+
+    def run(
+        self: Self,
+        conversation_ids: Optional[Sequence[str]] = None,
+        resume: bool = True,
+        progress: bool = True,
+        delete_empty: bool = False,
+    ) -> int:
+        # With resume, conversations already summarized up to their latest message are skipped,
+        # so an interrupted run picks up where it stopped. With delete_empty, conversations that
+        # have no messages and were never summarized are deleted, except the current one.
+        self.create_summary_state_table_if_not_exists()
+        if resume:
+            conversation_ids = self.get_pending_conversation_ids(conversation_ids)
+        elif conversation_ids is None:
+            conversation_ids = self.ch.get_conversation_ids()
+
+        if not conversation_ids:
+            logging.info("No conversations to summarize")
+            return 0
+
+        updated = 0
+        pending_results: List[SummaryResult] = []
+        completed: "queue.Queue[Future[Optional[SummaryResult]]]" = queue.Queue()
+        in_flight = 0
+
+        def handle(future: "Future[Optional[SummaryResult]]") -> None:
+            nonlocal updated, pending_results
+            try:
+                result = future.result()
+            except Exception as e:
+                logging.error(f"Failed to summarize conversation: {e}")
+                result = None
+            if result:
+                pending_results.append(result)
+                updated += 1
+            if len(pending_results) >= self.batch_size:
+                self.write_results(pending_results)
+                pending_results = []
+            progress_bar.update(1)
+
+        with tqdm(
+            total=len(conversation_ids),
+            desc="Summarizing conversations",
+            unit="conversation",
+            disable=not progress,
+        ) as progress_bar, ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            try:
+                for conv_id in conversation_ids:
+                    # Keep a bounded number of transcripts in memory
+                    while in_flight >= self.max_workers * 2:
+                        handle(completed.get())
+                        in_flight -= 1
+
+                    job = self.prepare(conv_id)
+                    if not job[0] and job[2] is None:
+                        # Nothing was ever said in this conversation
+                        if delete_empty and conv_id != self.ch.conversation_id:
+                            self.ch.delete_conversation_by_id(conv_id)
+                        else:
+                            # Not pending again until it has messages
+                            self.mark_summarized(conv_id, job[1])
+                        progress_bar.update(1)
+                        continue
+                    future = executor.submit(self.summarize, conv_id, job)
+                    future.add_done_callback(completed.put)
+                    in_flight += 1
+
+                while in_flight:
+                    handle(completed.get())
+                    in_flight -= 1
+            except KeyboardInterrupt:
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+            finally:
+                # Whatever finished is kept, so the next resume skips it
+                self.write_results(pending_results)
+        return updated
+
+
+class SummaryScheduler(threading.Thread):
+    description = "A background thread that refreshes rolling conversation summaries while the system is idle"
+
+    def __init__(
+        self: Self,
+        ch: "ContextHandlers",
+        idle_seconds: float = 120,
+        interval: float = 30,
+        max_per_run: int = 5,
+        requests_per_minute: float = 20,
+    ) -> None:
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.ch = ch
+        self.idle_seconds = idle_seconds
+        self.interval = interval
+        self.max_per_run = max_per_run
+        self.summarizer = ConversationSummarizer(
+            ch, max_workers=1, requests_per_minute=requests_per_minute, chat_factory=ch.create_summary_client
+        )
+        self.stop_event = threading.Event()
+
+    def run(self: Self) -> None:
+        while not self.stop_event.wait(self.interval):
+            if not self.is_idle():
+                continue
+            try:
+                pending = self.summarizer.get_pending_conversation_ids()
+                if pending:
+                    logging.info(f"Refreshing {len(pending[: self.max_per_run])} conversation summaries")
+                    self.summarizer.run(pending[: self.max_per_run], resume=False, progress=False)
+            except Exception as e:
+                logging.error("Summary refresh failed: " + str(e))
+
+    def is_idle(self: Self) -> bool:
+        # No context of the database changed in idle_seconds, from any handle in this process
+        last_activity = max(self.ch.last_activity, get_last_activity(self.ch.db_path))
+        return time.monotonic() - last_activity >= self.idle_seconds
+
+    def close(self: Self) -> None:
+        self.stop_event.set()
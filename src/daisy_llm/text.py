@@ -1,16 +1,9 @@
 from typing import Dict, List, Optional
 import sys
 
-from ruamel.yaml import YAML
+from .config_service import get_config_service
 
-yaml = YAML()
-
-# Define global variables
-yaml_print_text = True
-with open("configs.yaml", "r") as f:
-    configs = yaml.load(f)
-if "print_text" in configs:
-    yaml_print_text = configs["print_text"]
+config = get_config_service()
 
 
 class Colors:
@@ -23,7 +16,7 @@ class Colors:
     white = "\u001b[37m"
 
 
-TEXT_COLOR_MAPPING: {
+TEXT_COLOR_MAPPING = {
     "blue": "36;1",
     "yellow": "33;1",
     "pink": "38;5;200",
@@ -64,7 +57,7 @@ def print_text(
     text: str, color: Optional[str] = None, end: str = "", style: Optional[str] = None
 ) -> None:
     """Print text with highlighting and optional styling."""
-    if yaml_print_text:
+    if config.get_bool("print_text", default=True):
         if color is None:
             text_to_print = text
         else:
@@ -0,0 +1,238 @@
+# Class TtsCache keeps synthesized speech so that repeated phrases are not sent to the TTS module again.
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, TypedDict
+from typing_extensions import Self
+
+from .sound_assets import user_cache_directory
+
+# Temporary files older than this are left over from a crash, younger ones may still be written
+STALE_TEMP_SECONDS = 3600
+
+
+def default_cache_directory() -> str:
+    return user_cache_directory("tts")
+
+
+class CacheStats(TypedDict):
+    memory_hits: int
+    disk_hits: int
+    misses: int
+    hit_rate: float
+    memory_entries: int
+    memory_bytes: int
+    disk_entries: int
+    disk_bytes: int
+
+
+class TtsCache:
+    description = "A content addressed cache of TTS audio with an in-memory LRU and an on-disk tier"
+
+    def __init__(
+        self: Self,
+        directory: Optional[str] = None,  # None keeps the cache in memory only
+        max_memory_bytes: int = 32 * 1024 * 1024,
+        max_disk_bytes: int = 512 * 1024 * 1024,
+    ) -> None:
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.lock = threading.Lock()
+
+        self.memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self.memory_bytes = 0
+
+        # key -> (size, last use), loaded from the directory once
+        self.disk: Dict[str, Tuple[int, float]] = {}
+        self.disk_bytes = 0
+        if self.directory:
+            self._scan_disk()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(text: str, voice: str, speed: float) -> str:
+        return hashlib.sha256(
+            "\0".join((voice, f"{float(speed):.3f}", text)).encode("utf-8")
+        ).hexdigest()
+
+    def _path(self: Self, key: str) -> str:
+        return os.path.join(str(self.directory), key[:2], key + ".audio")
+
+    def _scan_disk(self: Self) -> None:
+        # Temporary files of writes that never finished are removed
+        os.makedirs(str(self.directory), exist_ok=True)
+        now = time.time()
+        for root, _, files in os.walk(str(self.directory)):
+            for filename in files:
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                    if filename.endswith(".audio"):
+                        self.disk[filename[: -len(".audio")]] = (stat.st_size, stat.st_mtime)
+                        self.disk_bytes += stat.st_size
+                    elif filename.endswith(".tmp") and now - stat.st_mtime > STALE_TEMP_SECONDS:
+                        os.remove(path)
+                except OSError:
+                    pass  # Removed by another process meanwhile
+
+    def _remember(self: Self, key: str, audio: bytes) -> None:
+        # Caller holds the lock
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return
+        if len(audio) > self.max_memory_bytes:
+            return
+        self.memory[key] = audio
+        self.memory_bytes += len(audio)
+        while self.memory_bytes > self.max_memory_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+
+    def _write_disk(self: Self, key: str, audio: bytes) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first, so a crash never leaves a truncated clip behind
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(audio)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        with self.lock:
+            previous = self.disk.get(key)
+            if previous:
+                self.disk_bytes -= previous[0]
+            self.disk[key] = (len(audio), time.time())
+            self.disk_bytes += len(audio)
+            evict: List[str] = []
+            if self.disk_bytes > self.max_disk_bytes:
+                # Least recently used files go first
+                for old_key, (size, _) in sorted(self.disk.items(), key=lambda item: item[1][1]):
+                    if self.disk_bytes <= self.max_disk_bytes:
+                        break
+                    if old_key == key:
+                        continue
+                    evict.append(old_key)
+                    self.disk_bytes -= size
+                for old_key in evict:
+                    del self.disk[old_key]
+        for old_key in evict:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def get(self: Self, key: str) -> Optional[bytes]:
+        with self.lock:
+            audio = self.memory.get(key)
+            if audio is not None:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return audio
+            on_disk = self.directory is not None and key in self.disk
+
+        if on_disk:
+            try:
+                with open(self._path(key), "rb") as f:
+                    audio = f.read()
+                os.utime(self._path(key))  # Keeps the disk tier in LRU order across restarts
+                used = os.path.getmtime(self._path(key))
+            except OSError:
+                audio = None  # Removed by another process
+            if audio is not None:
+                with self.lock:
+                    self.disk[key] = (len(audio), used)
+                    self._remember(key, audio)
+                    self.disk_hits += 1
+                return audio
+
+        with self.lock:
+            if on_disk:
+                gone = self.disk.pop(key, None)
+                if gone:
+                    self.disk_bytes -= gone[0]
+            self.misses += 1
+        return None
+
+    def put(self: Self, key: str, audio: bytes) -> None:
+        with self.lock:
+            self._remember(key, audio)
+        if self.directory is not None:
+            try:
+                self._write_disk(key, audio)
+            except OSError as e:
+                logging.warning(f"Failed to write TTS cache file: {e}")
+
+    def get_or_create(self: Self, key: str, create: Callable[[], bytes]) -> bytes:
+        audio = self.get(key)
+        if audio is None:
+            audio = create()
+            # Only encoded audio is cached, anything else the TTS module returns is passed through
+            if isinstance(audio, bytes) and audio:
+                self.put(key, audio)
+        return audio
+
+    def prewarm(
+        self: Self,
+        phrases: Iterable[str],
+        voice: str,
+        speed: float,
+        create: Callable[[str], bytes],
+    ) -> int:
+        # Synthesize phrases that are not cached yet. Returns how many were synthesized.
+        created = 0
+        for phrase in phrases:
+            key = self.key(phrase, voice, speed)
+            with self.lock:
+                cached = key in self.memory or key in self.disk
+            if cached:
+                continue
+            audio = create(phrase)
+            if isinstance(audio, bytes) and audio:
+                self.put(key, audio)
+                created += 1
+        logging.info(f"Pre-warmed TTS cache with {created} phrases")
+        return created
+
+    def stats(self: Self) -> CacheStats:
+        with self.lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self.memory),
+                "memory_bytes": self.memory_bytes,
+                "disk_entries": len(self.disk),
+                "disk_bytes": self.disk_bytes,
+            }
+
+    def clear(self: Self) -> None:
+        with self.lock:
+            keys = list(self.disk)
+            self.memory.clear()
+            self.memory_bytes = 0
+            self.disk.clear()
+            self.disk_bytes = 0
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
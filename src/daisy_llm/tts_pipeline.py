@@ -0,0 +1,304 @@
+# Class TtsPipeline moves sentences to synthesis and synthesized audio to playback through blocking queues.
+import logging
+import queue
+import threading
+import time
+
+import requests
+
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, List, Optional, Tuple
+from typing_extensions import Self
+
+from .cancellation import CancellationToken, as_token, wait_future
+from .pcm import parse_wav_header
+from .speech_chunker import SpeechChunker
+from .tts_prefetch import PrefetchController
+
+if TYPE_CHECKING:
+    from .ChatSpeechProcessor import ChatSpeechProcessor
+
+
+class Sentinel:
+    def __init__(self: Self, name: str) -> None:
+        self.name = name
+
+    def __repr__(self: Self) -> str:
+        return self.name
+
+
+# End of stream: everything before it is still synthesized and played
+END = Sentinel("END")
+# Cancel: stop as soon as possible, anything still queued is dropped
+CANCEL = Sentinel("CANCEL")
+
+# (sentence, time.perf_counter() when the sentence was complete)
+SentenceItem = Tuple[str, float]
+# (audio, seconds it holds in the prefetch buffer, bytes, duration if known)
+AudioItem = Tuple[Any, float, int, Optional[float]]
+
+
+def audio_duration(audio: Any) -> Optional[float]:
+    # Seconds of a 16-bit WAV clip, read from its header. None for anything else.
+    if not isinstance(audio, bytes):
+        return None
+    header = parse_wav_header(audio)
+    if header is None:
+        return None
+    channels, sample_rate, _, size = header
+    return size / (2 * channels * sample_rate)
+
+
+class TtsPipeline:
+    description = "A pipeline that synthesizes sentences as soon as they are complete and plays them in order"
+
+    def __init__(
+        self: Self,
+        csp: "ChatSpeechProcessor",
+        stop_event: Optional[threading.Event] = None,
+        sound_stop_event: Optional[threading.Event] = None,
+        max_sentences: int = 32,
+        max_audio: int = 16,
+        parallelism: int = 1,
+        chunker: Optional[SpeechChunker] = None,
+        prefetch: Optional[PrefetchController] = None,
+    ) -> None:
+        self.csp = csp
+        self.parallelism = max(1, parallelism)
+        self.chunker = chunker or SpeechChunker()
+        # Decides how far synthesis runs ahead of playback, in seconds of audio and bytes
+        self.prefetch = prefetch or PrefetchController()
+        self.prefetch.begin()
+        self.stop_event = as_token(stop_event)
+        self.sound_stop_event = sound_stop_event
+        self.cancelled = CancellationToken()
+
+        # Synthesis of a sentence starts once the prefetch controller has room for it, max_audio only
+        # caps the number of clips. The audio queue holds futures in sentence order, so playback order
+        # does not depend on which synthesis finishes first.
+        self.sentence_queue: "queue.Queue[Any]" = queue.Queue(maxsize=max_sentences)
+        self.audio_queue: "queue.Queue[Any]" = queue.Queue(maxsize=max_audio + self.parallelism)
+        # Clips queued on the output, (playback, audio item, time.perf_counter() when it was queued)
+        self.played_queue: "queue.Queue[Any]" = queue.Queue()
+        self.playing_lock = threading.Lock()
+        self.queued_clips = 0
+        self.playing_clips = 0
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.parallelism, thread_name_prefix="tts"
+        )
+
+        # Milliseconds from a sentence being complete to its synthesis starting
+        self.latencies_ms: List[float] = []
+        # Milliseconds from the pipeline being created (the request being sent) to the first audio
+        self.created_at = time.perf_counter()
+        self.first_audio_ms: Optional[float] = None
+        # Set once a TTS error has been spoken, so it is said once per response
+        self.error_spoken = False
+
+        # Setting the stop event cancels the pipeline right away, wherever its stages are blocked
+        self.remove_stop_callback = self.stop_event.on_cancel(self.cancel)
+
+    def put_sentence(self: Self, sentence: str) -> None:
+        if sentence.strip() and not self.cancelled.is_set():
+            self.sentence_queue.put((sentence, time.perf_counter()))
+
+    def feed_text(self: Self, text: str) -> None:
+        # text is the whole response streamed so far, chunks are queued as the chunker releases them
+        for chunk in self.chunker.feed(text):
+            self.put_sentence(chunk)
+
+    def finish_text(self: Self, text: str) -> None:
+        for chunk in self.chunker.finish(text):
+            self.put_sentence(chunk)
+        self.end()
+
+    def end(self: Self) -> None:
+        if not self.cancelled.is_set():
+            self.sentence_queue.put(END)
+
+    def cancel(self: Self) -> None:
+        # Drop everything queued and wake up both stages
+        if self.cancelled.is_set():
+            return
+        self.cancelled.set()
+        for q in (self.sentence_queue, self.audio_queue):
+            while True:
+                try:
+                    item = q.get_nowait()
+                except queue.Empty:
+                    break
+                if isinstance(item, Future):
+                    item.cancel()
+            try:
+                q.put_nowait(CANCEL)
+            except queue.Full:
+                # A stage refilled the queue in the meantime, it checks cancelled before using the item
+                pass
+        # Sentences that have not started synthesizing are dropped, running ones are discarded when done
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        logging.info("TTS pipeline canceled")
+
+    def is_stopped(self: Self) -> bool:
+        return self.cancelled.is_set() or self.stop_event.is_set()
+
+    def error_audio(self: Self, message: str) -> Any:
+        # The error is spoken in place of the first sentence that failed, the others are left out
+        with self.playing_lock:
+            if self.error_spoken:
+                return None
+            self.error_spoken = True
+        try:
+            return self.csp.create_error_audio(message)
+        except Exception as e:
+            logging.error(f"Error speaking TTS error feedback: {e}")
+            return None
+
+    def synthesize(self: Self, item: SentenceItem, estimate: float) -> Optional[AudioItem]:
+        # Runs on a worker thread. estimate is the sentence's audio seconds from the prefetch controller.
+        sentence, completed_at = item
+        audio = None
+        started = time.perf_counter()
+        try:
+            if self.is_stopped():
+                return None
+            latency_ms = (started - completed_at) * 1000
+            self.latencies_ms.append(latency_ms)
+            logging.info(f"Synthesizing sentence ({latency_ms:.1f} ms after it was complete): {sentence}")
+
+            try:
+                audio = self.csp.create_tts_audio(sentence)
+            except requests.exceptions.HTTPError as e:
+                logging.error(f"HTTP Error: {e}")
+                audio = self.error_audio("HTTP Error. Error creating TTS audio. Please check your TTS account.")
+            except requests.exceptions.ConnectionError as e:
+                logging.error(f"Connection Error: {e}")
+                audio = self.error_audio("Connection Error. Error creating TTS audio. Please check your TTS account.")
+        finally:
+            duration = audio_duration(audio)
+            nbytes = len(audio) if audio is not None else 0
+            buffered = self.prefetch.synthesized(estimate, sentence, duration, nbytes, time.perf_counter() - started)
+        if audio is None:
+            return None
+        return audio, buffered, nbytes, duration
+
+    def synthesize_loop(self: Self) -> None:
+        # Hands sentences to up to `parallelism` workers, each once the prefetch controller has room
+        # for its audio, so synthesis stays the target number of seconds ahead of playback.
+        while True:
+            item = self.sentence_queue.get()  # Block until a sentence is complete
+            if item is END:
+                self.audio_queue.put(END)
+                return
+            if item is CANCEL or self.is_stopped():
+                return
+
+            estimate = self.prefetch.acquire(item[0], self.cancelled)
+            if estimate is None:
+                return
+            try:
+                future = self.executor.submit(self.synthesize, item, estimate)
+            except RuntimeError:  # The executor was shut down by cancel()
+                return
+            self.audio_queue.put(future)
+
+    def queue_loop(self: Self) -> None:
+        # Queues each clip on the output as soon as it is synthesized, in sentence order, and hands it
+        # to play_loop. The output plays queued clips back to back, so there is no gap between
+        # sentences unless synthesis fell behind, which is counted as an underrun.
+        try:
+            while True:
+                future = self.audio_queue.get()  # Block until the next clip in order is queued
+                if future is END or future is CANCEL or self.is_stopped():
+                    break
+                if future.cancelled():
+                    continue
+                # Block until that clip is synthesized, or the pipeline is canceled while it is
+                if not wait_future(future, self.cancelled):
+                    break
+                try:
+                    result = future.result()
+                except CancelledError:
+                    continue
+                except Exception as e:
+                    logging.error(f"Error creating TTS audio: {e}")
+                    continue
+                if result is None:
+                    continue
+                if self.is_stopped():
+                    break
+
+                if self.first_audio_ms is None:
+                    self.first_audio_ms = (time.perf_counter() - self.created_at) * 1000
+                    logging.info(
+                        f"Time to first audio: {self.first_audio_ms:.0f} ms (chunking policy: {self.chunker.policy})"
+                    )
+
+                # Stop voice assistant "waiting" sound
+                if self.sound_stop_event:
+                    self.sound_stop_event.set()
+                with self.playing_lock:
+                    if self.queued_clips and not self.playing_clips:
+                        self.prefetch.underrun()
+                    self.queued_clips += 1
+                    self.playing_clips += 1
+                playback = self.csp.sounds.queue_sound(result[0])
+                self.played_queue.put((playback, result, time.perf_counter()))
+        finally:
+            self.played_queue.put(END)
+
+    def play_loop(self: Self) -> None:
+        # Waits for the queued clips in order and hands their buffer back to the prefetch controller
+        finished_at = 0.0
+        while True:
+            item = self.played_queue.get()
+            if item is END:
+                break
+            playback, (_, buffered, nbytes, duration), queued_at = item
+            if self.is_stopped():
+                playback.stop()
+                break
+            # A clip starts when it is queued, or when the one before it ends
+            started = max(queued_at, finished_at)
+            self.prefetch.playing(buffered, started)
+            if not self.csp.sounds.wait_sound(playback, self.stop_event):
+                break  # Stopping a clip drops the ones queued after it as well
+            finished_at = time.perf_counter()
+            with self.playing_lock:
+                self.playing_clips -= 1
+            self.prefetch.played(buffered, nbytes, finished_at - started if duration else None)
+
+        # Clips queued while the pipeline was being stopped
+        while item is not END:
+            item = self.played_queue.get()
+            if item is not END:
+                item[0].stop()
+
+        logging.info("TTS play queue complete")
+
+    def run(self: Self) -> None:
+        # Blocks until every sentence has been played, or the pipeline was canceled
+        synthesizer = threading.Thread(target=self.synthesize_loop)
+        synthesizer.daemon = True
+        synthesizer.start()
+        queuer = threading.Thread(target=self.queue_loop)
+        queuer.daemon = True
+        queuer.start()
+        try:
+            self.play_loop()
+        finally:
+            synthesizer.join()
+            queuer.join()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.remove_stop_callback()
+        if self.latencies_ms:
+            logging.info(
+                f"TTS latency for {len(self.latencies_ms)} sentences: "
+                f"mean {sum(self.latencies_ms) / len(self.latencies_ms):.1f} ms, "
+                f"max {max(self.latencies_ms):.1f} ms"
+            )
+        stats = self.prefetch.stats()
+        rtf = "unknown" if stats["synthesis_rtf"] is None else f"{stats['synthesis_rtf']:.2f}"
+        logging.info(
+            f"TTS prefetch: {stats['clips']} clips, {stats['underruns']} underruns, "
+            f"target {stats['target_seconds']:.1f} s ahead, synthesis real-time factor {rtf}"
+        )
@@ -0,0 +1,202 @@
+# Class PrefetchController decides how far TTS synthesis may run ahead of playback.
+import threading
+import time
+
+from typing import Optional, TypedDict
+from typing_extensions import Self
+
+from .cancellation import CancellationToken
+
+# Speech runs at about 15 characters a second, until the first clips give a better figure
+DEFAULT_SECONDS_PER_CHAR = 1 / 15
+
+
+class PrefetchStats(TypedDict):
+    target_seconds: float
+    ahead_seconds: float
+    buffered_seconds: float
+    buffered_bytes: int
+    pending: int
+    synthesis_rtf: Optional[float]
+    playback_rate: float
+    clips: int
+    underruns: int
+    total_underruns: int
+
+
+class PrefetchController:
+    description = "Keeps a target number of seconds of synthesized audio ahead of playback, within a memory bound"
+
+    # A sentence may start synthesizing while the audio that is synthesized and not yet played, plus
+    # the estimated audio of the sentences being synthesized, is shorter than the target and within
+    # max_bytes. The target follows the measured synthesis real-time factor (seconds of synthesis per
+    # second of audio): the sentence has to be ready before the buffered audio has been played, so the
+    # target is rtf * its estimated seconds * playback rate (audio seconds played per second) * margin,
+    # within [min_seconds, max_seconds].
+    # The clip being played counts for what is left of it, estimated from when it started.
+    # Rates are moving averages kept across responses, buffer counts are reset by begin().
+
+    def __init__(
+        self: Self,
+        min_seconds: float = 1.0,
+        max_seconds: float = 10.0,
+        max_bytes: int = 8 * 1024 * 1024,
+        margin: float = 1.5,
+        smoothing: float = 0.3,
+    ) -> None:
+        self.min_seconds = min_seconds
+        self.max_seconds = max_seconds
+        self.max_bytes = max_bytes
+        self.margin = margin
+        self.smoothing = smoothing
+        self.condition = threading.Condition()
+
+        # Moving averages
+        self.synthesis_rtf: Optional[float] = None
+        self.seconds_per_char = DEFAULT_SECONDS_PER_CHAR
+        self.sentence_seconds: Optional[float] = None
+        self.playback_rate = 1.0
+
+        # The current response
+        self.buffered_seconds = 0.0  # Synthesized, not yet played
+        self.buffered_bytes = 0
+        self.pending_seconds = 0.0  # Estimated audio of the sentences being synthesized
+        self.pending = 0
+        self.playing_seconds = 0.0  # Length of the clip being played
+        self.playing_since: Optional[float] = None  # time.perf_counter() when it started
+        self.clips = 0
+        self.underruns = 0
+        self.total_underruns = 0
+
+    def _average(self: Self, average: Optional[float], value: float) -> float:
+        return value if average is None else average + self.smoothing * (value - average)
+
+    def begin(self: Self) -> None:
+        with self.condition:
+            self.buffered_seconds = 0.0
+            self.buffered_bytes = 0
+            self.pending_seconds = 0.0
+            self.pending = 0
+            self.playing_since = None
+            self.clips = 0
+            self.underruns = 0
+            self.condition.notify_all()
+
+    def estimate_seconds(self: Self, text: str) -> float:
+        return self.seconds_per_char * len(text)
+
+    def target_seconds(self: Self, sentence_seconds: float = 0.0) -> float:
+        # For a sentence of the given length, and at least one of average length: the sentence after
+        # a short one is held back by the short one's target.
+        if self.synthesis_rtf is None or self.sentence_seconds is None:
+            return self.min_seconds
+        sentence_seconds = max(sentence_seconds, self.sentence_seconds)
+        target = self.synthesis_rtf * sentence_seconds * self.playback_rate * self.margin
+        return min(self.max_seconds, max(self.min_seconds, target))
+
+    def ahead_seconds(self: Self) -> float:
+        # Seconds of audio synthesized or being synthesized that have not been played yet
+        ahead = self.buffered_seconds + self.pending_seconds
+        if self.playing_since is not None:
+            played = (time.perf_counter() - self.playing_since) * self.playback_rate
+            ahead -= min(self.playing_seconds, played)
+        return max(0.0, ahead)
+
+    def _has_room(self: Self, estimate: float) -> bool:
+        if self.pending == 0 and self.buffered_bytes == 0:
+            return True  # One sentence is always allowed, or a long clip would stall the pipeline
+        return self.ahead_seconds() < self.target_seconds(estimate) and self.buffered_bytes < self.max_bytes
+
+    def _time_to_room(self: Self, estimate: float) -> Optional[float]:
+        # Seconds until playback has made room, None if only synthesized() or played() can
+        if self.playing_since is None or self.buffered_bytes >= self.max_bytes:
+            return None
+        return max(0.001, (self.ahead_seconds() - self.target_seconds(estimate)) / self.playback_rate)
+
+    def acquire(self: Self, text: str, token: Optional[CancellationToken] = None) -> Optional[float]:
+        # Blocks until the sentence may be synthesized. Returns its estimated audio seconds, to be
+        # passed to synthesized(), or None if the token was canceled while waiting.
+        def wake() -> None:
+            with self.condition:
+                self.condition.notify_all()
+
+        remove_callback = token.on_cancel(wake) if token is not None else None
+        try:
+            with self.condition:
+                estimate = self.estimate_seconds(text)
+                while not self._has_room(estimate):
+                    if token is not None and token.is_set():
+                        return None
+                    self.condition.wait(self._time_to_room(estimate))
+                if token is not None and token.is_set():
+                    return None
+                self.pending += 1
+                self.pending_seconds += estimate
+                return estimate
+        finally:
+            if remove_callback is not None:
+                remove_callback()
+
+    def synthesized(
+        self: Self,
+        estimate: float,
+        text: str,
+        seconds: Optional[float],
+        nbytes: int,
+        elapsed: float,
+    ) -> float:
+        # A sentence from acquire() is done. seconds is None when synthesis failed or the clip's
+        # duration is unknown, nbytes is 0 when there is no clip. Returns the seconds buffered for
+        # the clip, to be passed to played().
+        buffered = (seconds if seconds is not None else estimate) if nbytes else 0.0
+        with self.condition:
+            self.pending -= 1
+            self.pending_seconds = max(0.0, self.pending_seconds - estimate)
+            self.buffered_seconds += buffered
+            self.buffered_bytes += nbytes
+            if seconds:
+                self.synthesis_rtf = self._average(self.synthesis_rtf, elapsed / seconds)
+                self.sentence_seconds = self._average(self.sentence_seconds, seconds)
+                if text:
+                    self.seconds_per_char = self._average(self.seconds_per_char, seconds / len(text))
+            self.condition.notify_all()
+        return buffered
+
+    def playing(self: Self, seconds: float, since: float) -> None:
+        # A clip from synthesized() started playing at time.perf_counter() `since`
+        with self.condition:
+            self.playing_seconds = seconds
+            self.playing_since = since
+            self.condition.notify_all()
+
+    def played(self: Self, seconds: float, nbytes: int, elapsed: Optional[float] = None) -> None:
+        # A clip from synthesized() has been played. elapsed is the wall time it took, when known.
+        with self.condition:
+            self.playing_since = None
+            self.buffered_seconds = max(0.0, self.buffered_seconds - seconds)
+            self.buffered_bytes = max(0, self.buffered_bytes - nbytes)
+            self.clips += 1
+            if seconds and elapsed:
+                self.playback_rate = self._average(self.playback_rate, seconds / elapsed)
+            self.condition.notify_all()
+
+    def underrun(self: Self) -> None:
+        # Playback ran dry between two clips of the same response
+        with self.condition:
+            self.underruns += 1
+            self.total_underruns += 1
+
+    def stats(self: Self) -> PrefetchStats:
+        with self.condition:
+            return {
+                "target_seconds": self.target_seconds(),
+                "ahead_seconds": self.ahead_seconds(),
+                "buffered_seconds": self.buffered_seconds,
+                "buffered_bytes": self.buffered_bytes,
+                "pending": self.pending,
+                "synthesis_rtf": self.synthesis_rtf,
+                "playback_rate": self.playback_rate,
+                "clips": self.clips,
+                "underruns": self.underruns,
+                "total_underruns": self.total_underruns,
+            }
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from daisy_llm.context_handlers import ContextHandlers
+
+
+def fake_embed(texts):
+    # One dimension per letter, so texts that share words score higher than texts that do not
+    vectors = np.zeros((len(texts), 26), dtype=np.float32)
+    for i, text in enumerate(texts):
+        for char in text.lower():
+            if "a" <= char <= "z":
+                vectors[i, ord(char) - ord("a")] += 1
+    return vectors
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "daisy.db")
+
+
+@pytest.fixture
+def make_handlers(db_path):
+    def make(conversation_id="conversation-1", **kwargs):
+        # db_path=... opens another database than the test's default one
+        kwargs.setdefault("db_path", db_path)
+        ch = ContextHandlers(conversation_id=conversation_id, configs_yaml=None, **kwargs)
+        ch.load_context()
+        return ch
+
+    return make
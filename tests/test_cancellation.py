@@ -0,0 +1,130 @@
+import http.server
+import threading
+import time
+
+from concurrent.futures import Future
+
+import requests
+
+from daisy_llm.cancellation import CancellationToken, LinkedToken, as_token, on_cancel, wait_future
+from daisy_llm.chat import close_stream
+
+
+def test_plain_event_is_followed_not_changed():
+    event = threading.Event()
+    threads = threading.active_count()
+    token = as_token(event)
+    assert type(event) is threading.Event
+    assert isinstance(token, LinkedToken)
+    assert threading.active_count() == threads
+
+    called = []
+    token.on_cancel(lambda: called.append(True))
+    event.set()
+    assert token.is_set()  # A poller notices, the callbacks run then
+    assert called == [True]
+    assert token.cancelled_at is not None
+
+
+def test_tokens_are_returned_as_they_are():
+    token = CancellationToken()
+    assert as_token(token) is token
+    assert isinstance(as_token(None), CancellationToken)
+
+
+def test_anything_with_is_set_is_accepted():
+    class Flag:
+        def __init__(self):
+            self.value = False
+
+        def is_set(self):
+            return self.value
+
+    class OtherEvent(threading.Event):
+        pass
+
+    flag = Flag()
+    token = as_token(flag)
+    assert not token.is_set()
+    flag.value = True
+    assert token.wait(1)
+    assert not as_token(OtherEvent()).is_set()
+
+
+def test_set_event_runs_callbacks_right_away():
+    event = threading.Event()
+    event.set()
+    called = []
+    as_token(event).on_cancel(lambda: called.append(True))
+    assert called == [True]
+
+
+def test_plain_events_cannot_run_callbacks():
+    assert on_cancel(threading.Event(), lambda: None)() is None
+    assert on_cancel(None, lambda: None)() is None
+
+
+def test_wait_future_wakes_on_a_plain_event():
+    event = threading.Event()
+    future = Future()
+    timer = threading.Timer(0.05, event.set)
+    timer.start()
+    start = time.monotonic()
+    assert wait_future(future, event, timeout=5) is False
+    assert time.monotonic() - start < 1
+    timer.join()
+
+
+def test_wait_future_wakes_on_a_token():
+    token = CancellationToken()
+    threading.Timer(0.01, token.set).start()
+    assert wait_future(Future(), token, timeout=5) is False
+    assert token.is_set()
+
+
+def test_wait_future_returns_when_done():
+    future = Future()
+    threading.Timer(0.01, lambda: future.set_result(1)).start()
+    assert wait_future(future, threading.Event(), timeout=5) is True
+
+
+class SlowStream(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        self.wfile.write(b"data: one\n\n")
+        self.wfile.flush()
+        time.sleep(5)  # The next chunk is late
+
+    def log_message(self, *args):
+        pass
+
+
+def test_close_stream_ends_a_blocked_read():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), SlowStream)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    result = requests.get(f"http://127.0.0.1:{server.server_port}/", stream=True)
+    # Generators shaped like openai's: the outer one reads the inner one, which uses the response
+    lines = (line.decode() + str(result.status_code) for line in result.iter_lines())
+    response = (line for line in lines)
+
+    chunks = []
+    errors = []
+
+    def read():
+        try:
+            chunks.extend(response)
+        except Exception as e:
+            errors.append(e)
+
+    stream = threading.Thread(target=read)
+    stream.start()
+    time.sleep(0.2)
+    start = time.monotonic()
+    close_stream(response)
+    stream.join(5)
+    assert not stream.is_alive()
+    assert time.monotonic() - start < 2
+    server.shutdown()
@@ -0,0 +1,84 @@
+from daisy_llm.context_handlers import Role
+from daisy_llm.session_manager import SessionManager
+
+from conftest import fake_embed
+
+OLD = "2020-01-01 00:00:00"
+
+
+def age_conversation(ch, conversation_id):
+    with ch.connection_pool.get_connection() as conn:
+        conn.execute("UPDATE messages SET timestamp = ? WHERE conversation_id = ?", (OLD, conversation_id))
+
+
+def test_partly_archived_conversation_reads_archived_rows_first(make_handlers):
+    old = make_handlers("old")
+    for content in ("one", "two", "three"):
+        old.add_message_object(Role.user, content)
+    age_conversation(old, "old")
+
+    current = make_handlers("current")
+    report = current.archive_old_conversations(older_than_days=30, vacuum=False)
+    assert report["conversations"] == 1
+    assert current.cold_storage.is_archived("old")
+
+    # Another writer adds a message without loading (and so restoring) the conversation
+    with current.connection_pool.get_connection() as conn:
+        conn.execute(
+            "INSERT INTO messages (conversation_id, timestamp, role, message) VALUES (?, ?, ?, ?)",
+            ("old", "2024-01-01 00:00:00", "user", "new-after-archive"),
+        )
+
+    expected = ["one", "two", "three", "new-after-archive"]
+    context = current.get_conversation_context_by_id("old")
+    assert [message["content"] for message in context] == expected
+    assert [row[3] for row in current.get_conversation_rows("old")] == expected
+
+    reloaded = make_handlers("old")
+    assert [message["content"] for message in reloaded.get_context()] == expected
+
+
+def test_archive_skips_resident_sessions(db_path):
+    manager = SessionManager(db_path, embed_fn=fake_embed)
+    with manager.session("open") as ch:
+        ch.add_message_object(Role.user, "still talking")
+        age_conversation(ch, "open")
+    with manager.session("current") as current:
+        current.add_message_object(Role.user, "hello")
+        report = current.archive_old_conversations(older_than_days=30, vacuum=False)
+
+    assert report["conversations"] == 0
+    assert not current.cold_storage.is_archived("open")
+
+
+def test_only_conversations_with_parsed_old_timestamps_are_stale(make_handlers):
+    ch = make_handlers("current")
+    for conversation_id, timestamp in (
+        ("old", OLD),
+        ("iso-t", "2020-01-01T00:00:00"),
+        ("empty", ""),
+        ("not-iso", "01/02/2020 10:00"),
+        ("recent", "2999-01-01 00:00:00"),
+    ):
+        with ch.connection_pool.get_connection() as conn:
+            conn.execute(
+                "INSERT INTO messages (conversation_id, timestamp, role, message) VALUES (?, ?, ?, ?)",
+                (conversation_id, timestamp, "user", "hello"),
+            )
+    assert sorted(ch.cold_storage.get_stale_conversation_ids(30)) == ["iso-t", "old"]
+
+
+def test_vacuum_mode_is_only_switched_when_asked(make_handlers):
+    old = make_handlers("old")
+    old.add_message_object(Role.user, "hello " * 1000)
+    age_conversation(old, "old")
+    current = make_handlers("current")
+    storage = current.cold_storage
+
+    current.archive_old_conversations(older_than_days=30)
+    assert not storage.is_incremental_vacuum_enabled()
+
+    storage.enable_incremental_vacuum()
+    assert storage.is_incremental_vacuum_enabled()
+    storage.incremental_vacuum()
+    assert storage.get_page_counts()[1] == 0
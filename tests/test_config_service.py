@@ -0,0 +1,50 @@
+import os
+import time
+
+from daisy_llm.config_service import ConfigService
+
+
+def write(path, text, age):
+    # Explicit mtimes, so changes are seen on file systems with coarse timestamps
+    path.write_text(text)
+    stamp = time.time() - age
+    os.utime(path, (stamp, stamp))
+
+
+def test_the_watcher_only_runs_while_someone_is_subscribed(tmp_path):
+    path = tmp_path / "configs.yaml"
+    write(path, "log_level: WARNING\n", age=10)
+    service = ConfigService(str(path), poll_interval=0.01)
+    assert service.get_str("log_level") == "WARNING"
+    assert service.thread is None
+
+    seen = []
+    callback = service.subscribe(seen.append, call_now=False)
+    thread = service.thread
+    assert thread is not None and thread.is_alive()
+
+    write(path, "log_level: INFO\n", age=5)
+    deadline = time.monotonic() + 5
+    while not seen and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert seen and seen[-1]["log_level"] == "INFO"
+
+    service.unsubscribe(callback)
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert service.thread is None
+
+
+def test_reads_pick_up_changes_without_a_watcher(tmp_path):
+    path = tmp_path / "configs.yaml"
+    write(path, "config_reload_interval: 0\nlog_level: WARNING\n", age=10)
+    service = ConfigService(str(path))
+    assert service.get_str("log_level") == "WARNING"
+    assert service.interval() == 0
+
+    write(path, "config_reload_interval: 3600\nlog_level: INFO\n", age=5)
+    assert service.get_str("log_level") == "INFO"
+    assert service.interval() == 3600
+
+    write(path, "config_reload_interval: 3600\nlog_level: ERROR\n", age=0)
+    assert service.get_str("log_level") == "INFO"  # Not checked again within the interval
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from daisy_llm.context_handlers import Role
+
+
+def test_get_context_returns_a_new_list(make_handlers):
+    ch = make_handlers()
+    ch.add_start_prompt(Role.system, "You are Daisy")
+    ch.add_message_object(Role.user, "Hello")
+
+    context = ch.get_context()
+    assert isinstance(context, list)
+    context.append({"role": "user", "content": "extra", "timestamp": None})
+    assert len(ch.get_context()) == 2
+
+
+def test_get_context_messages_can_be_changed_by_callers(make_handlers):
+    ch = make_handlers()
+    ch.add_start_prompt(Role.system, "You are Daisy")
+    ch.add_message_object(Role.user, "Hello")
+
+    context = ch.get_context()
+    context[1]["content"] = "MUTATED"
+    context[0].update(role="user")
+    ch.get_context_without_timestamp()[1]["content"] = "MUTATED"
+
+    assert ch.get_context() == [
+        {"timestamp": context[0]["timestamp"], "role": "system", "content": "You are Daisy"},
+        {"timestamp": context[1]["timestamp"], "role": "user", "content": "Hello"},
+    ]
+
+
+def test_get_context_snapshot_is_cached_and_read_only(make_handlers):
+    ch = make_handlers()
+    ch.add_start_prompt(Role.system, "You are Daisy")
+    ch.add_message_object(Role.user, "Hello")
+
+    snapshot = ch.get_context_snapshot()
+    assert ch.get_context_snapshot() is snapshot
+    with pytest.raises(TypeError):
+        snapshot[1]["content"] = "MUTATED"
+    with pytest.raises(TypeError):
+        snapshot[1].update(content="MUTATED")
+    assert [message["content"] for message in ch.get_context_snapshot(include_system=False)] == ["Hello"]
+
+    ch.add_message_object(Role.user, "Again")
+    assert len(ch.get_context_snapshot()) == 3
+
+
+def test_get_context_messages_serialize_as_dicts(make_handlers):
+    ch = make_handlers()
+    ch.add_message_object(Role.user, "Hello")
+
+    message = ch.get_context(include_timestamp=False)[0]
+    assert json.loads(json.dumps(message)) == {"timestamp": None, "role": "user", "content": "Hello"}
+
+
+def test_get_context_follows_changes(make_handlers):
+    ch = make_handlers()
+    ch.add_message_object(Role.user, "Hello")
+    ch.get_context()
+    ch.replace_last_message_object("Hi")
+    assert ch.get_context()[-1]["content"] == "Hi"
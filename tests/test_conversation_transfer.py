@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+from daisy_llm.context_handlers import Role
+from daisy_llm.summarizer import ConversationSummarizer
+
+
+def store(ch):
+    with ch.connection_pool.get_connection() as conn:
+        conversations = conn.execute("SELECT id, name, summary FROM conversations ORDER BY id").fetchall()
+    messages = {conversation_id: [row[3] for row in ch.get_conversation_rows(conversation_id)] for conversation_id, _, _ in conversations}
+    return conversations, messages
+
+
+def write_jsonl(path, records):
+    path.write_text("".join(json.dumps(record) + "\n" for record in records))
+
+
+def message(conversation_id, content):
+    return {"type": "message", "conversation_id": conversation_id, "timestamp": "2024-01-01 00:00:00", "role": "user", "message": content}
+
+
+@pytest.mark.parametrize("file_name", ["export.jsonl", "export.jsonl.gz"])
+def test_round_trip(tmp_path, make_handlers, file_name):
+    source = make_handlers("a", db_path=str(tmp_path / "source.db"))
+    source.add_message_object(Role.user, "one")
+    source.add_message_object(Role.system, "two")
+    source.new_conversation()
+    source.add_message_object(Role.user, "three")
+    source.export_conversations(str(tmp_path / file_name))
+
+    target = make_handlers("a")
+    stats = target.import_conversations(str(tmp_path / file_name))
+    assert (stats["conversations"], stats["messages"]) == (2, 3)
+    assert store(target) == store(source)
+
+    # Importing again replaces the conversations instead of adding their messages twice
+    target.import_conversations(str(tmp_path / file_name))
+    assert store(target) == store(source)
+
+
+def test_conversation_record_after_its_messages(tmp_path, make_handlers):
+    path = tmp_path / "import.jsonl"
+    write_jsonl(
+        path,
+        [
+            message("b", "first"),
+            message("b", "second"),
+            {"type": "conversation", "id": "b", "name": "Named", "summary": "Summary"},
+            message("b", "third"),
+        ],
+    )
+    target = make_handlers()
+    target.add_message_object(Role.user, "kept")
+    for _ in range(2):
+        target.import_conversations(str(path))
+        conversations, messages = store(target)
+        assert ("b", "Named", "Summary") in conversations
+        assert messages["b"] == ["first", "second", "third"]
+        assert messages["conversation-1"] == ["kept"]
+
+
+def test_skip_keeps_existing_conversations(tmp_path, make_handlers):
+    path = tmp_path / "import.jsonl"
+    write_jsonl(
+        path,
+        [
+            message("conversation-1", "imported"),
+            {"type": "conversation", "id": "conversation-1", "name": "Imported", "summary": ""},
+            message("new", "hello"),
+            {"type": "conversation", "id": "new", "name": "New", "summary": "Summary"},
+        ],
+    )
+    target = make_handlers()
+    target.add_message_object(Role.user, "kept")
+    stats = target.import_conversations(str(path), on_conflict="skip")
+    assert (stats["conversations"], stats["messages"], stats["skipped_conversations"]) == (1, 1, 1)
+    conversations, messages = store(target)
+    assert ("new", "New", "Summary") in conversations
+    assert messages == {"conversation-1": ["kept"], "new": ["hello"]}
+
+
+def test_replace_drops_the_summary_state(tmp_path, make_handlers):
+    target = make_handlers()
+    target.add_message_object(Role.user, "old")
+    ConversationSummarizer(target, chat_factory=object).create_summary_state_table_if_not_exists()
+    with target.connection_pool.get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO conversation_summary_state (conversation_id, last_message_rowid, updated_at) VALUES (?, 1, 0)",
+            [("conversation-1",), ("other",)],
+        )
+
+    path = tmp_path / "import.jsonl"
+    write_jsonl(path, [message("conversation-1", "new")])
+    target.import_conversations(str(path))
+
+    with target.connection_pool.get_connection() as conn:
+        rows = conn.execute("SELECT conversation_id FROM conversation_summary_state").fetchall()
+    assert rows == [("other",)]
+    assert store(target)[1]["conversation-1"] == ["new"]
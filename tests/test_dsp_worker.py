@@ -0,0 +1,94 @@
+import os
+import signal
+
+import numpy as np
+
+from daisy_llm.dsp_worker import DspWorker, RingAllocator, process_clip
+from daisy_llm.pcm import PcmClip
+
+
+def clip():
+    return PcmClip((np.sin(np.arange(4000) / 5) * 20000).astype(np.int16), 1, 16000)
+
+
+def test_ring_allocator_wraps_and_frees_in_any_order():
+    ring = RingAllocator(100, 256)
+    first = ring.allocate(100)
+    second = ring.allocate(100)
+    assert (first, second) == (100, 228)
+    assert ring.allocate(100) is None
+    ring.free(first)
+    assert ring.allocate(64) == 100  # Wrapped around, before the second region
+    ring.free(second)
+    assert ring.allocate(300) is None
+
+
+def test_process_falls_back_when_the_worker_died():
+    worker = DspWorker(ring_bytes=1024 * 1024, timeout=5)
+    try:
+        worker.start()
+        worker.worker_process.kill()
+        worker.worker_process.join(5)
+        result = worker.process(clip(), volume=0.5)
+        np.testing.assert_array_equal(result.samples, process_clip(clip(), volume=0.5).samples)
+        assert worker.fallbacks >= 1
+    finally:
+        worker.close()
+
+
+def test_process_falls_back_when_the_worker_is_stuck():
+    worker = DspWorker(ring_bytes=1024 * 1024, timeout=0.5)
+    try:
+        worker.start()
+        os.kill(worker.worker_process.pid, signal.SIGSTOP)
+        result = worker.process(clip(), speed=1.5)
+        np.testing.assert_array_equal(result.samples, process_clip(clip(), speed=1.5).samples)
+        assert worker.fallbacks == 1
+    finally:
+        worker.worker_process.kill()
+        worker.close()
+
+
+def check_script(tmp_path, monkeypatch, source):
+    import sys
+    import types
+
+    from daisy_llm.dsp_worker import spawn_is_safe
+
+    path = tmp_path / "script.py"
+    path.write_text(source)
+    main = types.ModuleType("__main__")
+    main.__file__ = str(path)
+    monkeypatch.setitem(sys.modules, "__main__", main)
+    return spawn_is_safe.__wrapped__()
+
+
+def test_spawn_is_safe_only_with_a_main_guard(tmp_path, monkeypatch):
+    guarded = 'import sys\nNAME = "daisy"\n\ndef main():\n    pass\n\nif __name__ == "__main__":\n    main()\n'
+    assert check_script(tmp_path, monkeypatch, guarded)
+    assert not check_script(tmp_path, monkeypatch, 'from daisy_llm import ContextHandlers\nch = ContextHandlers("daisy.db")\n')
+    assert not check_script(tmp_path, monkeypatch, "import threading\nthreading.Thread(target=print).start()\n")
+
+
+def test_unsafe_spawn_processes_in_process(monkeypatch):
+    from daisy_llm import dsp_worker
+
+    monkeypatch.setattr(dsp_worker, "spawn_is_safe", lambda: False)
+    worker = DspWorker(ring_bytes=1024 * 1024)
+    result = worker.process(clip(), volume=0.5)
+    np.testing.assert_array_equal(result.samples, process_clip(clip(), volume=0.5).samples)
+    assert worker.worker_process is None
+    assert worker.fallbacks == 1
+
+
+def test_closed_worker_is_not_started_again():
+    from daisy_llm.dsp_worker import close_dsp_worker, get_dsp_worker
+
+    worker = get_dsp_worker()
+    worker.process(clip(), volume=0.5)
+    assert worker.worker_process is not None  # Started by the first clip
+    close_dsp_worker()
+    assert worker.worker_process is None
+    worker.process(clip(), volume=0.5)
+    assert worker.worker_process is None
+    assert get_dsp_worker() is not worker
@@ -0,0 +1,49 @@
+import threading
+
+import numpy as np
+import pytest
+
+from daisy_llm import local_tts
+from daisy_llm.local_tts import LocalTts
+from daisy_llm.pcm import PcmClip
+
+WAV = PcmClip(np.zeros(160, np.int16), 1, 16000).to_wav()
+
+
+@pytest.fixture
+def slow_tts(monkeypatch):
+    # An espeak LocalTts whose renders wait for the test to let them finish
+    monkeypatch.setattr(local_tts, "find_espeak", lambda: "espeak")
+    tts = LocalTts(backend="espeak")
+    tts.started = threading.Semaphore(0)
+    tts.finish = threading.Event()
+
+    def render(text):
+        tts.started.release()
+        tts.finish.wait(5)
+        return WAV
+
+    tts._render_espeak = render
+    return tts
+
+
+def test_close_lets_sentences_under_way_finish(slow_tts):
+    results = []
+    workers = [threading.Thread(target=lambda: results.append(slow_tts.create_tts_audio("Hello."))) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    assert slow_tts.started.acquire(timeout=5)
+
+    slow_tts.close()
+    slow_tts.finish.set()
+    for worker in workers:
+        worker.join(5)
+    assert results == [WAV, WAV]
+    with pytest.raises(RuntimeError):
+        slow_tts.create_tts_audio("Too late.")
+
+
+def test_close_when_idle_shuts_down(slow_tts):
+    slow_tts.close()
+    with pytest.raises(RuntimeError):
+        slow_tts.render("Too late.")
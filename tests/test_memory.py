@@ -0,0 +1,61 @@
+import time
+
+from daisy_llm.connection_pool import ConnectionPool
+from daisy_llm.context_handlers import Role
+from daisy_llm.memory import MemoryStore
+
+from conftest import fake_embed
+
+
+def test_memory_is_off_by_default(make_handlers):
+    ch = make_handlers()
+    ch.add_message_object(Role.user, "apples and pears")
+    assert ch.memory is None
+    assert ch.search_memories("apples") == []
+    assert ch.get_memory_context("apples") == []
+    assert ch.index_memories() == 0
+
+
+def test_memory_is_enabled_from_the_config(tmp_path, db_path):
+    from daisy_llm.context_handlers import ContextHandlers
+
+    configs = tmp_path / "configs.yaml"
+    configs.write_text("memory:\n  enabled: true\n")
+    ch = ContextHandlers(db_path, conversation_id="conversation-1", configs_yaml=str(configs))
+    assert ch.memory is not None
+    assert ch.memory.thread is None  # Started by the first message
+
+
+def test_replaced_summary_leaves_the_matrix(db_path):
+    memory = MemoryStore(ConnectionPool(db_path), fake_embed)
+    memory.create_memories_table_if_not_exists()
+    memory._store([("conversation-1", None, "summary", "apples apples apples")])
+    assert [m["content"] for m in memory.search("apples")] == ["apples apples apples"]
+
+    memory._store([("conversation-1", None, "summary", "zebra")])
+    assert memory.ids.size == 0
+    assert [m["content"] for m in memory.search("apples", k=5)] == ["zebra"]
+    assert memory.ids.size == 1
+
+
+def test_deleted_conversation_leaves_the_matrix(make_handlers):
+    ch = make_handlers(embed_fn=fake_embed)
+    ch.memory.create_memories_table_if_not_exists()
+    ch.memory._store([("conversation-2", "2024-01-01 00:00:00", "user", "apples")])
+    assert len(ch.search_memories("apples")) == 1
+    ch.delete_conversation_by_id("conversation-2")
+    assert ch.memory.ids.size == 0
+    assert ch.search_memories("apples") == []
+
+
+def test_embedding_thread_returns_its_connection_when_idle(db_path):
+    pool = ConnectionPool(db_path, max_connections=1, timeout=5)
+    memory = MemoryStore(pool, fake_embed)
+    memory.enqueue("conversation-1", "2024-01-01 00:00:00", "user", "apples")
+
+    # Only one connection, so this waits for the embedding thread to give it back
+    deadline = time.monotonic() + 5
+    while memory.get_indexed_conversation_ids() != ["conversation-1"]:
+        pool.release_connection()
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
@@ -0,0 +1,83 @@
+import pytest
+
+from daisy_llm.context_handlers import Role
+from daisy_llm.message_store import MessageStore, epoch_to_timestamp, timestamp_to_epoch
+
+TIMESTAMPS = [
+    "2023-05-01 10:00:00",
+    "2023-05-01T10:00:00.123+00:00",
+    "2023-05-01T10:00:00",
+    "05/01/2023",
+    "yesterday",
+    None,
+]
+
+
+@pytest.mark.parametrize("timestamp", TIMESTAMPS)
+def test_timestamps_round_trip(timestamp):
+    store = MessageStore([{"timestamp": timestamp, "role": "user", "content": "hi"}])
+    assert store[0]["timestamp"] == timestamp
+    assert store.timestamp_at(0) == timestamp
+
+
+def test_epoch_is_only_used_when_exact():
+    assert epoch_to_timestamp(timestamp_to_epoch("2023-05-01 10:00:00")) == "2023-05-01 10:00:00"
+    assert timestamp_to_epoch("2023-05-01T10:00:00.123+00:00") is None
+    assert timestamp_to_epoch("05/01/2023") is None
+
+
+def test_timestamps_survive_insert_delete_and_set():
+    store = MessageStore([{"timestamp": "05/01/2023", "role": "user", "content": "a"}])
+    other = MessageStore([{"timestamp": "2023-05-01T10:00:00.5+02:00", "role": "assistant", "content": "b"}])
+    store.insert_store(0, other)
+    store.append({"timestamp": "2023-05-02 09:30:00", "role": "user", "content": "c"})
+    assert [m["timestamp"] for m in store] == ["2023-05-01T10:00:00.5+02:00", "05/01/2023", "2023-05-02 09:30:00"]
+
+    del store[0]
+    store.set_timestamp(1, "later")
+    store[0] = {"timestamp": "2023-05-03 08:00:00", "role": "user", "content": "a2"}
+    assert [m["timestamp"] for m in store] == ["2023-05-03 08:00:00", "later"]
+    assert [m["content"] for m in store] == ["a2", "c"]
+
+
+def test_stored_timestamps_are_kept_through_a_rewrite(make_handlers):
+    ch = make_handlers()
+    with ch.connection_pool.get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO messages (conversation_id, timestamp, role, message) VALUES (?, ?, ?, ?)",
+            [
+                ("conversation-1", "2023-05-01T10:00:00.123+00:00", "user", "one"),
+                ("conversation-1", "05/01/2023", "assistant", "two"),
+            ],
+        )
+    ch.load_context()
+
+    # Rewrites every row of the conversation
+    ch.add_message_object_at_start(Role.system, "start")
+
+    reloaded = make_handlers()
+    assert [m["timestamp"] for m in reloaded.get_context()][1:] == ["2023-05-01T10:00:00.123+00:00", "05/01/2023"]
+
+
+def test_messages_without_a_timestamp_can_be_saved(make_handlers):
+    ch = make_handlers()
+    ch.messages.append({"timestamp": None, "role": "user", "content": "no time"})
+    ch.save_context()
+
+    reloaded = make_handlers()
+    assert [m["content"] for m in reloaded.get_context()] == ["no time"]
+
+
+def test_raw_timestamps_are_dropped_with_their_messages():
+    store = MessageStore()
+    for i in range(10):
+        store.append({"timestamp": f"day {i}", "role": "user", "content": str(i)})
+    store.pop(0)
+    del store[0]
+    store.set_timestamp(0, "2023-05-01 10:00:00")
+    store[1] = {"timestamp": "another day", "role": "user", "content": "x"}
+    assert len(store._raw_timestamps) == 7
+    assert [m["timestamp"] for m in store][:3] == ["2023-05-01 10:00:00", "another day", "day 4"]
+
+    store.set_content(0, "a much longer first message")
+    assert [m["content"] for m in store][:3] == ["a much longer first message", "x", "4"]
@@ -0,0 +1,68 @@
+import struct
+
+import numpy as np
+
+from daisy_llm.dsp_worker import process_clip
+from daisy_llm.pcm import PcmClip, apply_volume, convert_format, decode_audio, parse_wav_header
+
+
+def tone(frames=1000, channels=1):
+    samples = (np.sin(np.arange(frames * channels) / 5) * 20000).astype(np.int16)
+    return PcmClip(samples, channels, 16000)
+
+
+def test_apply_volume_does_not_change_the_input():
+    samples = tone().samples.copy()
+    original = samples.copy()
+    once = apply_volume(samples, 0.5)
+    twice = apply_volume(samples, 0.5)
+    np.testing.assert_array_equal(samples, original)
+    np.testing.assert_array_equal(once, twice)
+    np.testing.assert_array_equal(once, (original * 0.5).astype(np.int16))
+
+
+def test_apply_volume_in_place():
+    samples = tone().samples.copy()
+    assert apply_volume(samples, 0.5, in_place=True) is samples
+    assert apply_volume(samples, 1.0) is samples
+
+
+def test_apply_volume_clips_when_louder():
+    samples = np.array([20000, -20000, 100], dtype=np.int16)
+    np.testing.assert_array_equal(apply_volume(samples, 2.0), [32767, -32768, 200])
+
+
+def test_replayed_clip_keeps_its_volume():
+    clip = tone()
+    clip.samples = clip.samples.copy()  # Writable, like a clip the caller decoded into its own buffer
+    first = process_clip(clip, volume=0.5)
+    second = process_clip(clip, volume=0.5)
+    np.testing.assert_array_equal(first.samples, second.samples)
+
+
+def test_wav_round_trip():
+    clip = tone(channels=2)
+    decoded = decode_audio(clip.to_wav())
+    assert (decoded.channels, decoded.sample_rate) == (2, 16000)
+    np.testing.assert_array_equal(decoded.samples, clip.samples)
+
+
+def test_parse_wav_header_rejects_zero_channels():
+    data = bytearray(tone().to_wav())
+    struct.pack_into("<H", data, 22, 0)  # fmt channels
+    assert parse_wav_header(bytes(data)) is None
+
+
+def test_parse_wav_header_rejects_other_formats():
+    assert parse_wav_header(b"ID3" + bytes(100)) is None
+    data = bytearray(tone().to_wav())
+    struct.pack_into("<H", data, 34, 8)  # fmt bits per sample
+    assert parse_wav_header(bytes(data)) is None
+
+
+def test_convert_format():
+    stereo = np.array([100, 300, -100, -300], dtype=np.int16)
+    np.testing.assert_array_equal(convert_format(stereo, 2, 16000, 1, 16000), [200, -200])
+    mono = np.array([1, 2], dtype=np.int16)
+    np.testing.assert_array_equal(convert_format(mono, 1, 16000, 2, 16000), [1, 1, 2, 2])
+    assert len(convert_format(tone().samples, 1, 16000, 1, 8000)) == 500
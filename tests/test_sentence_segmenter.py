@@ -0,0 +1,62 @@
+import pytest
+
+from daisy_llm import sentence_segmenter
+from daisy_llm.sentence_segmenter import PunktSegmenter, RuleSegmenter, create_segmenter, find_punkt, load_punkt
+from daisy_llm.speech_chunker import SpeechChunker
+
+SENTENCES = ["Dr. Smith will see you now.", "It costs $3.50 at the store.", "Is it raining?", "Yes!"] * 25
+RESPONSE = " ".join(SENTENCES)
+
+
+class CountingTokenizer:
+    # Stands in for the punkt model: splits with the rules and counts the characters it is given
+    def __init__(self):
+        self.tokenized = 0
+
+    def span_tokenize(self, text):
+        self.tokenized += len(text)
+        segmenter = RuleSegmenter()
+        segmenter.update(text)
+        start = 0
+        for end in segmenter.boundaries + [len(text)]:
+            start += len(text[start:end]) - len(text[start:end].lstrip())
+            if start < end:
+                yield start, end
+            start = end
+
+    def tokenize(self, text):
+        return [text[start:end] for start, end in self.span_tokenize(text)]
+
+
+@pytest.fixture
+def tokenizer(monkeypatch):
+    tokenizer = CountingTokenizer()
+    monkeypatch.setattr(sentence_segmenter, "find_punkt", lambda language="english": tokenizer)
+    return tokenizer
+
+
+@pytest.mark.parametrize("step", [4, 200, len(RESPONSE)])
+def test_punkt_streaming_tokenizes_each_sentence_a_bounded_number_of_times(tokenizer, step):
+    chunker = SpeechChunker(segmenter=PunktSegmenter())
+    chunks = []
+    for end in range(step, len(RESPONSE) + step, step):
+        chunks += chunker.feed(RESPONSE[:end])
+    chunks += chunker.finish(RESPONSE)
+    assert chunks == SENTENCES
+    # Only the last, unfinished sentence is tokenized again, however much text arrives at once
+    assert tokenizer.tokenized < 5 * len(RESPONSE)
+
+
+def test_punkt_starts_over_on_other_text(tokenizer):
+    segmenter = PunktSegmenter()
+    assert segmenter.next_boundary("One here. Two here. Three") == len("One here.")
+    assert segmenter.next_boundary("Four here. Five") == len("Four here.")
+
+
+def test_missing_punkt_is_looked_for_once():
+    find_punkt.cache_clear()
+    for _ in range(3):
+        with pytest.raises(LookupError):
+            load_punkt("no-such-language")
+    assert find_punkt.cache_info().misses == 1
+    assert isinstance(create_segmenter("punkt", "no-such-language"), RuleSegmenter)
@@ -0,0 +1,143 @@
+import threading
+import time
+
+from daisy_llm.connection_pool import ConnectionPool
+from daisy_llm.context_handlers import Role
+from daisy_llm.session_manager import SessionManager
+
+from conftest import fake_embed
+
+
+def run_in_thread(target, *args):
+    thread = threading.Thread(target=target, args=args)
+    thread.start()
+    thread.join()
+
+
+def test_connections_are_reused_after_their_thread_ends(db_path):
+    pool = ConnectionPool(db_path, max_connections=2, timeout=1)
+    errors = []
+
+    def request():
+        try:
+            pool.get_connection().execute("SELECT 1").fetchone()
+        except Exception as e:
+            errors.append(e)
+
+    for _ in range(20):
+        run_in_thread(request)
+    assert errors == []
+    assert len(pool.connections) <= 2
+
+
+def test_release_connection_frees_the_slot(db_path):
+    pool = ConnectionPool(db_path, max_connections=1, timeout=0.1)
+    pool.get_connection()
+    pool.release_connection()
+    run_in_thread(lambda: pool.get_connection())
+    assert len(pool.connections) == 1
+
+
+def test_thread_per_request_sessions(db_path):
+    manager = SessionManager(db_path, max_resident=2, max_connections=3, embed_fn=fake_embed)
+    errors = []
+
+    def request(conversation_id, i):
+        try:
+            with manager.session(conversation_id) as ch:
+                ch.add_message_object(Role.user, f"message {i}")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=request, args=(f"conversation-{i % 4}", i)) for i in range(24)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+    manager.close()
+    with manager.session("conversation-0") as ch:
+        assert len(ch.get_context()) == 6
+
+
+def test_spill_waits_for_the_session_in_use(db_path):
+    manager = SessionManager(db_path, max_resident=1, embed_fn=fake_embed)
+    in_use = threading.Event()
+    release = threading.Event()
+    order = []
+
+    def use():
+        with manager.session("a") as ch:
+            in_use.set()
+            release.wait(5)
+            ch.messages.append({"timestamp": "2024-01-01 00:00:00", "role": "user", "content": "late"})
+            order.append("used")
+
+    user = threading.Thread(target=use)
+    user.start()
+    in_use.wait(5)
+
+    def evict():
+        manager.get_session("b")  # Evicts "a", spilling waits for the user to finish
+        order.append("evicted")
+
+    evicter = threading.Thread(target=evict)
+    evicter.start()
+    time.sleep(0.1)
+    assert "a" in manager.resident_conversation_ids()
+    release.set()
+    user.join()
+    evicter.join()
+
+    assert order == ["used", "evicted"]
+    assert "a" not in manager.resident_conversation_ids()
+    with manager.session("a") as ch:
+        assert [m["content"] for m in ch.get_context()] == ["late"]
+
+
+def test_a_slow_load_only_holds_up_its_own_conversation(db_path, monkeypatch):
+    from daisy_llm.context_handlers import ContextHandlers
+
+    manager = SessionManager(db_path)
+    manager.get_session("fast")
+    manager.close()
+    release = threading.Event()
+    load_context = ContextHandlers.load_context
+
+    def slow_load(self, *args, **kwargs):
+        if self.conversation_id == "slow":
+            assert release.wait(5)
+        return load_context(self, *args, **kwargs)
+
+    monkeypatch.setattr(ContextHandlers, "load_context", slow_load)
+    handles = []
+    loaders = [threading.Thread(target=lambda: handles.append(manager.get_session("slow"))) for _ in range(2)]
+    for loader in loaders:
+        loader.start()
+    time.sleep(0.05)
+
+    start = time.monotonic()
+    assert manager.get_session("fast").conversation_id == "fast"
+    manager.close_session("fast")
+    assert time.monotonic() - start < 1
+
+    release.set()
+    for loader in loaders:
+        loader.join(5)
+    assert len(handles) == 2 and handles[0] is handles[1]
+    assert manager.loading == {}
+
+
+def test_new_conversation_rekeys_a_managed_handle(db_path):
+    manager = SessionManager(db_path)
+    with manager.session("first") as ch:
+        ch.add_message_object(Role.user, "hello")
+        ch.new_conversation()
+        second = ch.conversation_id
+    assert manager.resident_conversation_ids() == [second]
+    assert manager.get_session(second) is ch
+    assert manager.get_session("first") is not ch
+    assert [m["content"] for m in manager.get_session("first").get_context()] == ["hello"]
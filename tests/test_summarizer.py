@@ -0,0 +1,141 @@
+import json
+import threading
+import time
+
+from daisy_llm.context_handlers import Role
+from daisy_llm.summarizer import ConversationSummarizer
+
+
+class FakeChat:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.threads = set()
+
+    def request(self, messages, **kwargs):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.threads.add(threading.get_ident())
+        time.sleep(0.01)
+        with self.lock:
+            self.active -= 1
+        return json.dumps({"name": "Name", "summary": " ".join(m["content"] for m in messages[:-1])})
+
+
+def add_conversations(ch, count):
+    for i in range(count):
+        ch.conversation_id = f"conversation-{i}"
+        ch.load_context()
+        ch.add_message_object(Role.user, f"hello {i}")
+
+
+def test_workers_take_turns_with_the_shared_chat(make_handlers):
+    ch = make_handlers()
+    add_conversations(ch, 8)
+    ch.chat = FakeChat()
+    summarizer = ConversationSummarizer(ch, max_workers=4, requests_per_minute=0)
+    assert summarizer.run(progress=False) == 8
+    assert ch.chat.max_active == 1
+
+
+def test_each_worker_gets_its_own_chat(make_handlers):
+    ch = make_handlers()
+    add_conversations(ch, 8)
+    chats = []
+
+    def chat_factory():
+        chats.append(FakeChat())
+        return chats[-1]
+
+    summarizer = ConversationSummarizer(ch, max_workers=4, requests_per_minute=0, chat_factory=chat_factory)
+    assert summarizer.run(progress=False) == 8
+    assert 1 <= len(chats) <= 4
+    assert all(len(chat.threads) == 1 and chat.max_active == 1 for chat in chats)
+
+
+def test_empty_conversations_are_only_deleted_when_asked(make_handlers):
+    ch = make_handlers()
+    add_conversations(ch, 1)
+    with ch.connection_pool.get_connection() as conn:
+        conn.execute("INSERT INTO conversations (id, name, summary) VALUES ('empty', 'No name', 'No summary')")
+    ch.chat = FakeChat()
+    summarizer = ConversationSummarizer(ch, requests_per_minute=0)
+
+    summarizer.run(progress=False)
+    assert "empty" in ch.get_conversation_ids()
+    assert summarizer.get_pending_conversation_ids() == []
+
+    summarizer.run(["empty"], resume=False, progress=False, delete_empty=True)
+    assert "empty" not in ch.get_conversation_ids()
+
+
+class RecordingChat(FakeChat):
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+
+    def request(self, messages, **kwargs):
+        self.requests.append([m["content"] for m in messages[:-1]])
+        return super().request(messages, **kwargs)
+
+
+def test_edited_messages_are_not_summarized_again(make_handlers):
+    ch = make_handlers()
+    for content in ("one", "two", "three"):
+        ch.add_message_object(Role.user, content)
+    ch.chat = RecordingChat()
+    summarizer = ConversationSummarizer(ch, requests_per_minute=0)
+    summarizer.run(progress=False)
+
+    # Another conversation writes in between, so the rewritten rows get new rowids
+    other = make_handlers("conversation-2")
+    other.add_message_object(Role.user, "elsewhere")
+    summarizer.mark_summarized("conversation-2", other.message_rowids[-1])
+
+    ch.update_message_at_index("TWO", 1)
+    assert summarizer.get_pending_conversation_ids() == []
+
+    ch.delete_message_at_index(0)
+    ch.add_message_object(Role.user, "four")
+    ch.chat.requests.clear()
+    summarizer.run(progress=False)
+    # Only the new message is sent, after the current summary
+    assert len(ch.chat.requests) == 1
+    assert ch.chat.requests[0][1:] == ["four"]
+
+
+def test_scheduler_waits_for_every_handle_to_be_idle(make_handlers):
+    from daisy_llm.summarizer import SummaryScheduler, get_last_activity
+
+    ch = make_handlers()
+    ch.last_activity -= 120
+    scheduler = SummaryScheduler(ch, idle_seconds=60)
+    other = make_handlers("conversation-2")
+    other.add_message_object(Role.user, "busy")
+    assert get_last_activity(ch.db_path) >= other.last_activity
+    assert not scheduler.is_idle()
+    assert SummaryScheduler(ch, idle_seconds=0).is_idle()
+
+
+def test_default_clients_request_side_by_side(make_handlers, monkeypatch):
+    import openai
+
+    ch = make_handlers()
+    add_conversations(ch, 4)
+    both_in_flight = threading.Barrier(2, timeout=5)  # Broken if requests are made one at a time
+    keys = []
+
+    class FakeCompletion:
+        @staticmethod
+        def create(messages, **kwargs):
+            keys.append(kwargs.get("api_key"))
+            both_in_flight.wait()
+            content = json.dumps({"name": "Name", "summary": messages[0]["content"]})
+            return {"choices": [{"message": {"content": content}}]}
+
+    monkeypatch.setattr(openai, "ChatCompletion", FakeCompletion, raising=False)
+    ch.update_conversation_name_summary(update_all=True, max_workers=2, requests_per_minute=0)
+    assert len(keys) == 4
+    assert {name for _, name, _ in ch.get_conversation_name_summary()} == {"Name"}
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from daisy_llm.pcm import PcmClip
+from daisy_llm.time_stretch import time_stretch, time_stretch_clip
+
+SAMPLE_RATE = 24000
+PITCH_HZ = 180.0
+
+
+def voice(seconds=2.0, channels=1):
+    # Harmonics of a fixed pitch with a syllable-like amplitude envelope
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    signal = sum(np.sin(2 * np.pi * PITCH_HZ * n * t) / n for n in range(1, 6))
+    envelope = 0.55 + 0.45 * np.sin(2 * np.pi * 3.0 * t)
+    samples = (signal * envelope * 8000).astype(np.int16)
+    return np.repeat(samples, channels)
+
+
+def dominant_hz(samples):
+    spectrum = np.abs(np.fft.rfft(samples.astype(np.float64) * np.hanning(len(samples))))
+    return np.argmax(spectrum) * SAMPLE_RATE / len(samples)
+
+
+@pytest.mark.parametrize("speed", [0.8, 1.25, 1.5, 2.0])
+def test_duration_is_exact_and_pitch_is_kept(speed):
+    samples = voice()
+    stretched = time_stretch(samples, 1, SAMPLE_RATE, speed)
+    assert stretched.dtype == np.int16
+    assert len(stretched) == round(len(samples) / speed)
+    assert abs(dominant_hz(stretched) - PITCH_HZ) < 1.0
+
+
+def test_coarse_search_matches_a_full_rate_search():
+    samples = voice()
+    coarse = time_stretch(samples, 1, SAMPLE_RATE, 1.5).astype(np.float64)
+    full = time_stretch(samples, 1, SAMPLE_RATE, 1.5, search_rate=SAMPLE_RATE).astype(np.float64)
+    assert np.sqrt(np.mean((coarse - full) ** 2)) < 0.05 * np.sqrt(np.mean(full**2))
+
+
+def test_stereo_keeps_channels_together():
+    stretched = time_stretch(voice(channels=2), 2, SAMPLE_RATE, 1.5)
+    frames = stretched.reshape(-1, 2)
+    assert len(frames) == round(2.0 * SAMPLE_RATE / 1.5)
+    np.testing.assert_array_equal(frames[:, 0], frames[:, 1])
+
+
+def test_speed_one_and_empty_input_are_returned_as_is():
+    samples = voice(0.1)
+    assert time_stretch(samples, 1, SAMPLE_RATE, 1.0) is samples
+    empty = np.zeros(0, np.int16)
+    assert time_stretch(empty, 1, SAMPLE_RATE, 1.5) is empty
+    clip = PcmClip(samples, 1, SAMPLE_RATE)
+    assert time_stretch_clip(clip, 1.0) is clip
+
+
+def test_short_input_is_stretched():
+    samples = voice(0.01)  # Shorter than a frame
+    assert len(time_stretch(samples, 1, SAMPLE_RATE, 2.0)) == round(len(samples) / 2.0)
+
+
+def test_speed_must_be_positive():
+    with pytest.raises(ValueError):
+        time_stretch(voice(0.1), 1, SAMPLE_RATE, 0)
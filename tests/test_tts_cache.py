@@ -0,0 +1,44 @@
+import os
+import time
+
+from daisy_llm import tts_cache
+from daisy_llm.tts_cache import TtsCache, default_cache_directory
+
+
+def test_default_directory_is_the_user_cache(monkeypatch, tmp_path):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    assert default_cache_directory() == os.path.join(str(tmp_path), "daisy_llm", "tts")
+    assert TtsCache().directory is None  # Memory only unless a directory is given
+
+
+def test_left_over_temp_files_are_removed_on_start(tmp_path):
+    cache = TtsCache(str(tmp_path))
+    key = TtsCache.key("Hello", "voice", 1.0)
+    cache.put(key, b"audio")
+
+    bucket = tmp_path / key[:2]
+    stale = bucket / "crashed.tmp"
+    stale.write_bytes(b"partial")
+    old = time.time() - tts_cache.STALE_TEMP_SECONDS - 1
+    os.utime(stale, (old, old))
+    writing = bucket / "writing.tmp"  # Another process may still be writing this one
+    writing.write_bytes(b"partial")
+
+    reopened = TtsCache(str(tmp_path))
+    assert not stale.exists()
+    assert writing.exists()
+    assert reopened.get(key) == b"audio"
+
+
+def test_a_file_removed_during_a_read_is_a_miss(monkeypatch, tmp_path):
+    TtsCache(str(tmp_path)).put(TtsCache.key("Hello", "voice", 1.0), b"audio")
+    cache = TtsCache(str(tmp_path))
+    key = TtsCache.key("Hello", "voice", 1.0)
+
+    def removed(path, *args):
+        os.remove(path)  # Evicted by another process between the read and the timestamp
+
+    monkeypatch.setattr(tts_cache.os, "utime", removed)
+    assert cache.get(key) is None
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["disk_entries"] == 0
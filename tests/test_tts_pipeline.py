@@ -0,0 +1,46 @@
+import time
+
+import numpy as np
+import requests
+
+from daisy_llm.pcm import PcmClip
+from daisy_llm.tts_pipeline import TtsPipeline
+
+
+ERROR_WAV = PcmClip(np.zeros(1600, dtype=np.int16), 1, 16000).to_wav()
+
+
+class FailingCsp:
+    def __init__(self, error):
+        self.error = error
+        self.spoken = []
+
+    def create_tts_audio(self, text):
+        raise self.error
+
+    def create_error_audio(self, message):
+        self.spoken.append(message)
+        return ERROR_WAV
+
+
+def test_tts_errors_are_spoken_once_per_response():
+    csp = FailingCsp(requests.exceptions.HTTPError("401"))
+    pipeline = TtsPipeline(csp)
+    try:
+        first = pipeline.synthesize(("Hello there.", time.perf_counter()), 1.0)
+        second = pipeline.synthesize(("How are you?", time.perf_counter()), 1.0)
+    finally:
+        pipeline.cancel()
+    assert first is not None and first[0] == ERROR_WAV
+    assert second is None
+    assert csp.spoken == ["HTTP Error. Error creating TTS audio. Please check your TTS account."]
+
+
+def test_connection_errors_are_spoken():
+    csp = FailingCsp(requests.exceptions.ConnectionError())
+    pipeline = TtsPipeline(csp)
+    try:
+        pipeline.synthesize(("Hello there.", time.perf_counter()), 1.0)
+    finally:
+        pipeline.cancel()
+    assert csp.spoken == ["Connection Error. Error creating TTS audio. Please check your TTS account."]
@@ -0,0 +1,66 @@
+import random
+import threading
+import time
+
+import numpy as np
+
+from daisy_llm.audio_output import get_audio_output
+from daisy_llm.cancellation import CancellationToken
+from daisy_llm.pcm import PcmClip
+from daisy_llm.SoundManager import SoundManager
+from daisy_llm.tts_pipeline import TtsPipeline
+
+# Measures stop-to-silence latency: the time from the stop token being set, in the middle of a
+# spoken response, to the output callback handing the device silence. Also reports how long the
+# pipeline takes to return, while a sentence is still being synthesized. Needs an audio device.
+# Usage: python utils/benchmark_barge_in.py [runs]
+
+SAMPLE_RATE = 24000
+RUNS = 20
+SENTENCE_SECONDS = 1.0
+SYNTHESIS_SECONDS = 0.4
+
+
+class SimulatedSpeech:
+    tts_speed = 1.0
+
+    def __init__(self):
+        self.sounds = SoundManager()
+
+    def create_tts_audio(self, text):
+        time.sleep(SYNTHESIS_SECONDS)
+        t = np.arange(int(SENTENCE_SECONDS * SAMPLE_RATE)) / SAMPLE_RATE
+        return PcmClip((np.sin(2 * np.pi * 220 * t) * 3000).astype(np.int16), 1, SAMPLE_RATE).to_wav()
+
+
+def run_once(speech):
+    token = CancellationToken()
+    pipeline = TtsPipeline(speech, token, parallelism=1)
+    for i in range(6):
+        pipeline.put_sentence(f"Sentence number {i}.")
+    pipeline.end()
+
+    stop_after = SYNTHESIS_SECONDS + random.uniform(0.1, 2 * SENTENCE_SECONDS)
+    threading.Timer(stop_after, token.set).start()
+    pipeline.run()
+    return (time.perf_counter() - token.cancelled_at) * 1000
+
+
+def main(runs=RUNS):
+    speech = SimulatedSpeech()
+    output = get_audio_output()
+    returns_ms = [run_once(speech) for _ in range(runs)]
+    silence_ms = output.stop_latencies_ms
+    if output.stream is not None and hasattr(output.stream, "get_output_latency"):
+        print(f"Device output latency: {output.stream.get_output_latency() * 1000:.1f} ms (not included below)")
+    print(
+        f"Stop to silence over {len(silence_ms)} stops: "
+        f"mean {sum(silence_ms) / max(1, len(silence_ms)):.1f} ms, max {max(silence_ms, default=0):.1f} ms"
+    )
+    print(f"Stop to pipeline return: mean {sum(returns_ms) / runs:.1f} ms, max {max(returns_ms):.1f} ms")
+
+
+if __name__ == "__main__":
+    import sys
+
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else RUNS)
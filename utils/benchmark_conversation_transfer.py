@@ -0,0 +1,73 @@
+import os
+import random
+import resource
+import sqlite3
+import string
+import sys
+import tempfile
+
+from daisy_llm.context_handlers import ContextHandlers
+
+# Measures JSONL export and import throughput, and peak memory, for a store of 1M messages.
+# Usage: python utils/benchmark_conversation_transfer.py [num_messages]
+
+NUM_MESSAGES = 1000000
+MESSAGES_PER_CONVERSATION = 100
+
+
+def fill_database(db_path, num_messages):
+    random.seed(0)
+    words = ["".join(random.choices(string.ascii_lowercase, k=random.randint(2, 9))) for _ in range(2000)]
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE messages (conversation_id TEXT NOT NULL, timestamp TEXT NOT NULL, role TEXT NOT NULL, message TEXT NOT NULL)")
+    conn.execute("CREATE TABLE conversations (id TEXT PRIMARY KEY, name TEXT NOT NULL, summary TEXT NOT NULL)")
+    num_conversations = max(1, num_messages // MESSAGES_PER_CONVERSATION)
+    conn.executemany(
+        "INSERT INTO conversations VALUES (?, ?, ?)",
+        ((f"conv-{i}", f"Conversation {i}", "A benchmark conversation") for i in range(num_conversations)),
+    )
+    conn.executemany(
+        "INSERT INTO messages VALUES (?, ?, ?, ?)",
+        (
+            (
+                f"conv-{i // MESSAGES_PER_CONVERSATION}",
+                "2023-05-01 12:%02d:%02d" % (i // 60 % 60, i % 60),
+                "user" if i % 2 == 0 else "assistant",
+                " ".join(random.choices(words, k=random.randint(5, 60))),
+            )
+            for i in range(num_messages)
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+def run(label, function):
+    stats = function()
+    # Peak resident memory of the process so far; it should stay flat as num_messages grows
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(
+        f"{label:<22} {stats['messages']:>9} messages  {stats['seconds']:7.2f} s  "
+        f"{stats['messages'] / stats['seconds']:>10,.0f} messages/s  peak RSS {peak / 1024:6.1f} MiB"
+    )
+
+
+def main():
+    num_messages = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_MESSAGES
+    with tempfile.TemporaryDirectory() as tmp:
+        source_db = os.path.join(tmp, "source.db")
+        print(f"Creating {num_messages} messages...")
+        fill_database(source_db, num_messages)
+        source = ContextHandlers(source_db, conversation_id="conv-0", configs_yaml=None)
+
+        for compression, extension in (("none", ".jsonl"), ("gzip", ".jsonl.gz")):
+            path = os.path.join(tmp, "export" + extension)
+            run(f"export ({compression})", lambda: source.export_conversations(path))
+            print(f"{'':<22} file size {os.path.getsize(path) / 1024 / 1024:.1f} MiB")
+
+            target = ContextHandlers(os.path.join(tmp, f"target-{compression}.db"), conversation_id="conv-0", configs_yaml=None)
+            run(f"import ({compression})", lambda: target.import_conversations(path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import threading
+import time
+
+import numpy as np
+
+from daisy_llm.dsp_worker import DspWorker, process_clip
+from daisy_llm.pcm import PcmClip
+
+# Processes TTS-like clips (24 kHz mono, speed 1.25, volume 0.8, converted to 48 kHz stereo) in
+# this process and in the DSP worker, while a pure-Python thread keeps the GIL busy as the
+# network and text threads do. A probe thread asks to wake every 10 ms, as the audio callback
+# does, and its lateness is reported as jitter.
+# Usage: python utils/benchmark_dsp_worker.py [clips]
+
+SAMPLE_RATE = 24000
+CLIP_SECONDS = 3.0
+CLIPS = 40
+PERIOD = 0.010
+
+
+def make_clip():
+    t = np.arange(int(CLIP_SECONDS * SAMPLE_RATE)) / SAMPLE_RATE
+    return PcmClip((np.sin(2 * np.pi * 220 * t) * 8000).astype(np.int16), 1, SAMPLE_RATE)
+
+
+def cpu_load(stop):
+    while not stop.is_set():
+        sum(i * i for i in range(1000))
+
+
+def probe(stop, lateness):
+    deadline = time.perf_counter() + PERIOD
+    while not stop.is_set():
+        time.sleep(max(0.0, deadline - time.perf_counter()))
+        now = time.perf_counter()
+        lateness.append((now - deadline) * 1000)
+        deadline = max(deadline + PERIOD, now)
+
+
+def run(name, process, clips):
+    stop = threading.Event()
+    lateness = []
+    threads = [threading.Thread(target=cpu_load, args=(stop,)), threading.Thread(target=probe, args=(stop, lateness))]
+    for thread in threads:
+        thread.start()
+    start = time.perf_counter()
+    for clip in clips:
+        process(clip)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for thread in threads:
+        thread.join()
+    p50, p99 = np.percentile(lateness, [50, 99])
+    print(
+        f"{name:11s} {len(clips) / elapsed:6.1f} clips/s   "
+        f"jitter p50 {p50:5.2f} ms  p99 {p99:6.2f} ms  max {max(lateness):6.2f} ms"
+    )
+
+
+def main(count=CLIPS):
+    clips = [make_clip() for _ in range(count)]
+    run("in-process", lambda clip: process_clip(clip, 1.25, 0.8, 2, 48000), clips)
+    worker = DspWorker()
+    worker.start()
+    worker.process(clips[0], 1.25, 0.8, 2, 48000)  # Warm up the worker's imports
+    try:
+        run("dsp worker", lambda clip: worker.process(clip, 1.25, 0.8, 2, 48000), clips)
+    finally:
+        worker.close()
+
+
+if __name__ == "__main__":
+    import sys
+
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else CLIPS)
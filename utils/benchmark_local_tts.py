@@ -0,0 +1,49 @@
+import statistics
+import sys
+import time
+
+from daisy_llm.local_tts import LocalTts
+from daisy_llm.tts_pipeline import audio_duration
+
+# Renders the same sentences with the local TTS backend, one at a time and then all at once, and
+# reports per-sentence latency and the real-time factor (seconds of rendering per second of audio).
+# Usage: python utils/benchmark_local_tts.py [auto|espeak|pyttsx3]
+
+BACKEND = sys.argv[1] if len(sys.argv) > 1 else "auto"
+SENTENCES = [
+    "The quick brown fox jumps over the lazy dog.",
+    "It is going to rain this afternoon, so take an umbrella.",
+    "Sure.",
+    "The meeting was moved to three thirty on Thursday, in the small conference room.",
+] * 3
+
+
+def main():
+    tts = LocalTts(backend=BACKEND)
+    print(f"Backend: {tts.backend}")
+    tts.create_tts_audio("Warm up.")
+
+    latencies = []
+    audio_seconds = 0.0
+    for sentence in SENTENCES:
+        start = time.perf_counter()
+        audio = tts.create_tts_audio(sentence)
+        latencies.append((time.perf_counter() - start) * 1000)
+        audio_seconds += audio_duration(audio) or 0.0
+    total = sum(latencies) / 1000
+    print(
+        f"sequential: mean {statistics.mean(latencies):.0f} ms, p95 {sorted(latencies)[int(len(latencies) * 0.95)]:.0f} ms, "
+        f"stdev {statistics.stdev(latencies):.0f} ms, real-time factor {total / audio_seconds:.3f}"
+    )
+
+    start = time.perf_counter()
+    futures = [tts.render(sentence) for sentence in SENTENCES]
+    for future in futures:
+        future.result()
+    total = time.perf_counter() - start
+    print(f"all at once: {total * 1000:.0f} ms, real-time factor {total / audio_seconds:.3f}")
+    tts.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import random
+import string
+import tracemalloc
+
+from daisy_llm.message_store import MessageStore
+
+# Compares the memory used per message by the old list-of-dicts context with MessageStore.
+# Usage: python utils/benchmark_message_store.py
+
+NUM_MESSAGES = 100000
+
+
+def make_rows(count):
+    random.seed(0)
+    rows = []
+    for i in range(count):
+        length = random.randint(20, 400)
+        content = "".join(random.choices(string.ascii_letters + " ", k=length))
+        role = "user" if i % 2 == 0 else "assistant"
+        # Fresh strings, as they would come back from sqlite
+        rows.append((i, "2023-05-01 12:%02d:%02d" % (i // 60 % 60, i % 60), role + "", content))
+    return rows
+
+
+def measure(build):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+def build_dicts(rows):
+    messages = []
+    for row in rows:
+        messages.append({
+            "timestamp": "".join(row[1]),
+            "role": "".join(row[2]),
+            "content": "".join(row[3]),
+        })
+    return messages
+
+
+def build_store(rows):
+    store = MessageStore()
+    for row in rows:
+        store.append_values(row[1], row[2], row[3])
+    return store
+
+
+def main():
+    rows = make_rows(NUM_MESSAGES)
+    text_bytes = sum(len(row[3]) for row in rows)
+
+    _, dict_bytes = measure(lambda: build_dicts(rows))
+    _, store_bytes = measure(lambda: build_store(rows))
+
+    print(f"Messages: {NUM_MESSAGES}, average text length: {text_bytes / NUM_MESSAGES:.0f} bytes")
+    print(f"List of dicts: {dict_bytes / NUM_MESSAGES:8.1f} bytes/message")
+    print(f"MessageStore:  {store_bytes / NUM_MESSAGES:8.1f} bytes/message")
+    print(f"Overhead beyond raw text: {(dict_bytes - text_bytes) / NUM_MESSAGES:.1f} -> {(store_bytes - text_bytes) / NUM_MESSAGES:.1f} bytes/message")
+
+
+if __name__ == '__main__':
+    main()
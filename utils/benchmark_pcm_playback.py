@@ -0,0 +1,75 @@
+import io
+import time
+import tracemalloc
+import wave
+
+import numpy as np
+from pydub import AudioSegment
+
+from daisy_llm.pcm import apply_volume, decode_audio
+
+# Compares CPU time and allocated bytes per second of audio between the old SoundManager path
+# (pydub decode, array -> float np.array -> round -> int16 -> _spawn -> raw_data) and the PCM path
+# (in-place WAV view, volume skipped at 1.0 or applied in one pass). The output device is left out.
+# Usage: python utils/benchmark_pcm_playback.py
+
+SECONDS = 10
+SAMPLE_RATE = 24000
+REPEATS = 20
+
+
+def make_wav(seconds, sample_rate):
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    samples = (np.sin(2 * np.pi * 220 * t) * 12000).astype("<i2")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+def old_path(data, volume):
+    sound = AudioSegment.from_file(io.BytesIO(data), format="wav")
+    scaled_volume = volume * 32767
+    sound_array = sound.get_array_of_samples()
+    scaled_array = np.round(scaled_volume * np.array(sound_array) / 32767).astype(np.int16)
+    sound = sound._spawn(scaled_array)
+    return sound.raw_data
+
+
+def new_path(data, volume):
+    clip = decode_audio(data)
+    return apply_volume(clip.samples, volume)
+
+
+def measure(function, data, volume):
+    function(data, volume)  # Warm up
+    start = time.process_time()
+    for _ in range(REPEATS):
+        function(data, volume)
+    cpu = (time.process_time() - start) / REPEATS
+
+    tracemalloc.start()
+    function(data, volume)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu, peak
+
+
+def main():
+    data = make_wav(SECONDS, SAMPLE_RATE)
+    print(f"{SECONDS} s of 16-bit mono audio at {SAMPLE_RATE} Hz ({len(data) / 1024:.0f} KiB)")
+    for volume in (1.0, 0.5):
+        for name, function in (("old", old_path), ("pcm", new_path)):
+            cpu, peak = measure(function, data, volume)
+            print(
+                f"volume {volume:.1f}  {name}  "
+                f"cpu {cpu / SECONDS * 1000:7.3f} ms per audio second  "
+                f"peak allocations {peak / SECONDS / 1024:8.1f} KiB per audio second"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import time
+
+import nltk
+
+from daisy_llm.sentence_segmenter import PunktSegmenter, RuleSegmenter
+from daisy_llm.speech_chunker import SpeechChunker
+
+# Compares nltk.sent_tokenize (the old path, called on the pending text for every streamed chunk)
+# with the cached punkt segmenter and the rule-based segmenter.
+# Accuracy: sentences split exactly as in the hand-split CASES, and agreement with nltk.sent_tokenize.
+# Throughput: a long response streamed a few characters at a time through SpeechChunker.
+# Usage: python utils/benchmark_sentence_segmenter.py
+
+CASES = [
+    ["Dr. Smith will see you now.", "Please bring your card."],
+    ["It costs $3.50 at the store.", "That is cheap."],
+    ["I moved to the U.S. in 2010 and never looked back."],
+    ["Is it raining?", "Yes!", "Take an umbrella."],
+    ["He said \"Stop.\"", "Then he left."],
+    ["Meet me at 5 p.m. tomorrow.", "Don't be late."],
+    ["We need apples, pears, etc. for the pie."],
+    ["The file is at example.com/data.csv today.", "Download it."],
+    ["J. R. R. Tolkien wrote it.", "It is long."],
+    ["Wait... what was that?", "Nothing."],
+    ["Use e.g. the second option.", "It works."],
+    ["Mr. and Mrs. Jones arrived at 7.", "They were early."],
+]
+RESPONSE = " ".join(" ".join(case) for case in CASES * 20)
+STREAM_STEP = 4
+
+
+def accuracy(split):
+    correct = 0
+    for case in CASES:
+        correct += split(" ".join(case)) == case
+    return correct / len(CASES)
+
+
+def agreement(split):
+    expected = nltk.sent_tokenize(RESPONSE)
+    return sum(a == b for a, b in zip(split(RESPONSE), expected)) / len(expected)
+
+
+def stream(make_chunker):
+    chunker = make_chunker()
+    start = time.perf_counter()
+    chunks = []
+    for end in range(STREAM_STEP, len(RESPONSE) + STREAM_STEP, STREAM_STEP):
+        chunks += chunker.feed(RESPONSE[:end])
+    chunks += chunker.finish(RESPONSE)
+    return time.perf_counter() - start, len(chunks)
+
+
+def main():
+    load_start = time.perf_counter()
+    PunktSegmenter()
+    load_ms = (time.perf_counter() - load_start) * 1000
+    start = time.perf_counter()
+    PunktSegmenter()
+    cached_ms = (time.perf_counter() - start) * 1000
+    print(f"punkt load: {load_ms:.1f} ms first, {cached_ms:.3f} ms cached")
+
+    segmenters = [
+        ("nltk.sent_tokenize", nltk.sent_tokenize, lambda: SpeechChunker(tokenize=nltk.sent_tokenize)),
+        ("punkt (cached)", PunktSegmenter().split, lambda: SpeechChunker(segmenter=PunktSegmenter())),
+        ("rules", lambda text: RuleSegmenter().split(text), lambda: SpeechChunker(segmenter=RuleSegmenter())),
+    ]
+    print(f"{len(RESPONSE)} characters streamed {STREAM_STEP} at a time")
+    print(f"{'segmenter':20s} {'accuracy':>8} {'vs nltk':>8} {'stream':>9} {'chars/s':>11} {'chunks':>6}")
+    for name, split, make_chunker in segmenters:
+        seconds, chunks = stream(make_chunker)
+        print(
+            f"{name:20s} {accuracy(split):8.0%} {agreement(split):8.0%} "
+            f"{seconds * 1000:7.1f}ms {len(RESPONSE) / seconds:11.0f} {chunks:6d}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import os
+import time
+
+# Compares the old SoundManager startup (pkg_resources lookup, then every file decoded by pydub,
+# once per instance) with the shared lazy registry: three instances are created, as Chat,
+# ChatSpeechProcessor and a module do, then one sound is played for the first time.
+# Usage: python utils/benchmark_sound_startup.py
+
+INSTANCES = 3
+
+
+def old_startup():
+    start = time.perf_counter()
+    import pkg_resources
+    import pydub
+
+    for _ in range(INSTANCES):
+        directory = pkg_resources.resource_filename("daisy_llm.SoundManager", "sounds")
+        sounds = {}
+        for filename in os.listdir(directory):
+            if filename.endswith(".wav") or filename.endswith(".mp3"):
+                try:
+                    sounds[os.path.splitext(filename)[0]] = pydub.AudioSegment.from_file(os.path.join(directory, filename))
+                except Exception:  # mp3 needs ffmpeg
+                    pass
+    return (time.perf_counter() - start) * 1000
+
+
+def new_startup():
+    start = time.perf_counter()
+    from daisy_llm.SoundManager import SoundManager
+
+    managers = [SoundManager() for _ in range(INSTANCES)]
+    startup = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    managers[0].load_clip("alert")
+    first_use = (time.perf_counter() - start) * 1000
+    return startup, first_use
+
+
+def main():
+    print(f"old: {INSTANCES} instances {old_startup():8.1f} ms (all sounds decoded)")
+    startup, first_use = new_startup()
+    print(f"new: {INSTANCES} instances {startup:8.1f} ms, first use of 'alert' {first_use:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
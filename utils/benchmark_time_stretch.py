@@ -0,0 +1,60 @@
+import sys
+import time
+
+import numpy as np
+from pydub.effects import speedup
+
+from daisy_llm.pcm import PcmClip
+from daisy_llm.time_stretch import time_stretch_clip
+
+# Compares pydub.effects.speedup (the old play time path) with the WSOLA time-stretch on a
+# synthetic voiced signal: throughput as a multiple of real time, duration error, and pitch drift.
+# Usage: python utils/benchmark_time_stretch.py [seconds]
+
+SAMPLE_RATE = 24000
+SECONDS = float(sys.argv[1]) if len(sys.argv) > 1 else 8.0
+PITCH_HZ = 180.0
+SPEEDS = (1.25, 1.5, 2.0)
+
+
+def make_voice(seconds, sample_rate):
+    # Harmonics of a fixed pitch with a syllable-like amplitude envelope
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    signal = sum(np.sin(2 * np.pi * PITCH_HZ * n * t) / n for n in range(1, 6))
+    envelope = 0.55 + 0.45 * np.sin(2 * np.pi * 3.0 * t)
+    samples = (signal * envelope * 8000).astype(np.int16)
+    return PcmClip(samples, 1, sample_rate)
+
+
+def dominant_hz(samples, sample_rate):
+    spectrum = np.abs(np.fft.rfft(samples.astype(np.float64) * np.hanning(len(samples))))
+    return np.argmax(spectrum) * sample_rate / len(samples)
+
+
+def old_path(clip, speed):
+    return PcmClip.from_segment(speedup(clip.to_segment(), speed))
+
+
+def new_path(clip, speed):
+    return time_stretch_clip(clip, speed)
+
+
+def main():
+    clip = make_voice(SECONDS, SAMPLE_RATE)
+    input_hz = dominant_hz(clip.samples, SAMPLE_RATE)
+    print(f"{SECONDS} s of 16-bit mono audio at {SAMPLE_RATE} Hz, pitch {input_hz:.1f} Hz")
+    for speed in SPEEDS:
+        for name, function in (("pydub", old_path), ("wsola", new_path)):
+            start = time.perf_counter()
+            stretched = function(clip, speed)
+            seconds = time.perf_counter() - start
+            expected = SECONDS / speed
+            print(
+                f"speed {speed:4.2f}  {name}  {SECONDS / seconds:7.1f}x real time  "
+                f"duration {stretched.duration:5.2f} s (expected {expected:5.2f})  "
+                f"pitch {dominant_hz(stretched.samples, SAMPLE_RATE):6.1f} Hz"
+            )
+
+
+if __name__ == "__main__":
+    main()
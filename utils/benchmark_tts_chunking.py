@@ -0,0 +1,95 @@
+import threading
+import time
+
+from daisy_llm.speech_chunker import SpeechChunker
+from daisy_llm.tts_pipeline import TtsPipeline
+
+# Reports time to first audio and playback gaps for each chunking policy, with a simulated
+# LLM stream and a simulated TTS module whose latency grows with the length of the text.
+# Usage: python utils/benchmark_tts_chunking.py
+
+RESPONSE = (
+    "Well, that depends on a few things, mostly on how much time you have and what kind of "
+    "weather you are expecting over the weekend, because the northern trail gets muddy after rain. "
+    "If it stays dry, I would take the ridge route. It is longer, but the views are worth it. "
+    "Bring water, a light jacket, and something to eat."
+)
+TOKENS_PER_SECOND = 40
+TTS_BASE_SECONDS = 0.25
+TTS_SECONDS_PER_CHAR = 0.004
+SPEECH_SECONDS_PER_WORD = 0.3
+
+
+def sentence_tokenize(text):
+    try:
+        import nltk
+
+        return nltk.sent_tokenize(text)
+    except LookupError:  # punkt is not downloaded
+        from daisy_llm.sentence_segmenter import RuleSegmenter
+
+        return RuleSegmenter().split(text)
+
+
+class SimulatedSpeech:
+    tts_speed = 1.0
+
+    def __init__(self):
+        self.sounds = self
+        self.playing_until = None
+        self.gaps = 0.0
+        self.chunks = []
+
+    def create_tts_audio(self, text):
+        time.sleep(TTS_BASE_SECONDS + TTS_SECONDS_PER_CHAR * len(text))
+        return text
+
+    def queue_sound(self, text):
+        # Queued speech starts when the speech before it ends, or now if the output has run dry
+        now = time.perf_counter()
+        start = now
+        if self.playing_until is not None:
+            self.gaps += max(0.0, now - self.playing_until)
+            start = max(now, self.playing_until)
+        self.chunks.append(text)
+        self.playing_until = start + SPEECH_SECONDS_PER_WORD * len(text.split())
+        return self.playing_until
+
+    def wait_sound(self, playing_until, stop_event=None):
+        time.sleep(max(0.0, playing_until - time.perf_counter()))
+        return True
+
+
+def run(policy, **kwargs):
+    speech = SimulatedSpeech()
+    chunker = SpeechChunker(policy, tokenize=sentence_tokenize, **kwargs)
+    pipeline = TtsPipeline(speech, parallelism=2, chunker=chunker)
+
+    def stream():
+        text = ""
+        for word in RESPONSE.split(" "):
+            time.sleep(1 / TOKENS_PER_SECOND)
+            text += word + " "
+            pipeline.feed_text(text)
+        pipeline.finish_text(text)
+
+    threading.Thread(target=stream).start()
+    start = time.perf_counter()
+    pipeline.run()
+    total = time.perf_counter() - start
+    print(
+        f"{policy:<9} {str(kwargs):<32} first audio {pipeline.first_audio_ms:6.0f} ms  "
+        f"gaps {speech.gaps * 1000:6.0f} ms  total {total:5.1f} s  chunks {len(speech.chunks)}"
+    )
+
+
+def main():
+    run("sentence")
+    run("clause", min_words=4, growth=2.0)
+    run("clause", min_words=2, growth=1.5)
+    run("words", min_words=5, growth=2.0)
+    run("words", min_words=3, growth=3.0)
+
+
+if __name__ == "__main__":
+    main()
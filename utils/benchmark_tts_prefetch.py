@@ -0,0 +1,88 @@
+import threading
+import time
+
+import numpy as np
+
+from daisy_llm.pcm import PcmClip
+from daisy_llm.tts_pipeline import TtsPipeline, audio_duration
+from daisy_llm.tts_prefetch import PrefetchController
+
+# Plays a long response through the TTS pipeline with synthesis at several real-time factors, once
+# with synthesis running ahead without a bound (the old unbounded queue) and once with the adaptive
+# prefetch controller. Reports underruns (the output running dry between sentences), the peak bytes
+# of audio held ahead of playback and the total time. Time is compressed: audio plays SPEEDUP
+# times faster than real time and synthesis is scaled the same way.
+# Usage: python utils/benchmark_tts_prefetch.py
+
+SAMPLE_RATE = 24000
+SECONDS_PER_CHAR = 1 / 15
+SPEEDUP = 10
+RTFS = [0.05, 0.3, 0.8]
+SENTENCES = [
+    "The quick brown fox jumps over the lazy dog near the river bank.",
+    "A short one.",
+    "Synthesis time depends on the length of the text and on how busy the service is today.",
+    "Then it keeps going for a while, with a few clauses, some numbers like 3.5, and a long tail of words.",
+] * 6
+
+
+class SimulatedSpeech:
+    tts_speed = 1.0
+
+    def __init__(self, rtf, prefetch):
+        self.rtf = rtf
+        self.prefetch = prefetch
+        self.sounds = self
+        self.playing_until = None
+        self.peak_bytes = 0
+
+    def create_tts_audio(self, text):
+        seconds = SECONDS_PER_CHAR * len(text)
+        time.sleep(self.rtf * seconds / SPEEDUP)
+        return PcmClip(np.zeros(int(seconds * SAMPLE_RATE), np.int16), 1, SAMPLE_RATE).to_wav()
+
+    def queue_sound(self, audio):
+        self.peak_bytes = max(self.peak_bytes, self.prefetch.buffered_bytes)
+        now = time.perf_counter()
+        start = now if self.playing_until is None else max(now, self.playing_until)
+        self.playing_until = start + audio_duration(audio) / SPEEDUP
+        return self.playing_until
+
+    def wait_sound(self, playing_until, stop_event=None):
+        time.sleep(max(0.0, playing_until - time.perf_counter()))
+        return True
+
+
+def run(rtf, prefetch):
+    speech = SimulatedSpeech(rtf, prefetch)
+    pipeline = TtsPipeline(speech, max_sentences=len(SENTENCES) + 1, max_audio=len(SENTENCES), prefetch=prefetch)
+    for sentence in SENTENCES:
+        pipeline.put_sentence(sentence)
+    pipeline.end()
+    start = time.perf_counter()
+    pipeline.run()
+    total = time.perf_counter() - start
+    stats = prefetch.stats()
+    return stats["underruns"], speech.peak_bytes, total, stats["target_seconds"]
+
+
+def main():
+    audio_seconds = SECONDS_PER_CHAR * sum(len(sentence) for sentence in SENTENCES)
+    print(f"{len(SENTENCES)} sentences, {audio_seconds:.0f} s of audio played {SPEEDUP}x faster than real time")
+    print(f"{'rtf':>5} {'policy':10s} {'underruns':>9} {'peak ahead':>11} {'total':>8} {'target':>8}")
+    for rtf in RTFS:
+        policies = [
+            ("unbounded", PrefetchController(min_seconds=float("inf"), max_seconds=float("inf"), max_bytes=1 << 40)),
+            ("adaptive", PrefetchController()),
+        ]
+        for name, prefetch in policies:
+            run(rtf, prefetch)  # Learn the rates, as earlier responses would have
+            underruns, peak_bytes, total, target = run(rtf, prefetch)
+            print(
+                f"{rtf:5.2f} {name:10s} {underruns:9d} {peak_bytes / 1024:8.0f} KB "
+                f"{total:7.2f}s {target:7.1f}s"
+            )
+
+
+if __name__ == "__main__":
+    main()